@@ -4,8 +4,13 @@ import threading
 import time
 import json
 import urllib
-from shared import app, FILE_DIR, TORRENT_DIR, TRACKER_PORT, auto_seed_static_files
+from shared import app, FILE_DIR, TORRENT_DIR, TRACKER_PORT
+from seeder import keep_static_files_seeded
+from control import try_lock
+from indexer import chain_indexer
+from prefilter import moderation_filter
 from blueprints.routes import blueprint
+import blueprints.api  # Registers the /api resources on rest_api
 from werkzeug.middleware.proxy_fix import ProxyFix
 from flask_cors import CORS
 
@@ -21,12 +26,21 @@ logging.basicConfig(level=logging.DEBUG)
 os.makedirs(FILE_DIR, exist_ok=True)
 os.makedirs(TORRENT_DIR, exist_ok=True)
 
+# Re-seed the static directory once per host, from whichever worker gets the lock,
+# and keep stopping and resuming files as their magnets are blacklisted or cleared
+if try_lock(app.config["AUTO_SEED_LOCK"]) is not None:
+    threading.Thread(target=keep_static_files_seeded, daemon=True).start()
+
+# Keep the shared moderation pre-filter up to date, from a single worker
+if try_lock(app.config["MODERATION_FILTER_LOCK"]) is not None:
+    threading.Thread(target=moderation_filter.maintain, daemon=True).start()
+
+# Follow the forum contracts into the local index, again from a single worker
+if app.config["CHAIN_INDEXER"] and try_lock(app.config["CHAIN_INDEXER_LOCK"]) is not None:
+    chain_indexer.start()
 
 
 if __name__ == "__main__":
     logging.info("Starting webseed server")
-    
-    # Automatically seed files in the static directory
-    auto_seed_static_files()
 
     app.run(host="0.0.0.0", port=TRACKER_PORT, debug=True)
@@ -0,0 +1,354 @@
+import os
+import math
+import sqlite3
+import time
+import queue
+import shutil
+import logging
+import threading
+from shared import app, FILE_DIR
+from db import Database
+from control import ControlError
+from seeder import seed_engine
+from torrent import build_multi_torrent
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS broadcasts (
+    id INTEGER PRIMARY KEY,
+    stream TEXT NOT NULL,
+    started REAL NOT NULL,
+    ended REAL,
+    duration REAL NOT NULL DEFAULT 0,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    seeding REAL,
+    info_hash TEXT,
+    magnet_url TEXT,
+    torrent_path TEXT
+);
+CREATE INDEX IF NOT EXISTS broadcasts_stream ON broadcasts (stream, started);
+CREATE TABLE IF NOT EXISTS parts (
+    broadcast INTEGER NOT NULL,
+    seq INTEGER NOT NULL,
+    chunk TEXT NOT NULL,
+    offset INTEGER NOT NULL,
+    length INTEGER NOT NULL,
+    duration REAL NOT NULL,
+    discontinuity INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (broadcast, seq)
+) WITHOUT ROWID;
+"""
+
+PLAYLIST = "index.m3u8"
+
+
+def parse_media_playlist(path):
+    """Return (media sequence, [(duration, uri), ...]) for an HLS media playlist."""
+    sequence, entries, duration = 0, [], None
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#EXT-X-MEDIA-SEQUENCE:"):
+                sequence = int(line.split(":", 1)[1])
+            elif line.startswith("#EXTINF:"):
+                duration = float(line.split(":", 1)[1].split(",", 1)[0])
+            elif line and not line.startswith("#") and duration is not None:
+                entries.append((duration, line))
+                duration = None
+    return sequence, entries
+
+
+class Archive:
+    """Past broadcasts kept as VODs under <FILE_DIR>/vod/<stream>/<broadcast id>/.
+
+    Segments are appended to chunk files of about chunk_seconds each as they
+    are archived, and the broadcast's playlist addresses them with
+    EXT-X-BYTERANGE. Earlier playlist entries therefore never change: the
+    playlist is an EVENT playlist viewers can seek back in while the
+    broadcast is live, and becomes a VOD playlist when it ends. Finished
+    broadcasts are deleted once older than max_age seconds, or oldest first
+    while all of them together take more than max_bytes. A VOD is only
+    hashed and seeded when someone asks for it (see seed).
+
+    The stream supervisor writes; every worker can read and seed.
+    """
+
+    def __init__(self, db_path, root, chunk_seconds=60, max_age=7 * 86400, max_bytes=50 * 2 ** 30):
+        self.db = Database(db_path, SCHEMA)
+        self.root = os.path.abspath(root)
+        self.chunk_seconds = chunk_seconds
+        self.max_age = max_age
+        self.max_bytes = max_bytes
+
+    def directory(self, broadcast):
+        return os.path.join(self.root, broadcast["stream"], str(broadcast["id"]))
+
+    def get(self, broadcast_id):
+        row = self.db.query_one("SELECT * FROM broadcasts WHERE id = ?", (broadcast_id,))
+        return dict(row) if row else None
+
+    def broadcasts(self, stream=None, limit=50):
+        """Newest first, optionally for one stream."""
+        if stream is None:
+            rows = self.db.query("SELECT * FROM broadcasts ORDER BY started DESC LIMIT ?", (limit,))
+        else:
+            rows = self.db.query("SELECT * FROM broadcasts WHERE stream = ? ORDER BY started DESC LIMIT ?",
+                                 (stream, limit))
+        return [dict(row) for row in rows]
+
+    # Writing (stream supervisor)
+
+    def begin(self, stream):
+        """Start a broadcast and return its id."""
+        broadcast_id = self.db.execute(
+            "INSERT INTO broadcasts (stream, started) VALUES (?, ?)", (stream, time.time())
+        ).lastrowid
+        os.makedirs(self.directory({"stream": stream, "id": broadcast_id}), exist_ok=True)
+        return broadcast_id
+
+    def append(self, broadcast, segment_path, duration, discontinuity=False):
+        """Append a finished segment to the broadcast's current chunk and rewrite its playlist."""
+        last = self.db.query_one(
+            "SELECT seq, chunk, offset, length, "
+            "(SELECT SUM(duration) FROM parts p WHERE p.broadcast = parts.broadcast AND p.chunk = parts.chunk) AS chunk_duration "
+            "FROM parts WHERE broadcast = ? ORDER BY seq DESC LIMIT 1",
+            (broadcast["id"],),
+        )
+        seq = last["seq"] + 1 if last else 0
+        extension = os.path.splitext(segment_path)[1]
+        if last is None or discontinuity or last["chunk_duration"] >= self.chunk_seconds:
+            chunk, offset = f"chunk-{seq:06d}{extension}", 0
+        else:
+            chunk, offset = last["chunk"], last["offset"] + last["length"]
+
+        chunk_path = os.path.join(self.directory(broadcast), chunk)
+        with open(segment_path, "rb") as src, open(chunk_path, "ab") as dst:
+            # Drop anything left past the last recorded part by an interrupted append
+            dst.truncate(offset)
+            shutil.copyfileobj(src, dst)
+            length = dst.tell() - offset
+
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO parts (broadcast, seq, chunk, offset, length, duration, discontinuity) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (broadcast["id"], seq, chunk, offset, length, duration, int(discontinuity and seq > 0)),
+            )
+            conn.execute("UPDATE broadcasts SET duration = duration + ?, bytes = bytes + ? WHERE id = ?",
+                         (duration, length, broadcast["id"]))
+        self.write_playlist(broadcast)
+
+    def write_playlist(self, broadcast, ended=False):
+        parts = self.db.query("SELECT * FROM parts WHERE broadcast = ? ORDER BY seq", (broadcast["id"],))
+        lines = [
+            "#EXTM3U",
+            "#EXT-X-VERSION:4",
+            f"#EXT-X-TARGETDURATION:{math.ceil(max((part['duration'] for part in parts), default=1))}",
+            f"#EXT-X-PLAYLIST-TYPE:{'VOD' if ended else 'EVENT'}",
+            "#EXT-X-MEDIA-SEQUENCE:0",
+        ]
+        for part in parts:
+            if part["discontinuity"]:
+                lines.append("#EXT-X-DISCONTINUITY")
+            lines += [
+                f"#EXTINF:{part['duration']:.3f},",
+                f"#EXT-X-BYTERANGE:{part['length']}@{part['offset']}",
+                part["chunk"],
+            ]
+        if ended:
+            lines.append("#EXT-X-ENDLIST")
+
+        path = os.path.join(self.directory(broadcast), PLAYLIST)
+        with open(f"{path}.tmp", "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.replace(f"{path}.tmp", path)
+
+    def finish(self, broadcast_id):
+        """End a broadcast: close its playlist, or drop it if nothing was archived."""
+        broadcast = self.get(broadcast_id)
+        if broadcast is None or broadcast["ended"] is not None:
+            return
+        if not broadcast["bytes"]:
+            self.delete(broadcast)
+            return
+        self.write_playlist(broadcast, ended=True)
+        self.db.execute("UPDATE broadcasts SET ended = ? WHERE id = ?", (time.time(), broadcast_id))
+        logging.info(f"Archived broadcast {broadcast_id} of {broadcast['stream']}: "
+                     f"{broadcast['duration']:.0f}s, {broadcast['bytes']} bytes")
+
+    def recover(self):
+        """Finish broadcasts left open by a supervisor that did not exit cleanly."""
+        for row in self.db.query("SELECT id FROM broadcasts WHERE ended IS NULL"):
+            self.finish(row["id"])
+
+    def delete(self, broadcast):
+        if broadcast["info_hash"]:
+            try:
+                seed_engine.remove(broadcast["info_hash"])
+            except ControlError as e:
+                logging.warning(f"Error retiring VOD {broadcast['id']}: {e}")
+            try:
+                os.remove(broadcast["torrent_path"])
+            except OSError:
+                pass
+        shutil.rmtree(self.directory(broadcast), ignore_errors=True)
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM parts WHERE broadcast = ?", (broadcast["id"],))
+            conn.execute("DELETE FROM broadcasts WHERE id = ?", (broadcast["id"],))
+
+    def enforce_retention(self):
+        """Delete finished broadcasts past max_age, then the oldest until under max_bytes."""
+        now = time.time()
+        finished = [dict(row) for row in self.db.query(
+            "SELECT * FROM broadcasts WHERE ended IS NOT NULL ORDER BY started"
+        )]
+        total = self.db.query_one("SELECT COALESCE(SUM(bytes), 0) FROM broadcasts")[0]
+        for broadcast in finished:
+            if broadcast["ended"] >= now - self.max_age and total <= self.max_bytes:
+                break
+            logging.info(f"Retention: deleting broadcast {broadcast['id']} of {broadcast['stream']}")
+            self.delete(broadcast)
+            total -= broadcast["bytes"]
+
+    # Lazy seeding (any worker)
+
+    def seed(self, broadcast_id, stale_after=600):
+        """Return the broadcast, making sure its VOD is seeded or being hashed.
+
+        Hashing runs on a background thread of whichever worker claims it first;
+        a claim older than stale_after seconds is taken over.
+        """
+        broadcast = self.get(broadcast_id)
+        if broadcast is None or broadcast["ended"] is None:
+            return broadcast
+        if broadcast["info_hash"]:
+            try:
+                # The daemon keeps one torrent per path, so this is a no-op unless it forgot the VOD
+                seed_engine.add(self.directory(broadcast), broadcast["torrent_path"],
+                                root=os.path.dirname(self.directory(broadcast)))
+            except ControlError as e:
+                logging.warning(f"Error seeding VOD {broadcast_id}: {e}")
+            return broadcast
+
+        now = time.time()
+        claimed = self.db.execute(
+            "UPDATE broadcasts SET seeding = ? WHERE id = ? AND info_hash IS NULL AND (seeding IS NULL OR seeding < ?)",
+            (now, broadcast_id, now - stale_after),
+        ).rowcount
+        if claimed:
+            broadcast["seeding"] = now
+            threading.Thread(target=self._seed, args=(broadcast,), daemon=True).start()
+        return broadcast
+
+    def _seed(self, broadcast):
+        directory = self.directory(broadcast)
+        try:
+            chunks = [row["chunk"] for row in self.db.query(
+                "SELECT DISTINCT chunk FROM parts WHERE broadcast = ? ORDER BY seq", (broadcast["id"],)
+            )]
+            torrent = build_multi_torrent(str(broadcast["id"]),
+                                          [os.path.join(directory, name) for name in [PLAYLIST] + chunks])
+            seed_engine.add(directory, torrent["torrent_path"], root=os.path.dirname(directory))
+        except (OSError, ControlError) as e:
+            logging.error(f"Error seeding VOD {broadcast['id']}: {e}")
+            self.db.execute("UPDATE broadcasts SET seeding = NULL WHERE id = ?", (broadcast["id"],))
+            return
+        self.db.execute(
+            "UPDATE broadcasts SET info_hash = ?, magnet_url = ?, torrent_path = ? WHERE id = ?",
+            (torrent["info_hash"], torrent["magnet_url"], torrent["torrent_path"], broadcast["id"]),
+        )
+        logging.info(f"Seeding VOD {broadcast['id']}: {torrent['magnet_url']}")
+
+
+class ArchiveRecorder:
+    """Feed live playlists into the archive from one background thread.
+
+    The supervisor reports each rewrite of a stream's archived playlist and
+    every ffmpeg (re)start; segments not archived yet are appended in order,
+    and a restart marks a discontinuity. Retention is enforced when a
+    broadcast ends and every sweep_interval seconds.
+    """
+
+    def __init__(self, archive, sweep_interval=600):
+        self.archive = archive
+        self.sweep_interval = sweep_interval
+        self.live = {}  # stream -> {"broadcast", "sequence", "discontinuity"}
+        self._events = queue.Queue()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def begin(self, stream):
+        self._events.put(("begin", stream, None))
+
+    def restarted(self, stream):
+        """ffmpeg was (re)started: its media sequence numbers start over."""
+        self._events.put(("restarted", stream, None))
+
+    def playlist(self, stream, path):
+        self._events.put(("playlist", stream, path))
+
+    def finish(self, stream, path=None):
+        """The broadcast ended; path is its playlist as ffmpeg left it, read one last time."""
+        self._events.put(("finish", stream, path))
+
+    def _ingest(self, state, path):
+        sequence, entries = parse_media_playlist(path)
+        directory = os.path.dirname(path)
+        for i, (duration, uri) in enumerate(entries):
+            if sequence + i <= state["sequence"]:
+                continue
+            try:
+                self.archive.append(state["broadcast"], os.path.join(directory, uri), duration,
+                                    state["discontinuity"])
+            except FileNotFoundError:
+                logging.warning(f"Segment {uri} was gone before it could be archived")
+            state["sequence"] = sequence + i
+            state["discontinuity"] = False
+
+    def _handle(self, event, stream, path):
+        if event == "begin":
+            self.live[stream] = {
+                "broadcast": self.archive.get(self.archive.begin(stream)),
+                "sequence": -1,
+                "discontinuity": False,
+            }
+            return
+        state = self.live.get(stream)
+        if state is None:
+            return
+        if event == "restarted":
+            state["sequence"] = -1
+            state["discontinuity"] = True
+        elif event == "playlist":
+            self._ingest(state, path)
+        elif event == "finish":
+            del self.live[stream]
+            try:
+                if path and os.path.exists(path):
+                    self._ingest(state, path)
+            finally:
+                self.archive.finish(state["broadcast"]["id"])
+            self.archive.enforce_retention()
+
+    def _run(self):
+        next_sweep = time.time() + self.sweep_interval
+        while True:
+            try:
+                event, stream, path = self._events.get(timeout=max(0, next_sweep - time.time()))
+            except queue.Empty:
+                event = None
+            try:
+                if event is None:
+                    next_sweep = time.time() + self.sweep_interval
+                    self.archive.enforce_retention()
+                else:
+                    self._handle(event, stream, path)
+            except (OSError, ValueError, sqlite3.Error) as e:
+                logging.error(f"Archive error for {stream if event else 'retention sweep'}: {e}")
+
+
+archive = Archive(
+    app.config["ARCHIVE_DB"],
+    os.path.join(FILE_DIR, "vod"),
+    app.config["ARCHIVE_CHUNK_SECONDS"],
+    app.config["ARCHIVE_MAX_AGE"],
+    app.config["ARCHIVE_MAX_BYTES"],
+)
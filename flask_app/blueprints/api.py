@@ -0,0 +1,245 @@
+import json
+import base64
+import hashlib
+from flask import request, make_response
+from flask_restful import Resource
+from shared import rest_api
+from control import ControlError
+from indexer import chain_indexer
+from providers import rpc_pool
+from streams import stream_control
+from archive import archive, PLAYLIST
+from prefilter import moderation_filter
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+SORT_COLUMNS = {"bump": "bump", "timestamp": "timestamp"}
+
+
+def encode_cursor(*values):
+    return base64.urlsafe_b64encode(json.dumps(values, separators=(',', ':')).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded))
+
+
+def page_size():
+    try:
+        return max(1, min(int(request.args.get('limit', DEFAULT_PAGE_SIZE)), MAX_PAGE_SIZE))
+    except ValueError:
+        return DEFAULT_PAGE_SIZE
+
+
+def compact_response(payload):
+    """Serialize without whitespace, tag with a strong ETag and answer If-None-Match with 304."""
+    body = json.dumps(payload, separators=(',', ':'), ensure_ascii=False)
+    response = make_response(body)
+    response.mimetype = 'application/json'
+    response.set_etag(hashlib.sha1(body.encode()).hexdigest())
+    return response.make_conditional(request)
+
+
+def thread_json(row):
+    """Shape an indexed thread like the contract's Thread struct."""
+    return {
+        "id": row["id"],
+        "name": row["name"],
+        "subject": row["subject"],
+        "email": row["email"],
+        "magnetUrl": row["magnet_url"],
+        "tags": json.loads(row["tags"]),
+        "content": row["content"],
+        "parentThreadId": row["parent_thread_id"],
+        "sender": row["sender"],
+        "timestamp": row["timestamp"],
+        "bump": row["bump"],
+    }
+
+
+def reply_json(row):
+    """Shape an indexed reply like the contract's Reply struct."""
+    return {
+        "id": row["id"],
+        "content": row["content"],
+        "email": row["email"],
+        "magnetUrl": row["magnet_url"],
+        "parentId": row["parent_id"],
+        "sender": row["sender"],
+        "timestamp": row["timestamp"],
+    }
+
+
+class ThreadList(Resource):
+    """GET /api/threads?sort=bump|timestamp&limit=N&cursor=C[&parent=ID]
+
+    Newest first, paginated by keyset on (sort key, id) so every page costs
+    the same no matter how deep it is. Hidden threads (deleted, blacklisted
+    on chain or locally, or from banned senders) are dropped with one lookup
+    in the precomputed visibility table per row.
+    """
+
+    def get(self):
+        column = SORT_COLUMNS.get(request.args.get('sort', 'bump'))
+        if column is None:
+            return {"error": "sort must be bump or timestamp"}, 400
+        limit = page_size()
+
+        where = ["v.visible = 1"]
+        params = []
+        if 'parent' in request.args:
+            where.append("t.parent_thread_id = ?")
+            params.append(request.args.get('parent', type=int, default=0))
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                key, last_id = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                return {"error": "Invalid cursor"}, 400
+            where.append(f"(t.{column}, t.id) < (?, ?)")
+            params += [key, last_id]
+
+        # CROSS JOIN keeps threads as the outer loop, so the sort index drives the scan
+        rows = chain_indexer.db.query(
+            f"SELECT t.* FROM threads AS t CROSS JOIN visibility AS v ON v.kind = 'thread' AND v.id = t.id "
+            f"WHERE {' AND '.join(where)} ORDER BY t.{column} DESC, t.id DESC LIMIT ?",
+            (*params, limit + 1),
+        )
+        threads = [thread_json(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(rows[limit - 1][column], rows[limit - 1]["id"]) if len(rows) > limit else None
+        return compact_response({"threads": threads, "next": next_cursor})
+
+
+class ThreadReplies(Resource):
+    """GET /api/threads/<thread_id>/replies?limit=N&cursor=C
+
+    Replies whose parentId is the thread, oldest first, paginated by id.
+    """
+
+    def get(self, thread_id):
+        limit = page_size()
+        after = 0
+        cursor = request.args.get('cursor')
+        if cursor:
+            try:
+                (after,) = decode_cursor(cursor)
+            except (ValueError, TypeError):
+                return {"error": "Invalid cursor"}, 400
+
+        rows = chain_indexer.db.query(
+            "SELECT r.* FROM replies AS r CROSS JOIN visibility AS v ON v.kind = 'reply' AND v.id = r.id "
+            "WHERE r.parent_id = ? AND r.id > ? AND v.visible = 1 ORDER BY r.id LIMIT ?",
+            (thread_id, after, limit + 1),
+        )
+        replies = [reply_json(row) for row in rows[:limit]]
+        next_cursor = encode_cursor(rows[limit - 1]["id"]) if len(rows) > limit else None
+        return compact_response({"replies": replies, "next": next_cursor})
+
+
+class RPCMetrics(Resource):
+    """GET /api/rpc/metrics
+
+    Latency, error rate and breaker state of each RPC endpoint, as seen by
+    the worker answering the request.
+    """
+
+    def get(self):
+        return {"endpoints": rpc_pool.metrics()}
+
+
+class StreamList(Resource):
+    """GET /api/streams
+
+    Every stream the supervisor is running, restarting or backing off, and
+    how much of the host's encode budget they use.
+    """
+
+    def get(self):
+        try:
+            return {"streams": stream_control.list(), "encode_budget": stream_control.budget()}
+        except ControlError as e:
+            return {"error": str(e)}, 503
+
+
+class StreamStatus(Resource):
+    """GET /api/streams/<stream>"""
+
+    def get(self, stream):
+        try:
+            status = stream_control.status(stream)
+        except ControlError as e:
+            return {"error": str(e)}, 503
+        if status is None:
+            return {"error": "Stream is not running"}, 404
+        return status
+
+
+def vod_json(broadcast):
+    """Describe an archived broadcast; magnetUrl is set once the VOD is seeded."""
+    return {
+        "id": broadcast["id"],
+        "stream": broadcast["stream"],
+        "started": broadcast["started"],
+        "ended": broadcast["ended"],
+        "live": broadcast["ended"] is None,
+        "duration": broadcast["duration"],
+        "bytes": broadcast["bytes"],
+        "playlist": f"/vod/{broadcast['stream']}/{broadcast['id']}/{PLAYLIST}",
+        "magnetUrl": broadcast["magnet_url"],
+        "seeding": broadcast["info_hash"] is None and broadcast["seeding"] is not None,
+    }
+
+
+def vod_blocked(broadcast):
+    """Whether the local blacklist hides the broadcast's streamer or its VOD torrent, as on /vod."""
+    return moderation_filter.blocked(magnet=broadcast["magnet_url"], user=broadcast["stream"])
+
+
+class VodList(Resource):
+    """GET /api/vods?stream=S&limit=N
+
+    Archived broadcasts, newest first. A broadcast still in progress is
+    listed too; its playlist grows until it ends. Broadcasts the local
+    blacklist hides are left out, so a page can come back short.
+    """
+
+    def get(self):
+        broadcasts = archive.broadcasts(request.args.get('stream'), page_size())
+        return {"vods": [vod_json(row) for row in broadcasts if not vod_blocked(row)]}
+
+
+class Vod(Resource):
+    """GET /api/vods/<broadcast_id>
+
+    POST seeds the VOD on first request: 202 while it is being hashed, 200
+    with its magnetUrl once it is seeded, 409 while the broadcast is live.
+    """
+
+    def get(self, broadcast_id):
+        broadcast = archive.get(broadcast_id)
+        if broadcast is None or vod_blocked(broadcast):
+            return {"error": "No such VOD"}, 404
+        return vod_json(broadcast)
+
+    def post(self, broadcast_id):
+        # Checked before seeding, so a blacklisted streamer's VOD is never hashed or announced
+        broadcast = archive.get(broadcast_id)
+        if broadcast is None or vod_blocked(broadcast):
+            return {"error": "No such VOD"}, 404
+        broadcast = archive.seed(broadcast_id)
+        if broadcast is None:
+            return {"error": "No such VOD"}, 404
+        if broadcast["ended"] is None:
+            return {"error": "Broadcast is still live"}, 409
+        return vod_json(broadcast), 200 if broadcast["magnet_url"] else 202
+
+
+rest_api.add_resource(ThreadList, '/api/threads')
+rest_api.add_resource(ThreadReplies, '/api/threads/<int:thread_id>/replies')
+rest_api.add_resource(RPCMetrics, '/api/rpc/metrics')
+rest_api.add_resource(StreamList, '/api/streams')
+rest_api.add_resource(StreamStatus, '/api/streams/<stream>')
+rest_api.add_resource(VodList, '/api/vods')
+rest_api.add_resource(Vod, '/api/vods/<int:broadcast_id>')
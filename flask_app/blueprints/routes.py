@@ -1,12 +1,24 @@
 from flask import Blueprint, render_template
-from shared import gremlinThreadABI, gremlinThreadAddress, gremlinAdminABI, gremlinAdminAddress, gremlinReplyABI, gremlinReplyAddress, allowed_file, FILE_DIR, seed_file, seeded_files, save_whitelist, save_blacklist, blacklist, whitelist, app, gremlinProfileAddress, gremlinProfileABI, THREADS, StreamSeed
+from shared import gremlinThreadABI, gremlinThreadAddress, gremlinAdminABI, gremlinAdminAddress, gremlinReplyABI, gremlinReplyAddress, allowed_file, FILE_DIR, app, gremlinProfileAddress, gremlinProfileABI
+from control import ControlError
+from streams import stream_control
+from segmentlog import segment_log
+from moderation import moderation, KINDS
+from prefilter import moderation_filter
+from staticfiles import send_static
+from store import content_store
+from jobs import upload_jobs
+from upload import receive_upload, UploadError
 import json, os, threading
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, url_for
 import logging, time
 from werkzeug.utils import secure_filename
 import subprocess
 
 blueprint = Blueprint('blueprint', __name__)
+
+# Segments handed to a viewer that just arrived
+LIVE_WINDOW = 7
 logging.basicConfig(level=logging.DEBUG)
 
 @blueprint.route('/')
@@ -22,174 +34,307 @@ def index():
 
 
 
+def stored_content(content_hash):
+    """Answer for content the store already has: its magnet, 403 if blacklisted, or None when unknown."""
+    stored = content_store.lookup(content_hash)
+    if stored is None:
+        return None
+    if moderation_filter.blocked(magnet=stored["magnet_url"]):
+        return jsonify({"error": "This content is blacklisted"}), 403
+    logging.info(f"Upload matched stored content {content_hash}")
+    return jsonify({"magnet_url": stored["magnet_url"]}), 200
+
+
+@app.route('/upload/sha256/<content_hash>', methods=['GET'])
+def uploaded_content(content_hash):
+    """Preflight for uploads: the magnet URL of stored content with this SHA-256, or 404 to upload it."""
+    return stored_content(content_hash) or (jsonify({"error": "Unknown content"}), 404)
+
+
 @app.route('/upload', methods=['POST'])
 def upload_file():
-    """Handle the image upload, start torrent seeding in a separate thread, and return the magnet link."""
+    """Stream the image upload into the content store and return the magnet link.
+
+    With ?async=1 (or "Prefer: respond-async") the response is 202 with a job
+    id as soon as the body is on disk; see /upload/jobs/<job_id>.
+    """
     logging.info('Upload route accessed')  # Log route access
-    
-    if 'file' not in request.files:
-        logging.error('No file part in the request')  # Log missing file part
-        return jsonify({"error": "No file provided"}), 400
-
-    file = request.files['file']
-
-    if file.filename == '':
-        logging.error('No file selected')  # Log empty filename
-        return jsonify({"error": "No selected file"}), 400
-
-    if file and allowed_file(file.filename):
-        filename = secure_filename(file.filename)
-        file_path = os.path.join(os.path.abspath(FILE_DIR), filename)
-        
-        logging.info(f"Attempting to save file: {filename} at {file_path}")  # Log file details
-
-        try:
-            file.save(file_path)  # Save the file
-            logging.info(f"File successfully saved to {file_path}")
-
-            # Start seeding in a separate thread
-            seed_thread = threading.Thread(target=seed_file, args=(file_path,))
-            seed_thread.start()
-
-            # Poll the seeded_files dictionary until the magnet URL is available
-            max_wait_time = 60  # Max wait time in seconds
-            wait_time = 0
-            while file_path not in seeded_files and wait_time < max_wait_time:
-                time.sleep(0.5)  # Sleep for 500ms
-                wait_time += 0.5
-
-            if file_path in seeded_files:
-                magnet_url = seeded_files[file_path]
-                logging.info(f"Magnet URL generated: {magnet_url}")
-                return jsonify({"magnet_url": magnet_url}), 200
-            else:
-                logging.error('Failed to generate magnet URL in time')
-                return jsonify({"error": "Failed to generate magnet URL in time"}), 500
-
-        except Exception as e:
-            logging.error(f"Error during file saving or torrent creation: {e}")
-            return jsonify({"error": "Error creating torrent", "details": str(e)}), 500
 
-    else:
-        logging.error(f"Invalid file type: {file.filename}")
-        return jsonify({"error": "Invalid file type"}), 400
+    # Clients that already know the content hash can skip sending a duplicate body;
+    # this only looks the hash up and changes nothing
+    content_hash = request.headers.get('X-Content-SHA256')
+    if content_hash:
+        known = stored_content(content_hash)
+        if known is not None:
+            return known
+
+    try:
+        upload = receive_upload(request, os.path.abspath(FILE_DIR), app.config["MAX_UPLOAD_SIZE"])
+    except UploadError as e:
+        logging.error(f"Upload rejected: {e}")
+        return jsonify({"error": str(e)}), e.status
+
+    if request.args.get('async') == '1' or 'respond-async' in request.headers.get('Prefer', ''):
+        job_id = upload_jobs.submit(upload)
+        logging.info(f"Upload job {job_id} accepted")
+        status_url = url_for('upload_job_status', job_id=job_id)
+        return jsonify({
+            "job_id": job_id,
+            "status_url": status_url,
+            "events_url": url_for('upload_job_events', job_id=job_id),
+        }), 202, {"Location": status_url}
+
+    try:
+        # The pieces were hashed on the way in; the daemon announces in the background
+        magnet_url = content_store.put(upload)["magnet_url"]
+        logging.info(f"Magnet URL generated: {magnet_url}")
+        return jsonify({"magnet_url": magnet_url}), 200
+
+    except Exception as e:
+        logging.error(f"Error during torrent creation: {e}")
+        if os.path.exists(upload["path"]):
+            os.remove(upload["path"])
+        return jsonify({"error": "Error creating torrent", "details": str(e)}), 500
+
+
+@app.route('/upload/jobs/<job_id>', methods=['GET'])
+def upload_job_status(job_id):
+    """Report the progress of an asynchronous upload."""
+    job = upload_jobs.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job), 200
+
+
+@app.route('/upload/jobs/<job_id>/events', methods=['GET'])
+def upload_job_events(job_id):
+    """Stream the progress of an asynchronous upload as server-sent events."""
+    if upload_jobs.get(job_id) is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def stream():
+        for job in upload_jobs.events(job_id):
+            yield f"event: {job['stage']}\ndata: {json.dumps(job)}\n\n"
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
 
 
 @app.route('/static/<path:filename>', methods=['GET'])
 def serve_static(filename):
-    """Serve the uploaded image."""
-    return send_from_directory(FILE_DIR, filename)
+    """Serve an uploaded file, handing the bytes to nginx when it is in front (see staticfiles.py)."""
+    return send_static(FILE_DIR, filename)
+
+
+@app.route('/hls/<path:filename>', methods=['GET'])
+def serve_hls(filename):
+    """Serve live stream output unless its streamer is blacklisted."""
+    return send_static(FILE_DIR, f"hls/{filename}")
+
+
+@app.route('/vod/<path:filename>', methods=['GET'])
+def serve_vod(filename):
+    """Serve an archived broadcast unless its streamer is blacklisted."""
+    return send_static(FILE_DIR, f"vod/{filename}")
+
+
+def moderate(list_name, item_type, op):
+    """Add or remove one tag, magnet or user; every worker sees the change on its next check."""
+    if item_type not in KINDS:
+        return jsonify({"error": f"Invalid {list_name} type"}), 400
+    data = request.get_json(silent=True) or {}
+    item_value = data.get(item_type)
+    if not isinstance(item_value, str) or not item_value.strip():
+        return jsonify({"error": f"Missing {item_type}"}), 400
+    if op == "add":
+        if moderation.add(list_name, item_type, item_value):
+            return jsonify({"message": f"{item_type.capitalize()} '{item_value}' added to {list_name}"}), 200
+        return jsonify({"error": f"{item_type.capitalize()} already {list_name}ed"}), 400
+    if moderation.remove(list_name, item_type, item_value):
+        return jsonify({"message": f"{item_type.capitalize()} '{item_value}' removed from {list_name}"}), 200
+    return jsonify({"error": f"{item_type.capitalize()} not {list_name}ed"}), 404
 
 
 # Route to add to blacklist
 @app.route('/admin/blacklist/<item_type>', methods=['POST'])
 def add_to_blacklist(item_type):
-    data = request.json
-    if item_type in ['tag', 'magnet', 'user']:
-        blacklist_key = f"{item_type}s"  # "tags", "magnet_urls", or "users"
-        item_value = data[item_type]
-        if item_value not in blacklist[blacklist_key]:
-            blacklist[blacklist_key].append(item_value)
-            save_blacklist(blacklist)
-            return jsonify({"message": f"{item_type.capitalize()} '{item_value}' added to blacklist"}), 200
-        return jsonify({"error": f"{item_type.capitalize()} already blacklisted"}), 400
-    return jsonify({"error": "Invalid blacklist type"}), 400
+    return moderate("blacklist", item_type, "add")
 
 # Route to add to whitelist
 @app.route('/admin/whitelist/<item_type>', methods=['POST'])
 def add_to_whitelist(item_type):
-    data = request.json
-    if item_type in ['tag', 'magnet', 'user']:
-        whitelist_key = f"{item_type}s"  # "tags", "magnet_urls", or "users"
-        item_value = data[item_type]
-        if item_value not in whitelist[whitelist_key]:
-            whitelist[whitelist_key].append(item_value)
-            save_whitelist(whitelist)
-            return jsonify({"message": f"{item_type.capitalize()} '{item_value}' added to whitelist"}), 200
-        return jsonify({"error": f"{item_type.capitalize()} already whitelisted"}), 400
-    return jsonify({"error": "Invalid whitelist type"}), 400
+    return moderate("whitelist", item_type, "add")
+
+# Routes to take entries off the lists again
+@app.route('/admin/blacklist/<item_type>', methods=['DELETE'])
+def remove_from_blacklist(item_type):
+    return moderate("blacklist", item_type, "remove")
+
+@app.route('/admin/whitelist/<item_type>', methods=['DELETE'])
+def remove_from_whitelist(item_type):
+    return moderate("whitelist", item_type, "remove")
 
 # Route to get current blacklist
 @app.route('/admin/blacklist', methods=['GET'])
 def get_blacklist():
-    return jsonify(blacklist)
+    return jsonify(moderation.export("blacklist"))
 
 # Route to get current whitelist
 @app.route('/admin/whitelist', methods=['GET'])
 def get_whitelist():
-    return jsonify(whitelist)
-
-@app.route('/users/<eth_address>')
-def user_profile(eth_address):
-
-    """Serve the live stream page and continuously monitor and seed HLS segments."""
-    hls_dir = os.path.join(FILE_DIR, "hls", eth_address)
-    os.makedirs(hls_dir, exist_ok=True)
-
-    # Ensure the directory is writable
-    if not os.access(hls_dir, os.W_OK):
-        os.chmod(hls_dir, 0o777)
-
-    # RTMP stream input URL and HLS output directory
-    rtmp_stream_url = f"rtmp://gremlin.codes:1935/live/{eth_address}"
-    hls_output_path = os.path.join(hls_dir, f"{eth_address}.m3u8")
-
-    # RTMP streaming configuration using FFmpeg
-    def stream_rtmp_to_hls():
-        """Use FFmpeg to capture RTMP stream and convert to HLS."""
-        try:
-            logging.info(f"Starting FFmpeg to stream RTMP to HLS for {eth_address}...")
-            ffmpeg_cmd = [
-                "/usr/bin/ffmpeg",
-                "-i", rtmp_stream_url,
-                "-c:v", "copy",
-                "-c:a", "copy",
-                "-f", "hls",
-                "-hls_time", "10",
-                "-hls_list_size", "6",
-                "-hls_flags", "delete_segments",
-                hls_output_path
-            ]
-            process = subprocess.Popen(ffmpeg_cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-            for stdout_line in iter(process.stdout.readline, ""):
-                logging.info(stdout_line.strip())
-            for stderr_line in iter(process.stderr.readline, ""):
-                logging.error(stderr_line.strip())
-            process.wait()
-        except Exception as e:
-            logging.error(f"Error streaming RTMP to HLS: {e}")
-
-    # Monitor and seed HLS segments
-    def monitor_hls_segments(directory):
-        """Monitor the HLS directory for new .ts segments and seed them."""
+    return jsonify(moderation.export("whitelist"))
+
+def parse_bulk_items(item_type):
+    """Read a bulk moderation body: a JSON array, or NDJSON with one item per line.
+
+    An item is {"type": "tag", "value": "...", "op": "remove"}, the single
+    route's {"tag": "..."} form, or a bare string when ?type= is given. op
+    defaults to ?op= (itself "add"). Returns [(kind, op, value) or error message].
+    """
+    default_op = request.args.get('op', 'add')
+    body = request.get_data(cache=False, as_text=True)
+    if request.mimetype in ('application/x-ndjson', 'application/jsonl', 'application/json-seq'):
+        raw = [json.loads(line) for line in body.splitlines() if line.strip()]
+    else:
+        raw = json.loads(body)
+        if not isinstance(raw, list):
+            raise ValueError("Expected a JSON array")
+
+    items = []
+    for entry in raw:
+        if isinstance(entry, str):
+            kind, value, op = item_type, entry, default_op
+        elif isinstance(entry, dict):
+            op = entry.get('op', default_op)
+            kind = entry.get('type') or next((k for k in KINDS if k in entry), item_type)
+            value = entry.get('value', entry.get(kind) if kind else None)
+        else:
+            kind = value = op = None
+        if kind not in KINDS:
+            items.append(f"type must be one of {', '.join(KINDS)}")
+        elif op not in ('add', 'remove'):
+            items.append("op must be add or remove")
+        elif not isinstance(value, str) or not value.strip():
+            items.append(f"Missing {kind}")
+        else:
+            items.append((kind, op, value))
+    return items
+
+
+# Spelled out per list: /admin/<list>/<item_type> would otherwise take /bulk and /export
+@app.route('/admin/blacklist/bulk', methods=['POST'], defaults={'list_name': 'blacklist'})
+@app.route('/admin/whitelist/bulk', methods=['POST'], defaults={'list_name': 'whitelist'})
+def bulk_moderate(list_name):
+    """Apply many adds/removes to a list in one transaction; returns a result per item, in order."""
+    item_type = request.args.get('type')
+    if item_type is not None and item_type not in KINDS:
+        return jsonify({"error": f"Invalid {list_name} type"}), 400
+    try:
+        items = parse_bulk_items(item_type)
+    except ValueError as e:
+        # json.JSONDecodeError is a ValueError too
+        return jsonify({"error": f"Invalid body: {e}"}), 400
+
+    valid = [item for item in items if isinstance(item, tuple)]
+    applied = iter(moderation.bulk(list_name, valid))
+    results = []
+    for item in items:
+        if isinstance(item, tuple):
+            kind, _, value = item
+            results.append({"type": kind, "value": value, "result": next(applied)})
+        else:
+            results.append({"result": "invalid", "error": item})
+    summary = {}
+    for result in results:
+        summary[result["result"]] = summary.get(result["result"], 0) + 1
+    return jsonify({"results": results, "summary": summary})
+
+
+@app.route('/admin/blacklist/export', methods=['GET'], defaults={'list_name': 'blacklist'})
+@app.route('/admin/whitelist/export', methods=['GET'], defaults={'list_name': 'whitelist'})
+def export_moderation(list_name):
+    """Stream a whole list as NDJSON ({"type", "value", "added"} per line), or a JSON array with ?format=json."""
+    item_type = request.args.get('type')
+    if item_type is not None and item_type not in KINDS:
+        return jsonify({"error": f"Invalid {list_name} type"}), 400
+    as_array = request.args.get('format') == 'json'
+
+    def stream():
+        after, first = None, True
+        if as_array:
+            yield '['
         while True:
-            try:
-                segment_files = sorted([f for f in os.listdir(directory) if f.endswith(".m3u8")])
-
-                for segment_file in segment_files:
-                    if segment_file not in seeded_files.get(eth_address, ""):
-                        file_path = os.path.join(directory, segment_file)
-                        logging.info(f"Seeding segment: {file_path}")
-                        # Start the seeding process using the StreamSeed class
-                        stream_seed = StreamSeed(eth_address, file_path)
-                        stream_seed.start()  # Start the thread
-                        logging.info(f"Started seeding thread for segment: {file_path}")
-                        if (seeded_files.get(eth_address, "") == ""):
-                            seeded_files[eth_address] = set()
-
-                time.sleep(5)  # Check every 5 seconds for new segments
-            except Exception as e:
-                logging.error(f"Error monitoring HLS segments: {e}")
+            page = moderation.entries(list_name, item_type, after)
+            for entry in page:
+                line = json.dumps({"type": entry["kind"], "value": entry["value"], "added": entry["added"]})
+                if as_array:
+                    yield line if first else ',' + line
+                else:
+                    yield line + '\n'
+                first = False
+            if not page:
                 break
+            after = (page[-1]["kind"], page[-1]["value"])
+        if as_array:
+            yield ']'
+
+    return Response(stream(), mimetype='application/json' if as_array else 'application/x-ndjson',
+                    headers={'Content-Disposition': f'attachment; filename={list_name}.{"json" if as_array else "ndjson"}'})
+
+
+def rtmp_callback(handler, **kwargs):
+    """Answer an nginx-rtmp notification: 2xx lets the publish/play through, anything else refuses it."""
+    if request.remote_addr not in ('127.0.0.1', '::1'):
+        return jsonify({"error": "Forbidden"}), 403
+    stream = request.form.get('name', '')
+    try:
+        handler(stream, **kwargs)
+    except ControlError as e:
+        logging.error(f"RTMP callback for {stream} failed: {e}")
+        return jsonify({"error": str(e)}), 403
+    return '', 204
+
+
+@app.route('/internal/rtmp/on_publish', methods=['POST'])
+def rtmp_on_publish():
+    """A streamer went live: start remuxing now so the first segment is ready before any viewer.
+
+    The publish URL's query string reaches us as form fields, so streamers pick
+    the output with e.g. rtmp://.../live/<eth>?profile=low_latency.
+    """
+    logging.info(f"RTMP publish started: {request.form.get('name')}")
+    return rtmp_callback(stream_control.publish, profile=request.form.get('profile') or None)
 
-    ffmpeg_thread = threading.Thread(target=stream_rtmp_to_hls, daemon=True)
-    monitor_thread = threading.Thread(target=monitor_hls_segments, args=(hls_dir,), daemon=True)
 
-    # Check if the stream is already running for this RTMP URL
-    if (rtmp_stream_url not in [x[0] for x in THREADS]):
-        ffmpeg_thread.start()  # Start FFmpeg RTMP to HLS conversion in a separate thread
-        monitor_thread.start()  # Start monitoring and seeding in a separate thread
-        THREADS.append(tuple((rtmp_stream_url, ffmpeg_thread, monitor_thread)))
+@app.route('/internal/rtmp/on_publish_done', methods=['POST'])
+def rtmp_on_publish_done():
+    """The streamer stopped: tear the pipeline down."""
+    logging.info(f"RTMP publish ended: {request.form.get('name')}")
+    return rtmp_callback(stream_control.stop)
+
+
+@app.route('/internal/rtmp/on_play', methods=['POST'])
+def rtmp_on_play():
+    """An RTMP viewer joined; counts as activity for on-demand streams."""
+    return rtmp_callback(stream_control.touch)
+
+
+@app.route('/users/<eth_address>')
+def user_profile(eth_address):
+    """Serve the live stream page.
+
+    Streams normally start from the on_publish callback; with STREAM_ON_DEMAND
+    a profile view starts the remux as well.
+    """
+    try:
+        if app.config["STREAM_ON_DEMAND"]:
+            # Starts ffmpeg unless it already runs for this stream, and keeps it from idling out
+            stream_control.start(eth_address)
+        else:
+            stream_control.touch(eth_address)
+    except ControlError as e:
+        logging.error(f"Could not start stream {eth_address}: {e}")
+
     """Serve the user's profile page and provide the RTMP stream URL."""
     # Assuming the user is the profile owner; generate an RTMP URL
     return render_template(
@@ -200,10 +345,71 @@ def user_profile(eth_address):
         magnet_url=get_magnet_url(eth_address)
     )
     
+def unblocked(eth_address, segments):
+    """Drop segments whose magnet URL the local blacklist hides."""
+    return [segment for segment in segments
+            if not moderation_filter.blocked(magnet=segment["magnet_url"], user=eth_address)]
+
+
 @app.route('/magnet_url/<eth_address>')
 def get_magnet_url(eth_address):
-    """Get the latest magnet URL for the given user's stream."""
-    if (any([True if sf.startswith(eth_address) else False for sf in seeded_files.keys()])):
-        return jsonify({"magnet_url": list(seeded_files.get(eth_address, list()))}), 200
+    """Get the magnet URLs of the user's live segments, oldest first.
+
+    Without ?after=<seq> this is the newest few segments. With it, the request
+    waits (up to ?wait= seconds, at most 30) until there are segments after
+    that sequence number and returns those; "next" is the seq to ask for next.
+    """
+    if moderation_filter.blocked(user=eth_address):
+        return jsonify({"error": "No magnet URL available"}), 404
+    after = request.args.get('after', type=int)
+    if after is None:
+        segments = segment_log.latest(eth_address, LIVE_WINDOW)
+        if not segments:
+            return jsonify({"error": "No magnet URL available"}), 404
     else:
-        return jsonify({"error": "No magnet URL available"}), 404
\ No newline at end of file
+        wait = max(0, min(request.args.get('wait', 25, type=float), 30))
+        segments = segment_log.wait(eth_address, after, wait)
+
+    # "next" still moves past blacklisted segments, so they are not fetched again
+    next_seq = segments[-1]["seq"] if segments else after
+    segments = unblocked(eth_address, segments)
+    magnet_urls = [segment["magnet_url"] for segment in segments]
+    return jsonify({
+        "magnet_url": magnet_urls,
+        "magnet_urls": magnet_urls,
+        "segments": segments,
+        "next": next_seq,
+    }), 200
+
+
+@app.route('/magnet_url/<eth_address>/events')
+def magnet_url_events(eth_address):
+    """Push the user's new segments as server-sent events, in order, as soon as they are seeded.
+
+    Resumes after ?after=<seq> or the Last-Event-ID a reconnecting EventSource sends;
+    otherwise starts with the newest few segments.
+    """
+    if moderation_filter.blocked(user=eth_address):
+        return jsonify({"error": "No magnet URL available"}), 404
+    after = request.headers.get('Last-Event-ID', type=int)
+    if after is None:
+        after = request.args.get('after', type=int)
+
+    def event(segment):
+        return f"id: {segment['seq']}\nevent: segment\ndata: {json.dumps(segment)}\n\n"
+
+    def stream():
+        start = after
+        if start is None:
+            backlog = segment_log.latest(eth_address, LIVE_WINDOW)
+            start = backlog[-1]["seq"] if backlog else 0
+            for segment in unblocked(eth_address, backlog):
+                yield event(segment)
+        for segment in segment_log.follow(eth_address, start):
+            if segment is None:
+                yield ": keep-alive\n\n"
+            elif unblocked(eth_address, [segment]):
+                yield event(segment)
+
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
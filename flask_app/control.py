@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import fcntl
+import socket
+import logging
+import threading
+import subprocess
+
+
+class ControlError(Exception):
+    """Raised when a control channel request fails or the helper is unreachable."""
+
+
+def try_lock(lock_path):
+    """Take an exclusive lock file without blocking; returns the fd or None if another process holds it.
+
+    The lock lasts as long as the returned fd stays open (normally for the life of the process).
+    """
+    fd = os.open(lock_path, os.O_CREAT | os.O_RDWR, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        os.close(fd)
+        return None
+    return fd
+
+
+class ControlClient:
+    """Newline-delimited JSON client for a helper listening on a unix socket.
+
+    Every call opens its own connection, so gevent workers can issue requests
+    concurrently without sharing a socket.
+    """
+
+    def __init__(self, socket_path, timeout=30):
+        self.socket_path = socket_path
+        self.timeout = timeout
+
+    def call(self, cmd, **params):
+        """Send one command and return the decoded reply."""
+        request = dict(params, cmd=cmd)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(self.timeout)
+                sock.connect(self.socket_path)
+                sock.sendall(json.dumps(request).encode() + b"\n")
+                buf = b""
+                while not buf.endswith(b"\n"):
+                    chunk = sock.recv(65536)
+                    if not chunk:
+                        break
+                    buf += chunk
+        except OSError as e:
+            raise ControlError(f"{self.socket_path}: {e}") from e
+
+        if not buf:
+            raise ControlError(f"{self.socket_path}: connection closed without a reply")
+        reply = json.loads(buf)
+        if not reply.get("ok"):
+            raise ControlError(reply.get("error", "unknown error"))
+        return reply
+
+    def is_alive(self):
+        """Check whether something is accepting connections on the socket."""
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+                sock.settimeout(1)
+                sock.connect(self.socket_path)
+            return True
+        except OSError:
+            return False
+
+
+class SupervisedProcess:
+    """Run one long-lived helper process for the whole host.
+
+    Every gunicorn worker calls ensure_running(); only the worker that wins the
+    lock file spawns the helper and restarts it with backoff when it exits. If
+    that worker dies the lock is released and the next caller takes over. The
+    helper gets a stdin pipe so it can exit when its supervisor goes away.
+    """
+
+    def __init__(self, name, argv, socket_path, lock_path, max_backoff=30):
+        self.name = name
+        self.argv = argv
+        self.client = ControlClient(socket_path)
+        self.lock_path = lock_path
+        self.max_backoff = max_backoff
+        self.process = None
+        self._lock_fd = None
+        self._guard = threading.Lock()
+
+    def ensure_running(self, timeout=10):
+        """Make sure the helper is up, spawning it if no other worker supervises it."""
+        if self.client.is_alive():
+            return True
+
+        with self._guard:
+            if self._lock_fd is None:
+                self._lock_fd = try_lock(self.lock_path)
+                if self._lock_fd is not None:
+                    threading.Thread(target=self._supervise, daemon=True).start()
+
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            if self.client.is_alive():
+                return True
+            time.sleep(0.1)
+        logging.error(f"{self.name} did not come up within {timeout}s")
+        return False
+
+    def _supervise(self):
+        """Keep the helper running, restarting it with exponential backoff."""
+        backoff = 1
+        while True:
+            started = time.time()
+            logging.info(f"Starting {self.name}: {' '.join(self.argv)}")
+            try:
+                self.process = subprocess.Popen(self.argv, stdin=subprocess.PIPE)
+                returncode = self.process.wait()
+                logging.error(f"{self.name} exited with code {returncode}")
+            except OSError as e:
+                logging.error(f"Failed to start {self.name}: {e}")
+
+            # Reset the backoff once the helper stayed up for a while
+            if time.time() - started > 60:
+                backoff = 1
+            time.sleep(backoff)
+            backoff = min(backoff * 2, self.max_backoff)
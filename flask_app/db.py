@@ -0,0 +1,60 @@
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class Database:
+    """A SQLite database shared by every gunicorn worker on the host.
+
+    WAL mode lets readers in all workers run alongside one writer. Each process
+    keeps a single connection guarded by a lock; schema is the DDL run on open.
+    """
+
+    def __init__(self, path, schema=""):
+        self.path = path
+        self.schema = schema
+        self._conn = None
+        self._pid = None
+        self._lock = threading.RLock()
+
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(self.schema)
+        return conn
+
+    @property
+    def conn(self):
+        # gunicorn forks after import, so never reuse a connection across processes
+        if self._conn is None or self._pid != os.getpid():
+            self._conn = self._connect()
+            self._pid = os.getpid()
+        return self._conn
+
+    def execute(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params)
+
+    def query(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def query_one(self, sql, params=()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchone()
+
+    @contextmanager
+    def transaction(self):
+        """Run a block as one write transaction, taking the write lock up front."""
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
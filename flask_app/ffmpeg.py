@@ -0,0 +1,148 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+import subprocess
+from collections import deque
+
+# "[hls @ 0x55d0c8] [info] Opening '/app/static/hls/x/x12.ts.tmp' for writing"
+LEVEL = re.compile(r"\[(fatal|error|warning|info)\] ")
+OPENING = re.compile(r"Opening '(.+?)' for writing")
+SEGMENT_SUFFIXES = (".ts", ".ts.tmp", ".m4s", ".m4s.tmp")
+
+
+def parse_number(value, suffix=""):
+    """Turn progress values like "2400.3kbits/s", "1.01x" or "N/A" into floats (None when unknown)."""
+    try:
+        return float(value.strip().removesuffix(suffix))
+    except ValueError:
+        return None
+
+
+def probe(url, ffprobe, timeout=15):
+    """Describe a live input as {"height": video height or None, "audio": whether it has audio}.
+
+    Returns None when ffprobe fails or does not answer within timeout seconds.
+    """
+    try:
+        result = subprocess.run(
+            [ffprobe, "-v", "error", "-show_entries", "stream=codec_type,height", "-of", "json", url],
+            capture_output=True, timeout=timeout, check=True,
+        )
+        streams = json.loads(result.stdout)["streams"]
+    except (OSError, subprocess.SubprocessError, ValueError, KeyError) as e:
+        logging.warning(f"Could not probe {url}: {e}")
+        return None
+    heights = [s["height"] for s in streams if s.get("codec_type") == "video" and s.get("height")]
+    return {
+        "height": heights[0] if heights else None,
+        "audio": any(s.get("codec_type") == "audio" for s in streams),
+    }
+
+
+class FFmpegProcess:
+    """Run ffmpeg with its stderr and -progress output drained on their own threads.
+
+    Progress goes to a dedicated pipe and is parsed into metrics (fps,
+    bitrate, speed, dropped/duplicated frames, segment timings); stderr is
+    read continuously so ffmpeg can never block on a full pipe, with warnings
+    and errors logged and the last lines kept for when the process exits.
+    Exposes the Popen methods the stream supervisor uses (pid, poll, wait,
+    terminate, kill).
+    """
+
+    def __init__(self, argv, name, tail=20):
+        self.name = name
+        self.tail = deque(maxlen=tail)
+        self.metrics = {
+            "frame": None,
+            "fps": None,
+            "bitrate_kbps": None,
+            "speed": None,
+            "drop_frames": None,
+            "dup_frames": None,
+            "out_time_s": None,
+            "segments": 0,
+            "segment_interval_s": None,
+            "last_segment_at": None,
+            "updated": None,
+        }
+
+        progress_read, progress_write = os.pipe()
+        try:
+            self.process = subprocess.Popen(
+                [argv[0], "-nostats", "-loglevel", "level+info", "-progress", f"pipe:{progress_write}", *argv[1:]],
+                stdin=subprocess.DEVNULL,
+                stdout=subprocess.DEVNULL,
+                stderr=subprocess.PIPE,
+                pass_fds=(progress_write,),
+            )
+        except OSError:
+            os.close(progress_read)
+            raise
+        finally:
+            os.close(progress_write)
+
+        threading.Thread(target=self._read_progress, args=(progress_read,), daemon=True).start()
+        threading.Thread(target=self._read_stderr, daemon=True).start()
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def poll(self):
+        return self.process.poll()
+
+    def wait(self, timeout=None):
+        return self.process.wait(timeout)
+
+    def terminate(self):
+        self.process.terminate()
+
+    def kill(self):
+        self.process.kill()
+
+    def _read_progress(self, fd):
+        """Parse key=value blocks, each ending with progress=continue (or end)."""
+        block = {}
+        with os.fdopen(fd, "r", errors="replace") as progress:
+            for line in progress:
+                key, _, value = line.strip().partition("=")
+                if key != "progress":
+                    block[key] = value
+                    continue
+                out_time_us = parse_number(block.get("out_time_us", ""))
+                self.metrics.update({
+                    "frame": parse_number(block.get("frame", "")),
+                    "fps": parse_number(block.get("fps", "")),
+                    "bitrate_kbps": parse_number(block.get("bitrate", ""), "kbits/s"),
+                    "speed": parse_number(block.get("speed", ""), "x"),
+                    "drop_frames": parse_number(block.get("drop_frames", "")),
+                    "dup_frames": parse_number(block.get("dup_frames", "")),
+                    "out_time_s": out_time_us / 1e6 if out_time_us is not None else None,
+                    "updated": time.time(),
+                })
+                block = {}
+
+    def _read_stderr(self):
+        for raw in self.process.stderr:
+            line = raw.decode(errors="replace").rstrip()
+            if not line:
+                continue
+            self.tail.append(line)
+
+            level = LEVEL.search(line)
+            if level and level.group(1) in ("fatal", "error"):
+                logging.error(f"FFmpeg {self.name}: {line}")
+            elif level and level.group(1) == "warning":
+                logging.warning(f"FFmpeg {self.name}: {line}")
+
+            opening = OPENING.search(line)
+            if opening and opening.group(1).endswith(SEGMENT_SUFFIXES):
+                now = time.time()
+                last = self.metrics["last_segment_at"]
+                self.metrics["segments"] += 1
+                self.metrics["segment_interval_s"] = round(now - last, 3) if last else None
+                self.metrics["last_segment_at"] = now
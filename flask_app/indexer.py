@@ -0,0 +1,560 @@
+import json
+import time
+import queue
+import logging
+import threading
+from web3 import Web3
+from web3.exceptions import ContractLogicError
+from shared import (app, gremlinThreadABI, gremlinThreadAddress, gremlinReplyABI,
+                    gremlinReplyAddress)
+from db import Database
+from providers import web3
+from rpc import contract_reader
+from moderation import moderation
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS threads (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    subject TEXT NOT NULL,
+    email TEXT NOT NULL,
+    magnet_url TEXT NOT NULL,
+    tags TEXT NOT NULL,
+    content TEXT NOT NULL,
+    parent_thread_id INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    whitelisted INTEGER NOT NULL,
+    blacklisted INTEGER NOT NULL,
+    deleted INTEGER NOT NULL,
+    bump INTEGER NOT NULL,
+    block_number INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS replies (
+    id INTEGER PRIMARY KEY,
+    content TEXT NOT NULL,
+    email TEXT NOT NULL,
+    magnet_url TEXT NOT NULL,
+    parent_id INTEGER NOT NULL,
+    sender TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    whitelisted INTEGER NOT NULL,
+    blacklisted INTEGER NOT NULL,
+    deleted INTEGER NOT NULL,
+    block_number INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS threads_bump ON threads (bump, id);
+CREATE INDEX IF NOT EXISTS threads_timestamp ON threads (timestamp, id);
+CREATE INDEX IF NOT EXISTS threads_parent_bump ON threads (parent_thread_id, bump, id);
+CREATE INDEX IF NOT EXISTS replies_parent ON replies (parent_id, id);
+CREATE INDEX IF NOT EXISTS threads_magnet ON threads (magnet_url);
+CREATE INDEX IF NOT EXISTS threads_sender ON threads (lower(sender));
+CREATE INDEX IF NOT EXISTS replies_magnet ON replies (magnet_url);
+CREATE INDEX IF NOT EXISTS replies_sender ON replies (lower(sender));
+CREATE TABLE IF NOT EXISTS thread_tags (
+    tag TEXT NOT NULL,
+    thread_id INTEGER NOT NULL,
+    PRIMARY KEY (tag, thread_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS thread_tags_thread ON thread_tags (thread_id);
+CREATE TABLE IF NOT EXISTS banned (
+    address TEXT PRIMARY KEY,
+    banned INTEGER NOT NULL,
+    block_number INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS visibility (
+    kind TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    visible INTEGER NOT NULL,
+    reason TEXT,
+    PRIMARY KEY (kind, id)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS blocks (
+    number INTEGER PRIMARY KEY,
+    hash TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+# How many recent block hashes to keep for reorg detection
+BLOCK_HISTORY = 256
+
+# Replies emit no events, so their moderation flags are re-read a slice at a time
+REPLY_SWEEP_BATCH = 100
+
+# Neither are bans: new senders are checked as they appear, known ones a slice at a time
+BAN_SWEEP_BATCH = 100
+
+# Rows per IN (...) list when looking up posts touched by moderation changes
+LOOKUP_BATCH = 500
+
+
+def chunked(values, size):
+    values = list(values)
+    for i in range(0, len(values), size):
+        yield values[i:i + size]
+
+
+def visibility(row, tags, banned, lists):
+    """Decide whether a thread or reply is shown: (visible, reason it is hidden).
+
+    In order: deleted posts, posts blacklisted on chain and posts by banned
+    senders are hidden; then the local whitelist (magnet, sender or tag)
+    shows and the local blacklist hides. Everything else is shown. The
+    contracts whitelist every new post, so the on-chain whitelisted flag is
+    the default and overrides nothing. lists are the moderation store's sets.
+    """
+    if row["deleted"]:
+        return 0, "deleted"
+    if row["blacklisted"]:
+        return 0, "blacklisted"
+    if banned:
+        return 0, "banned"
+    sender = row["sender"].lower()
+    for list_name, visible in (("whitelist", 1), ("blacklist", 0)):
+        if row["magnet_url"] in lists[(list_name, "magnet")]:
+            hit = "magnet"
+        elif sender in lists[(list_name, "user")]:
+            hit = "user"
+        elif any(tag in lists[(list_name, "tag")] for tag in tags):
+            hit = "tag"
+        else:
+            continue
+        return visible, None if visible else f"{list_name}ed_{hit}"
+    return 1, None
+
+
+def event_topics(abi):
+    """Map each event's topic0 to its name."""
+    topics = {}
+    for entry in abi:
+        if entry["type"] == "event":
+            signature = f"{entry['name']}({','.join(i['type'] for i in entry['inputs'])})"
+            topics[Web3.keccak(text=signature).hex().removeprefix("0x")] = entry["name"]
+    return topics
+
+
+class ChainIndexer:
+    """Follow GremlinThread events and GremlinReply state into a local SQLite index.
+
+    The first run backfills every thread and reply by id. After that the
+    indexer reads ThreadCreated/Deleted/Blacklisted/Whitelisted logs block
+    range by block range, re-reading the affected threads at the range's last
+    block. GremlinReply has no events, so new replies are found through
+    replyCount() and existing ones are re-read in a rolling sweep.
+
+    The last processed block is checkpointed along with recent block hashes.
+    When a stored hash no longer matches the chain, everything written after
+    the fork point is re-read and the logs from there are processed again.
+
+    The visibility table holds whether each post is shown (see visibility),
+    so listings filter with a primary key lookup. It is updated for the posts
+    and senders each block range touches, and, from a second thread, for the
+    posts matching each change to the moderation store.
+    """
+
+    def __init__(self, db_path, w3, reader, confirmations=2, log_batch=5000, poll_interval=2):
+        self.db = Database(db_path, SCHEMA)
+        self.w3 = w3
+        self.reader = reader
+        self.confirmations = confirmations
+        self.log_batch = log_batch
+        self.poll_interval = poll_interval
+        self.thread_contract = w3.eth.contract(address=gremlinThreadAddress, abi=gremlinThreadABI)
+        self.reply_contract = w3.eth.contract(address=gremlinReplyAddress, abi=gremlinReplyABI)
+        self.thread_topics = event_topics(gremlinThreadABI)
+
+    # Checkpoint state
+
+    def _state(self, key, default=None):
+        row = self.db.query_one("SELECT value FROM state WHERE key = ?", (key,))
+        return default if row is None else row["value"]
+
+    def checkpoint(self):
+        """Last block fully reflected in the index, or None before the first backfill."""
+        return self._state("checkpoint")
+
+    # Chain reads
+
+    def fetch_threads(self, thread_ids, block):
+        """Read threads as of a block in batched calls; returns (threads, ids of deleted threads)."""
+        thread_ids = list(thread_ids)
+        results = self.reader.call_many([(self.thread_contract, "getThread", (i,)) for i in thread_ids], block)
+        threads, deleted = [], []
+        for thread_id, thread in zip(thread_ids, results):
+            if isinstance(thread, ContractLogicError):
+                # getThread reverts for deleted threads
+                deleted.append(thread_id)
+                continue
+            if isinstance(thread, Exception):
+                raise thread
+            (id_, name, subject, email, magnet_url, tags, content, parent_thread_id,
+             sender, timestamp, whitelisted, blacklisted, is_deleted) = thread
+            threads.append({
+                "id": id_, "name": name, "subject": subject, "email": email, "magnet_url": magnet_url,
+                "tags": json.dumps(list(tags)), "content": content, "parent_thread_id": parent_thread_id,
+                "sender": sender, "timestamp": timestamp, "whitelisted": int(whitelisted),
+                "blacklisted": int(blacklisted), "deleted": int(is_deleted),
+            })
+        return threads, deleted
+
+    def fetch_replies(self, reply_ids, block):
+        """Read replies as of a block in batched calls; deleted replies come back zeroed and are flagged."""
+        reply_ids = list(reply_ids)
+        results = self.reader.call_many([(self.reply_contract, "replies", (i,)) for i in reply_ids], block)
+        replies = []
+        for reply_id, reply in zip(reply_ids, results):
+            if isinstance(reply, Exception):
+                raise reply
+            (id_, content, email, magnet_url, parent_id, sender, timestamp, whitelisted, blacklisted) = reply
+            replies.append({
+                "id": reply_id, "content": content, "email": email, "magnet_url": magnet_url,
+                "parent_id": parent_id, "sender": sender, "timestamp": timestamp,
+                "whitelisted": int(whitelisted), "blacklisted": int(blacklisted), "deleted": int(id_ == 0),
+            })
+        return replies
+
+    def fetch_bans(self, senders, block):
+        """Read bannedAddresses for senders on both contracts as of a block; returns {lowercased address: bool}."""
+        senders = list(dict.fromkeys(senders))
+        calls = []
+        for sender in senders:
+            address = Web3.to_checksum_address(sender)
+            calls += [(self.thread_contract, "bannedAddresses", (address,)),
+                      (self.reply_contract, "bannedAddresses", (address,))]
+        results = self.reader.call_many(calls, block)
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return {sender.lower(): bool(results[2 * i] or results[2 * i + 1]) for i, sender in enumerate(senders)}
+
+    def unchecked_senders(self, threads=(), replies=()):
+        """Senders of the given posts whose ban status was never read."""
+        senders = {post["sender"].lower(): post["sender"] for post in (*threads, *replies)}
+        known = set()
+        for batch in chunked(senders, LOOKUP_BATCH):
+            known.update(row["address"] for row in self.db.query(
+                f"SELECT address FROM banned WHERE address IN ({','.join('?' * len(batch))})", batch))
+        return [sender for address, sender in senders.items() if address not in known]
+
+    def counts(self, block):
+        """Return (threadCount, replyCount) as of a block."""
+        thread_count, reply_count = self.reader.call_many([
+            (self.thread_contract, "threadCount", ()),
+            (self.reply_contract, "replyCount", ()),
+        ], block)
+        for count in (thread_count, reply_count):
+            if isinstance(count, Exception):
+                raise count
+        return thread_count, reply_count
+
+    def block_hash(self, number):
+        return self.w3.eth.get_block(number)["hash"].hex()
+
+    # Writes
+
+    def _write(self, block, threads=(), deleted_threads=(), replies=(), extra_state=None, bans=None):
+        """Apply one block range worth of changes and advance the checkpoint to block.
+
+        bans maps lowercased senders to their current ban status.
+        """
+        block_hash = self.block_hash(block)
+        bans = bans or {}
+        with self.db.transaction() as conn:
+            changed_bans = []
+            for address, banned in bans.items():
+                row = conn.execute("SELECT banned FROM banned WHERE address = ?", (address,)).fetchone()
+                if row is not None and row["banned"] != banned:
+                    changed_bans.append(address)
+                conn.execute("INSERT OR REPLACE INTO banned (address, banned, block_number) VALUES (?, ?, ?)",
+                             (address, int(banned), block))
+
+            for reply in replies:
+                conn.execute(
+                    "INSERT OR REPLACE INTO replies (id, content, email, magnet_url, parent_id, sender, timestamp, "
+                    "whitelisted, blacklisted, deleted, block_number) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (reply["id"], reply["content"], reply["email"], reply["magnet_url"], reply["parent_id"],
+                     reply["sender"], reply["timestamp"], reply["whitelisted"], reply["blacklisted"],
+                     reply["deleted"], block),
+                )
+                if not reply["deleted"]:
+                    conn.execute("UPDATE threads SET bump = MAX(bump, ?) WHERE id = ?",
+                                 (reply["timestamp"], reply["parent_id"]))
+
+            for thread in threads:
+                # Re-writing a thread (e.g. a flag change) must keep the bumps its replies and child threads gave it
+                latest_reply = conn.execute(
+                    "SELECT MAX(timestamp) FROM replies WHERE parent_id = ? AND deleted = 0", (thread["id"],)
+                ).fetchone()[0] or 0
+                latest_child = conn.execute(
+                    "SELECT MAX(timestamp) FROM threads WHERE parent_thread_id = ? AND deleted = 0", (thread["id"],)
+                ).fetchone()[0] or 0
+                conn.execute(
+                    "INSERT OR REPLACE INTO threads (id, name, subject, email, magnet_url, tags, content, "
+                    "parent_thread_id, sender, timestamp, whitelisted, blacklisted, deleted, bump, block_number) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    (thread["id"], thread["name"], thread["subject"], thread["email"], thread["magnet_url"],
+                     thread["tags"], thread["content"], thread["parent_thread_id"], thread["sender"],
+                     thread["timestamp"], thread["whitelisted"], thread["blacklisted"], thread["deleted"],
+                     max(thread["timestamp"], latest_reply, latest_child), block),
+                )
+                if thread["parent_thread_id"]:
+                    conn.execute("UPDATE threads SET bump = MAX(bump, ?) WHERE id = ?",
+                                 (thread["timestamp"], thread["parent_thread_id"]))
+                conn.execute("DELETE FROM thread_tags WHERE thread_id = ?", (thread["id"],))
+                conn.executemany("INSERT OR IGNORE INTO thread_tags (tag, thread_id) VALUES (?, ?)",
+                                 [(tag.strip(), thread["id"]) for tag in json.loads(thread["tags"]) if tag.strip()])
+
+            for thread_id in deleted_threads:
+                conn.execute("UPDATE threads SET deleted = 1, block_number = ? WHERE id = ?", (block, thread_id))
+
+            thread_ids, reply_ids = self._posts_by_sender(conn, changed_bans)
+            thread_ids.update(thread["id"] for thread in threads)
+            thread_ids.update(deleted_threads)
+            reply_ids.update(reply["id"] for reply in replies)
+            moderation.refresh()
+            self._refresh_visibility(conn, thread_ids, reply_ids)
+
+            state = dict(extra_state or {}, checkpoint=block)
+            conn.executemany("INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)", state.items())
+            conn.execute("INSERT OR REPLACE INTO blocks (number, hash) VALUES (?, ?)", (block, block_hash))
+            conn.execute("DELETE FROM blocks WHERE number NOT IN "
+                         "(SELECT number FROM blocks ORDER BY number DESC LIMIT ?)", (BLOCK_HISTORY,))
+
+    # Visibility
+
+    def _refresh_visibility(self, conn, thread_ids=(), reply_ids=()):
+        """Recompute the visibility rows of some posts inside a write transaction."""
+        lists = moderation.sets
+        for kind, table, ids in (("thread", "threads", thread_ids), ("reply", "replies", reply_ids)):
+            for batch in chunked(set(ids), LOOKUP_BATCH):
+                marks = ",".join("?" * len(batch))
+                rows = conn.execute(
+                    f"SELECT p.*, COALESCE(b.banned, 0) AS sender_banned FROM {table} AS p "
+                    f"LEFT JOIN banned AS b ON b.address = lower(p.sender) WHERE p.id IN ({marks})",
+                    batch,
+                ).fetchall()
+                tags = {}
+                if kind == "thread":
+                    for row in conn.execute(f"SELECT thread_id, tag FROM thread_tags WHERE thread_id IN ({marks})", batch):
+                        tags.setdefault(row["thread_id"], []).append(row["tag"])
+                conn.executemany(
+                    "INSERT OR REPLACE INTO visibility (kind, id, visible, reason) VALUES (?, ?, ?, ?)",
+                    [(kind, row["id"], *visibility(row, tags.get(row["id"], ()), row["sender_banned"], lists))
+                     for row in rows],
+                )
+
+    def _posts_by_sender(self, conn, addresses):
+        """Thread and reply ids of posts sent from any of the (lowercased) addresses."""
+        thread_ids, reply_ids = set(), set()
+        for batch in chunked(addresses, LOOKUP_BATCH):
+            marks = ",".join("?" * len(batch))
+            thread_ids.update(row[0] for row in conn.execute(
+                f"SELECT id FROM threads WHERE lower(sender) IN ({marks})", batch))
+            reply_ids.update(row[0] for row in conn.execute(
+                f"SELECT id FROM replies WHERE lower(sender) IN ({marks})", batch))
+        return thread_ids, reply_ids
+
+    def rebuild_visibility(self):
+        """Recompute every post's visibility, a page at a time."""
+        for kind, table in (("thread", "threads"), ("reply", "replies")):
+            after = 0
+            while True:
+                ids = [row["id"] for row in self.db.query(
+                    f"SELECT id FROM {table} WHERE id > ? ORDER BY id LIMIT 5000", (after,))]
+                if not ids:
+                    break
+                with self.db.transaction() as conn:
+                    self._refresh_visibility(conn, ids if kind == "thread" else (), ids if kind == "reply" else ())
+                after = ids[-1]
+
+    def apply_moderation(self, changes):
+        """Recompute the posts whose magnet, sender or tags match a batch of moderation changes."""
+        values = {"magnet": set(), "user": set(), "tag": set()}
+        for change in changes:
+            values[change["kind"]].add(change["value"])
+        with self.db.transaction() as conn:
+            thread_ids, reply_ids = self._posts_by_sender(conn, values["user"])
+            for batch in chunked(values["magnet"], LOOKUP_BATCH):
+                marks = ",".join("?" * len(batch))
+                thread_ids.update(row[0] for row in conn.execute(
+                    f"SELECT id FROM threads WHERE magnet_url IN ({marks})", batch))
+                reply_ids.update(row[0] for row in conn.execute(
+                    f"SELECT id FROM replies WHERE magnet_url IN ({marks})", batch))
+            for batch in chunked(values["tag"], LOOKUP_BATCH):
+                thread_ids.update(row[0] for row in conn.execute(
+                    f"SELECT thread_id FROM thread_tags WHERE tag IN ({','.join('?' * len(batch))})", batch))
+            self._refresh_visibility(conn, thread_ids, reply_ids)
+        return len(thread_ids) + len(reply_ids)
+
+    def follow_moderation(self, interval=0.05):
+        """Keep visibility in step with the moderation store, applying its changes in batches."""
+        changes = queue.Queue()
+        moderation.subscribe(changes.put)
+        moderation.refresh(force=True)
+        # Changes from before we subscribed are covered by a full pass
+        self.rebuild_visibility()
+        while True:
+            try:
+                moderation.refresh(force=True)
+                batch = []
+                while not changes.empty():
+                    batch.append(changes.get())
+                if batch:
+                    touched = self.apply_moderation(batch)
+                    logging.info(f"Applied {len(batch)} moderation changes to {touched} posts")
+            except Exception as e:
+                logging.error(f"Visibility update failed: {e}")
+            time.sleep(interval)
+
+    # Sync steps
+
+    def backfill(self, block):
+        """Read every thread and reply by id as of block."""
+        thread_count, reply_count = self.counts(block)
+        logging.info(f"Backfilling {thread_count} threads and {reply_count} replies at block {block}")
+
+        threads, deleted = self.fetch_threads(range(1, thread_count + 1), block)
+        replies = self.fetch_replies(range(1, reply_count + 1), block)
+        bans = self.fetch_bans([post["sender"] for post in (*threads, *replies)], block)
+        self._write(block, threads, deleted, replies, {"reply_count": reply_count}, bans)
+
+    def rollback(self):
+        """Detect a reorg behind the checkpoint and rewind to the last block still on the chain."""
+        stored = self.db.query("SELECT number, hash FROM blocks ORDER BY number DESC")
+        if not stored or self.block_hash(stored[0]["number"]) == stored[0]["hash"]:
+            return False
+
+        fork = None
+        for row in stored[1:]:
+            if self.block_hash(row["number"]) == row["hash"]:
+                fork = row["number"]
+                break
+        if fork is None:
+            # Reorged deeper than the hashes we keep: start over from a fresh backfill
+            logging.error("Reorg deeper than the stored block history, re-indexing")
+            with self.db.transaction() as conn:
+                for table in ("threads", "replies", "thread_tags", "banned", "visibility", "blocks", "state"):
+                    conn.execute(f"DELETE FROM {table}")
+            return True
+
+        logging.warning(f"Chain reorg detected, rolling back from block {stored[0]['number']} to {fork}")
+        thread_count, reply_count = self.counts(fork)
+        stale_threads = [row["id"] for row in self.db.query(
+            "SELECT id FROM threads WHERE block_number > ? AND id <= ?", (fork, thread_count))]
+        stale_replies = [row["id"] for row in self.db.query(
+            "SELECT id FROM replies WHERE block_number > ? AND id <= ?", (fork, reply_count))]
+
+        threads, deleted = self.fetch_threads(stale_threads, fork)
+        replies = self.fetch_replies(stale_replies, fork)
+
+        with self.db.transaction() as conn:
+            # Anything created after the fork point no longer exists
+            conn.execute("DELETE FROM threads WHERE id > ?", (thread_count,))
+            conn.execute("DELETE FROM replies WHERE id > ?", (reply_count,))
+            conn.execute("DELETE FROM thread_tags WHERE thread_id > ?", (thread_count,))
+            conn.execute("DELETE FROM visibility WHERE kind = 'thread' AND id > ?", (thread_count,))
+            conn.execute("DELETE FROM visibility WHERE kind = 'reply' AND id > ?", (reply_count,))
+            conn.execute("DELETE FROM blocks WHERE number > ?", (fork,))
+        self._write(fork, threads, deleted, replies, {"reply_count": reply_count})
+
+        # Bumps may have come from replies that are gone now
+        self.db.execute(
+            "UPDATE threads SET bump = MAX(timestamp, "
+            "COALESCE((SELECT MAX(timestamp) FROM replies WHERE parent_id = threads.id AND deleted = 0), 0), "
+            "COALESCE((SELECT MAX(c.timestamp) FROM threads AS c WHERE c.parent_thread_id = threads.id "
+            "AND c.deleted = 0), 0))"
+        )
+        return True
+
+    def sync_once(self):
+        """Index the next block range; returns True while the index is still behind the chain."""
+        head = self.w3.eth.block_number - self.confirmations
+        if self.checkpoint() is None:
+            self.backfill(head)
+            return False
+
+        self.rollback()
+        checkpoint = self.checkpoint()
+        if checkpoint is None:
+            return True
+        if head <= checkpoint:
+            return False
+
+        start, end = checkpoint + 1, min(head, checkpoint + self.log_batch)
+        logs = self.w3.eth.get_logs({
+            "address": self.thread_contract.address,
+            "fromBlock": start,
+            "toBlock": end,
+        })
+
+        changed, deleted = set(), set()
+        for log in logs:
+            name = self.thread_topics.get(log["topics"][0].hex().removeprefix("0x"))
+            if name is None:
+                continue
+            event = self.thread_contract.events[name]().process_log(log)
+            if name == "ThreadDeleted":
+                deleted.add(event["args"]["id"])
+            else:
+                changed.add(event["args"]["id"])
+
+        threads, gone = self.fetch_threads(sorted(changed - deleted), end)
+        deleted.update(gone)
+
+        # New replies, plus a slice of existing ones to pick up moderation changes
+        _, reply_count = self.counts(end)
+        known = self._state("reply_count", 0)
+        sweep = self._state("reply_sweep", 0)
+        reply_ids = list(range(known + 1, reply_count + 1))
+        if known:
+            sweep_ids = [(sweep + i) % known + 1 for i in range(min(REPLY_SWEEP_BATCH, known))]
+            reply_ids += sweep_ids
+            sweep = sweep_ids[-1] % known
+        replies = self.fetch_replies(dict.fromkeys(reply_ids), end)
+
+        # Ban status of new senders, plus a slice of known ones
+        senders = self.unchecked_senders(threads, replies)
+        ban_sweep = self._state("ban_sweep", 0)
+        known_senders = [row["address"] for row in self.db.query(
+            "SELECT address FROM banned ORDER BY address LIMIT ? OFFSET ?", (BAN_SWEEP_BATCH, ban_sweep))]
+        bans = self.fetch_bans(senders + known_senders, end)
+        ban_sweep = ban_sweep + len(known_senders) if len(known_senders) == BAN_SWEEP_BATCH else 0
+
+        self._write(end, threads, deleted, replies,
+                    {"reply_count": reply_count, "reply_sweep": sweep, "ban_sweep": ban_sweep}, bans)
+        if logs or reply_count > known:
+            logging.info(f"Indexed blocks {start}-{end}: {len(threads)} threads, {len(deleted)} deletions, "
+                         f"{reply_count - known} new replies")
+        return end < head
+
+    def run(self):
+        backoff = self.poll_interval
+        while True:
+            try:
+                behind = self.sync_once()
+                backoff = self.poll_interval
+            except Exception as e:
+                logging.error(f"Chain indexer error: {e}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, 60)
+                continue
+            if not behind:
+                time.sleep(self.poll_interval)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True).start()
+        threading.Thread(target=self.follow_moderation, daemon=True).start()
+
+
+chain_indexer = ChainIndexer(
+    app.config["CHAIN_DB"],
+    web3,
+    contract_reader,
+    confirmations=app.config["CHAIN_CONFIRMATIONS"],
+    log_batch=app.config["CHAIN_LOG_BATCH"],
+    poll_interval=app.config["CHAIN_POLL_INTERVAL"],
+)
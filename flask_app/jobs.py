@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import uuid
+import logging
+import threading
+from shared import app
+from db import Database
+from control import ControlError
+from seeder import seed_engine
+from store import content_store
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    status TEXT NOT NULL,
+    stages TEXT NOT NULL,
+    info_hash TEXT,
+    magnet_url TEXT,
+    error TEXT,
+    final INTEGER NOT NULL DEFAULT 0,
+    created REAL NOT NULL,
+    updated REAL NOT NULL
+);
+"""
+
+# Progress stages, in the order they are reached
+STAGES = ("stored", "hashed", "torrent_built", "announced", "first_peer")
+
+
+class UploadJobs:
+    """Background upload jobs, kept in SQLite so any worker can report on them.
+
+    A job is "done" once its torrent is announced. It keeps watching for the
+    first peer for first_peer_timeout seconds and is final after that.
+    """
+
+    def __init__(self, db_path, announce_timeout=60, first_peer_timeout=300, poll_interval=1):
+        self.db = Database(db_path, SCHEMA)
+        self.announce_timeout = announce_timeout
+        self.first_peer_timeout = first_peer_timeout
+        self.poll_interval = poll_interval
+
+    def get(self, job_id):
+        """Return a job as a dict, or None."""
+        row = self.db.query_one("SELECT * FROM jobs WHERE id = ?", (job_id,))
+        if row is None:
+            return None
+        job = dict(row)
+        job["stages"] = json.loads(job["stages"])
+        job["stage"] = [stage for stage in STAGES if stage in job["stages"]][-1]
+        job["final"] = bool(job["final"])
+        return job
+
+    def _update(self, job_id, stage=None, **fields):
+        with self.db.transaction() as conn:
+            if stage:
+                stages = json.loads(conn.execute("SELECT stages FROM jobs WHERE id = ?", (job_id,)).fetchone()["stages"])
+                stages.setdefault(stage, time.time())
+                fields["stages"] = json.dumps(stages)
+            fields["updated"] = time.time()
+            assignments = ", ".join(f"{name} = ?" for name in fields)
+            conn.execute(f"UPDATE jobs SET {assignments} WHERE id = ?", (*fields.values(), job_id))
+
+    def submit(self, upload):
+        """Register a job for an upload whose body is already on disk and finish it in the background."""
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        # The body was hashed while it was streamed in, so both stages are done
+        stages = {"stored": now, "hashed": now}
+        self.db.execute(
+            "INSERT INTO jobs (id, status, stages, created, updated) VALUES (?, 'running', ?, ?, ?)",
+            (job_id, json.dumps(stages), now, now),
+        )
+        threading.Thread(target=self._run, args=(job_id, upload), daemon=True).start()
+        return job_id
+
+    def _run(self, job_id, upload):
+        try:
+            torrent = content_store.put(upload)
+        except Exception as e:
+            logging.error(f"Upload job {job_id} failed: {e}")
+            if os.path.exists(upload["path"]):
+                os.remove(upload["path"])
+            self._update(job_id, status="failed", error=str(e), final=1)
+            return
+
+        self._update(job_id, "torrent_built", info_hash=torrent["info_hash"], magnet_url=torrent["magnet_url"])
+
+        started = time.time()
+        announced = False
+        while True:
+            elapsed = time.time() - started
+            try:
+                status = seed_engine.status(torrent["info_hash"])
+            except ControlError:
+                # The daemon may not have picked the torrent up yet
+                status = {}
+
+            if not announced and status.get("announcedAt"):
+                announced = True
+                self._update(job_id, "announced", status="done")
+            if status.get("firstPeerAt"):
+                self._update(job_id, "first_peer", status="done", final=1)
+                return
+
+            if not announced and elapsed > self.announce_timeout:
+                self._update(job_id, status="failed", error="Torrent was not announced in time", final=1)
+                return
+            if elapsed > self.first_peer_timeout:
+                self._update(job_id, final=1)
+                return
+            time.sleep(self.poll_interval)
+
+    def events(self, job_id, poll_interval=0.5, timeout=600):
+        """Yield the job every time it changes, until it is final."""
+        last = None
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            job = self.get(job_id)
+            if job is None:
+                return
+            if job["updated"] != last:
+                last = job["updated"]
+                yield job
+            if job["final"]:
+                return
+            time.sleep(poll_interval)
+
+
+upload_jobs = UploadJobs(app.config["JOBS_DB"])
@@ -0,0 +1,280 @@
+import os
+import time
+import logging
+import threading
+from shared import app, BLACKLIST_FILE, WHITELIST_FILE, load_blacklist, load_whitelist
+from db import Database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    list TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    added REAL NOT NULL,
+    PRIMARY KEY (list, kind, value)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS changes (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    list TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    op TEXT NOT NULL,
+    at REAL NOT NULL
+);
+"""
+
+LISTS = ("blacklist", "whitelist")
+KINDS = ("tag", "magnet", "user")
+
+
+def normalize(kind, value):
+    """Canonical form of an entry: surrounding whitespace dropped, addresses lowercased."""
+    value = str(value).strip()
+    return value.lower() if kind == "user" else value
+
+
+class ModerationStore:
+    """Blacklists and whitelists of tags, magnet URLs and users, shared by every worker.
+
+    Entries are a set per (list, kind) in SQLite; every add or remove that
+    changes one is also appended to the changes log. Each worker keeps the
+    sets in memory for O(1) membership tests and brings them up to date by
+    replaying the log whenever SQLite reports a commit from another
+    connection, checked at most every refresh_interval seconds. Callbacks
+    registered with subscribe see each change as it is replayed.
+
+    The first worker to open an empty store imports blacklist.json and
+    whitelist.json.
+    """
+
+    def __init__(self, db_path, refresh_interval=0.005):
+        self.db = Database(db_path, SCHEMA)
+        self.refresh_interval = refresh_interval
+        self.sets = {(list_name, kind): set() for list_name in LISTS for kind in KINDS}
+        self.seq = 0
+        self._subscribers = []
+        self._version = None
+        self._checked = 0
+        self._pid = None
+        self._lock = threading.RLock()
+        self._latest = (None, 0, 0)  # (data_version, latest seq, when checked), see latest_seq
+
+    @staticmethod
+    def _check(list_name, kind):
+        if list_name not in LISTS:
+            raise ValueError(f"Unknown list: {list_name!r}")
+        if kind not in KINDS:
+            raise ValueError(f"Unknown kind: {kind!r}")
+
+    def _load(self):
+        """Import the legacy JSON lists if needed, then read everything into memory."""
+        with self.db.transaction() as conn:
+            if conn.execute("SELECT seq FROM changes LIMIT 1").fetchone() is None:
+                self._import(conn, "blacklist", load_blacklist(), BLACKLIST_FILE)
+                self._import(conn, "whitelist", load_whitelist(), WHITELIST_FILE)
+        for sets in self.sets.values():
+            sets.clear()
+        self.seq = self.db.query_one("SELECT COALESCE(MAX(seq), 0) FROM changes")[0]
+        for row in self.db.query("SELECT list, kind, value FROM entries"):
+            self.sets[(row["list"], row["kind"])].add(row["value"])
+        # Anything committed between the two reads is replayed; replaying is idempotent
+        self._pull()
+        self._version = self.db.query_one("PRAGMA data_version")[0]
+        self._pid = os.getpid()
+
+    def _import(self, conn, list_name, data, path):
+        count = 0
+        for kind in KINDS:
+            for value in data.get(f"{kind}s", []):
+                count += self._write(conn, list_name, kind, normalize(kind, value), "add", time.time())
+        if count:
+            logging.info(f"Imported {count} entries from {path} into the moderation store")
+
+    @staticmethod
+    def _write(conn, list_name, kind, value, op, now):
+        """Apply one change inside a transaction; returns whether the set changed."""
+        if op == "add":
+            changed = conn.execute(
+                "INSERT OR IGNORE INTO entries (list, kind, value, added) VALUES (?, ?, ?, ?)",
+                (list_name, kind, value, now),
+            ).rowcount
+        else:
+            changed = conn.execute(
+                "DELETE FROM entries WHERE list = ? AND kind = ? AND value = ?", (list_name, kind, value)
+            ).rowcount
+        if changed:
+            conn.execute(
+                "INSERT INTO changes (list, kind, value, op, at) VALUES (?, ?, ?, ?, ?)",
+                (list_name, kind, value, op, now),
+            )
+        return bool(changed)
+
+    def _pull(self):
+        """Replay the changes log past the last seq seen by this worker."""
+        self._replay(self.db.query("SELECT * FROM changes WHERE seq > ? ORDER BY seq", (self.seq,)))
+
+    def _replay(self, rows):
+        for row in rows:
+            entries = self.sets[(row["list"], row["kind"])]
+            if row["op"] == "add":
+                entries.add(row["value"])
+            else:
+                entries.discard(row["value"])
+            self.seq = row["seq"]
+            for callback in self._subscribers:
+                try:
+                    callback(dict(row))
+                except Exception as e:
+                    logging.error(f"Moderation subscriber failed on change {row['seq']}: {e}")
+
+    def refresh(self, force=False):
+        """Catch up with changes committed by other workers."""
+        with self._lock:
+            if self._pid != os.getpid():
+                # First use in this process (gunicorn forks after import)
+                self._load()
+                return
+            now = time.monotonic()
+            if not force and now - self._checked < self.refresh_interval:
+                return
+            self._checked = now
+            version = self.db.query_one("PRAGMA data_version")[0]
+            if version != self._version:
+                self._version = version
+                self._pull()
+
+    def subscribe(self, callback):
+        """Call callback(change) for every change this worker replays from now on.
+
+        A change is a dict with seq, list, kind, value, op ("add" or "remove") and at.
+        """
+        with self._lock:
+            self._subscribers.append(callback)
+
+    def bulk(self, list_name, items):
+        """Apply (kind, op, value) items to one list in a single transaction, in order.
+
+        Returns one result per item: "added", "exists", "removed" or "missing".
+        Membership is decided from the in-memory sets, brought up to date
+        under the write lock, and entries are written with executemany, so
+        100k items take about a second.
+        """
+        items = list(items)
+        for kind, op, _ in items:
+            self._check(list_name, kind)
+            if op not in ("add", "remove"):
+                raise ValueError(f"Unknown operation: {op!r}")
+        items = [(kind, op, normalize(kind, value)) for kind, op, value in items]
+        self.refresh()
+        now = time.time()
+        with self._lock:
+            with self.db.transaction() as conn:
+                # Holding the write lock, catch up with other workers: the in-memory
+                # sets are then exact and can stand in for lookups in SQLite
+                self._replay(conn.execute("SELECT * FROM changes WHERE seq > ? ORDER BY seq", (self.seq,)).fetchall())
+                last_seq = conn.execute(
+                    "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'changes'"
+                ).fetchone()[0]
+
+                results, log, touched = [], [], {}
+                for kind, op, value in items:
+                    key = (kind, value)
+                    if key not in touched:
+                        touched[key] = value in self.sets[(list_name, kind)]
+                    listed = touched[key]
+                    if op == "add" and not listed:
+                        results.append("added")
+                    elif op == "remove" and listed:
+                        results.append("removed")
+                    else:
+                        results.append("exists" if op == "add" else "missing")
+                        continue
+                    touched[key] = op == "add"
+                    log.append((list_name, kind, value, op, now))
+
+                # Net effect per entry, in key order so the b-tree is written front to back
+                final = sorted((key, present) for key, present in touched.items()
+                               if present != (key[1] in self.sets[(list_name, key[0])]))
+                conn.executemany(
+                    "INSERT INTO entries (list, kind, value, added) VALUES (?, ?, ?, ?)",
+                    [(list_name, kind, value, now) for (kind, value), present in final if present],
+                )
+                conn.executemany(
+                    "DELETE FROM entries WHERE list = ? AND kind = ? AND value = ?",
+                    [(list_name, kind, value) for (kind, value), present in final if not present],
+                )
+                conn.executemany("INSERT INTO changes (list, kind, value, op, at) VALUES (?, ?, ?, ?, ?)", log)
+            # The write lock was held throughout, so our changes got the next seqs in order
+            self._replay({"seq": last_seq + i, "list": list_name, "kind": kind, "value": value, "op": op, "at": at}
+                         for i, (_, kind, value, op, at) in enumerate(log, 1))
+        return results
+
+    def apply(self, list_name, kind, op, values):
+        """Add or remove values in one transaction; returns, per value, whether it changed the set."""
+        return [result in ("added", "removed") for result in self.bulk(list_name, [(kind, op, v) for v in values])]
+
+    def add(self, list_name, kind, value):
+        """Add one entry; False if it was already listed."""
+        return self.apply(list_name, kind, "add", [value])[0]
+
+    def remove(self, list_name, kind, value):
+        """Remove one entry; False if it was not listed."""
+        return self.apply(list_name, kind, "remove", [value])[0]
+
+    def latest_seq(self):
+        """Seq of the newest change committed by any worker, without loading the lists.
+
+        Re-reads it only when SQLite reports a commit, checked at most every refresh_interval seconds.
+        """
+        with self._lock:
+            version, seq, checked = self._latest
+            now = time.monotonic()
+            if now - checked >= self.refresh_interval:
+                current = self.db.query_one("PRAGMA data_version")[0]
+                if current != version:
+                    seq = self.db.query_one(
+                        "SELECT COALESCE(MAX(seq), 0) FROM sqlite_sequence WHERE name = 'changes'"
+                    )[0]
+                self._latest = (current, seq, now)
+            return max(seq, self.seq if self._pid == os.getpid() else 0)
+
+    def lookup(self, list_name, kind, value):
+        """Exact membership straight from SQLite, for processes that don't keep the lists in memory."""
+        self._check(list_name, kind)
+        return self.db.query_one(
+            "SELECT 1 FROM entries WHERE list = ? AND kind = ? AND value = ?",
+            (list_name, kind, normalize(kind, value)),
+        ) is not None
+
+    def contains(self, list_name, kind, value):
+        self.refresh()
+        return normalize(kind, value) in self.sets[(list_name, kind)]
+
+    def entries(self, list_name, kind=None, after=None, limit=5000):
+        """One page of a list straight from SQLite, ordered by (kind, value) and starting after the key given."""
+        if list_name not in LISTS:
+            raise ValueError(f"Unknown list: {list_name!r}")
+        where, params = ["list = ?"], [list_name]
+        if kind is not None:
+            self._check(list_name, kind)
+            where.append("kind = ?")
+            params.append(kind)
+        if after is not None:
+            where.append("(kind, value) > (?, ?)")
+            params += list(after)
+        rows = self.db.query(
+            f"SELECT kind, value, added FROM entries WHERE {' AND '.join(where)} ORDER BY kind, value LIMIT ?",
+            (*params, limit),
+        )
+        return [dict(row) for row in rows]
+
+    def export(self, list_name):
+        """The whole list in the blacklist.json layout: {"tags": [...], "magnets": [...], "users": [...]}."""
+        if list_name not in LISTS:
+            raise ValueError(f"Unknown list: {list_name!r}")
+        self.refresh()
+        with self._lock:
+            return {f"{kind}s": sorted(self.sets[(list_name, kind)]) for kind in KINDS}
+
+
+moderation = ModerationStore(app.config["MODERATION_DB"])
@@ -0,0 +1,207 @@
+import os
+import math
+import mmap
+import time
+import struct
+import hashlib
+import logging
+from shared import app
+from moderation import moderation, normalize
+
+MAGIC = b"GRMBLOOM"
+# magic, bits, hashes, entries, stale entries, seq of the last change included
+HEADER = struct.Struct("<8sQQQQQ")
+
+
+class BloomFilter:
+    """A Bloom filter in a file, mapped into memory so every process shares one copy.
+
+    Bits are only ever set, so a reader needs no locking; the seq in the
+    header tells which prefix of the moderation change log the bits cover.
+    """
+
+    def __init__(self, path, writable=False):
+        self.path = path
+        with open(path, "r+b" if writable else "rb") as f:
+            self.inode = os.fstat(f.fileno()).st_ino
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        magic, self.bits, self.hashes, _, _, _ = HEADER.unpack_from(self.map)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a moderation filter")
+
+    @classmethod
+    def create(cls, path, capacity, error_rate=0.01):
+        """Write an empty filter sized for capacity entries at error_rate; returns it, writable."""
+        bits = max(8 * 4096, math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        bits += -bits % 8
+        hashes = max(1, round(bits / capacity * math.log(2)))
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(HEADER.pack(MAGIC, bits, hashes, 0, 0, 0))
+            f.truncate(HEADER.size + bits // 8)
+        bloom = cls(tmp_path, writable=True)
+        bloom.path = path
+        return bloom
+
+    @property
+    def entries(self):
+        return HEADER.unpack_from(self.map)[3]
+
+    @property
+    def stale(self):
+        return HEADER.unpack_from(self.map)[4]
+
+    @property
+    def seq(self):
+        return HEADER.unpack_from(self.map)[5]
+
+    def set_counts(self, entries, stale, seq):
+        # Written after the bits they describe, so a reader never trusts bits that are not there yet
+        struct.pack_into("<QQQ", self.map, HEADER.size - 24, entries, stale, seq)
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=16).digest()
+        h1, h2 = struct.unpack("<QQ", digest)
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            offset = HEADER.size + position // 8
+            self.map[offset] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        return all(self.map[HEADER.size + position // 8] & (1 << (position % 8))
+                   for position in self._positions(key))
+
+    def close(self):
+        self.map.close()
+
+
+def filter_key(list_name, kind, value):
+    return f"{list_name}\0{kind}\0{value}"
+
+
+class ModerationFilter:
+    """Cheap negative answers for moderation checks on hot paths (static files, seeding, live streams).
+
+    One process (see maintain) keeps a Bloom filter of every list entry in a
+    file that all workers map read-only. A miss in a filter that has caught
+    up with the change log means "not listed"; only hits, and checks made
+    while the filter is behind, go to SQLite. Adds are set in place as they
+    are committed. Removals cannot be taken out of a Bloom filter, so they
+    only make it stale; it is rebuilt from scratch into a new file, swapped
+    in with a rename, once a fifth of it is stale or it holds more entries
+    than it was sized for.
+    """
+
+    def __init__(self, path, store, error_rate=0.01, reopen_interval=1):
+        self.path = os.path.abspath(path)
+        self.store = store
+        self.error_rate = error_rate
+        self.reopen_interval = reopen_interval
+        self._bloom = None
+        self._opened = 0
+
+    # Reading (every worker)
+
+    def _current(self):
+        """The mapped filter, remapped when the maintainer swapped in a rebuilt one."""
+        now = time.monotonic()
+        if now - self._opened >= self.reopen_interval:
+            self._opened = now
+            try:
+                inode = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                inode = None
+            if self._bloom is None or self._bloom.inode != inode:
+                try:
+                    self._bloom = BloomFilter(self.path) if inode is not None else None
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Moderation filter unavailable: {e}")
+                    self._bloom = None
+        return self._bloom
+
+    def contains(self, list_name, kind, value):
+        """Exact membership, answered from the filter alone when it can rule the entry out."""
+        value = normalize(kind, value)
+        if not value:
+            return False
+        bloom = self._current()
+        if (bloom is not None and bloom.seq >= self.store.latest_seq()
+                and filter_key(list_name, kind, value) not in bloom):
+            return False
+        return self.store.lookup(list_name, kind, value)
+
+    def blocked(self, magnet=None, user=None, tags=()):
+        """Whether the local blacklist hides content with this magnet, sender or tags, and the whitelist does not save it."""
+        candidates = [("magnet", magnet), ("user", user)] + [("tag", tag) for tag in tags]
+        candidates = [(kind, value) for kind, value in candidates if value]
+        if not any(self.contains("blacklist", kind, value) for kind, value in candidates):
+            return False
+        return not any(self.contains("whitelist", kind, value) for kind, value in candidates)
+
+    # Maintaining (one process, see app.py)
+
+    def rebuild(self):
+        """Build a fresh filter from the entries table and swap it in."""
+        seq = self.store.db.query_one("SELECT COALESCE(MAX(seq), 0) FROM changes")[0]
+        count = self.store.db.query_one("SELECT COUNT(*) FROM entries")[0]
+        bloom = BloomFilter.create(self.path, max(2 * count, 65536), self.error_rate)
+        after = None
+        while True:
+            if after is None:
+                rows = self.store.db.query("SELECT list, kind, value FROM entries ORDER BY list, kind, value LIMIT 10000")
+            else:
+                rows = self.store.db.query(
+                    "SELECT list, kind, value FROM entries WHERE (list, kind, value) > (?, ?, ?) "
+                    "ORDER BY list, kind, value LIMIT 10000", after)
+            if not rows:
+                break
+            for row in rows:
+                bloom.add(filter_key(row["list"], row["kind"], row["value"]))
+            after = tuple(rows[-1])
+        # Entries committed while we read are replayed by the next update
+        bloom.set_counts(count, 0, seq)
+        bloom.map.flush()
+        os.replace(f"{self.path}.tmp", self.path)
+        logging.info(f"Rebuilt the moderation filter: {count} entries, {bloom.bits // 8} bytes")
+        return bloom
+
+    def update(self, bloom):
+        """Fold changes past the filter's seq into it; returns the filter to use from now on."""
+        rows = self.store.db.query(
+            "SELECT seq, list, kind, value, op FROM changes WHERE seq > ? ORDER BY seq LIMIT 100000", (bloom.seq,))
+        if not rows:
+            return bloom
+        entries, stale = bloom.entries, bloom.stale
+        for row in rows:
+            if row["op"] == "add":
+                bloom.add(filter_key(row["list"], row["kind"], row["value"]))
+                entries += 1
+            else:
+                stale += 1
+        bloom.set_counts(entries, stale, rows[-1]["seq"])
+        capacity = bloom.bits * math.log(2) ** 2 / -math.log(self.error_rate)
+        if stale * 5 > entries or entries - stale > capacity:
+            bloom.close()
+            return self.rebuild()
+        return bloom
+
+    def maintain(self, interval=0.02):
+        """Keep the filter file in step with the change log; run from a single process."""
+        try:
+            bloom = BloomFilter(self.path, writable=True)
+        except (OSError, ValueError):
+            bloom = None
+        while True:
+            try:
+                if bloom is None:
+                    bloom = self.rebuild()
+                bloom = self.update(bloom)
+            except Exception as e:
+                logging.error(f"Moderation filter update failed: {e}")
+                bloom = None
+            time.sleep(interval)
+
+
+moderation_filter = ModerationFilter(app.config["MODERATION_FILTER"], moderation)
@@ -0,0 +1,234 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import requests
+from requests.adapters import HTTPAdapter
+from web3 import Web3
+from web3.providers import JSONBaseProvider
+from shared import app
+
+
+class RPCError(Exception):
+    """A JSON-RPC request failed for a reason other than the call reverting."""
+
+
+def size_class(calls):
+    """Bucket a request by how many calls it carries: 1, 2-3, 4-7, ... (powers of two)."""
+    return max(1, calls).bit_length()
+
+
+class Endpoint:
+    """One RPC URL with its EWMA latency/error rate and a circuit breaker.
+
+    Besides the overall latency used for ranking, a latency is kept per
+    request size class, since a 500-call batch takes far longer than a
+    single call and must not be measured against it.
+
+    The breaker opens after failure_threshold consecutive failures. While open
+    the endpoint gets no traffic; after the cooldown one probe request is let
+    through (half-open) and its outcome closes or re-opens the breaker, with
+    the cooldown doubling each time up to max_cooldown.
+    """
+
+    def __init__(self, url, alpha=0.2, failure_threshold=5, cooldown=10, max_cooldown=300):
+        self.url = url
+        self.alpha = alpha
+        self.failure_threshold = failure_threshold
+        self.base_cooldown = cooldown
+        self.cooldown = cooldown
+        self.max_cooldown = max_cooldown
+
+        self.latency = None  # EWMA seconds; None until the first request completes
+        self.latency_by_size = {}  # size_class -> EWMA seconds
+        self.error_rate = 0.0
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.open_until = 0
+        self.probing = False
+
+        self.requests = 0
+        self.failures = 0
+        self.hedged = 0
+        self.trips = 0
+        self._lock = threading.Lock()
+
+    def available(self):
+        """Whether a request may be sent now; claims the probe slot of a half-open breaker."""
+        with self._lock:
+            if self.state == "closed":
+                return True
+            if time.time() < self.open_until or self.probing:
+                return False
+            self.state = "half-open"
+            self.probing = True
+            return True
+
+    def _ewma(self, previous, sample):
+        return sample if previous is None else self.alpha * sample + (1 - self.alpha) * previous
+
+    def record_success(self, elapsed, calls=1):
+        with self._lock:
+            self.requests += 1
+            self.latency = self._ewma(self.latency, elapsed)
+            bucket = size_class(calls)
+            self.latency_by_size[bucket] = self._ewma(self.latency_by_size.get(bucket), elapsed)
+            self.error_rate = (1 - self.alpha) * self.error_rate
+            self.consecutive_failures = 0
+            if self.state != "closed":
+                logging.info(f"RPC endpoint {self.url} recovered")
+            self.state = "closed"
+            self.probing = False
+            self.cooldown = self.base_cooldown
+
+    def record_failure(self):
+        with self._lock:
+            self.requests += 1
+            self.failures += 1
+            self.error_rate = self.alpha + (1 - self.alpha) * self.error_rate
+            self.consecutive_failures += 1
+            if self.state == "open":
+                # A request sent before the breaker tripped
+                return
+            if self.state == "half-open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state == "half-open":
+                    self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+                self.state = "open"
+                self.open_until = time.time() + self.cooldown
+                self.probing = False
+                self.trips += 1
+                logging.warning(f"RPC endpoint {self.url} tripped, retrying in {self.cooldown}s")
+
+    def score(self):
+        """Lower is better: latency penalized by recent errors. Untried endpoints go first.
+
+        The additive term makes an endpoint that has only ever failed (and so
+        has no latency yet) lose to any endpoint that answers.
+        """
+        return (self.latency or 0) * (1 + 4 * self.error_rate) + self.error_rate
+
+    def metrics(self):
+        return {
+            "url": self.url,
+            "state": self.state,
+            "latency_ms": None if self.latency is None else round(self.latency * 1000, 1),
+            "error_rate": round(self.error_rate, 4),
+            "requests": self.requests,
+            "failures": self.failures,
+            "hedged": self.hedged,
+            "trips": self.trips,
+        }
+
+
+class ProviderPool:
+    """Route JSON-RPC requests across several endpoints.
+
+    Each request goes to the best-scoring available endpoint. If it has not
+    answered after hedge_factor times that endpoint's EWMA latency for
+    requests of its size (at least hedge_min seconds) the same request is
+    also sent to the next endpoint and the first answer wins; a size the
+    endpoint has not answered yet is not hedged, so the first large batches
+    are not doubled on a guess. Failed requests fail over to the next endpoint.
+    """
+
+    def __init__(self, urls, timeout=30, hedge_factor=3, hedge_min=0.25, max_concurrency=16):
+        if not urls:
+            raise ValueError("At least one RPC URL is required")
+        self.endpoints = [Endpoint(url) for url in urls]
+        self.timeout = timeout
+        self.hedge_factor = hedge_factor
+        self.hedge_min = hedge_min
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=len(urls), pool_maxsize=max_concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+
+    def ranked(self):
+        return sorted(self.endpoints, key=Endpoint.score)
+
+    def _attempt(self, endpoint, body, calls):
+        started = time.time()
+        try:
+            response = self.session.post(endpoint.url, data=body, timeout=self.timeout,
+                                         headers={"Content-Type": "application/json"})
+            if response.status_code == 429 or response.status_code >= 500:
+                raise RPCError(f"{endpoint.url} answered HTTP {response.status_code}")
+            response.raise_for_status()
+        except Exception:
+            endpoint.record_failure()
+            raise
+        endpoint.record_success(time.time() - started, calls)
+        return response.content
+
+    def post(self, body, calls=1):
+        """Send a JSON-RPC request body (bytes) carrying `calls` requests and return the raw response body."""
+        candidates = iter(self.ranked())
+        pending = {}
+        errors = []
+        hedged = False
+
+        def launch():
+            for endpoint in candidates:
+                if endpoint.available():
+                    pending[self._executor.submit(self._attempt, endpoint, body, calls)] = endpoint
+                    return endpoint
+            return None
+
+        primary = launch()
+        if primary is None:
+            raise RPCError("No healthy RPC endpoints")
+
+        while pending:
+            hedge_after = None
+            typical = primary.latency_by_size.get(size_class(calls))
+            if not hedged and typical is not None:
+                hedge_after = max(self.hedge_min, self.hedge_factor * typical)
+            done, _ = wait(list(pending), timeout=hedge_after, return_when=FIRST_COMPLETED)
+            if not done:
+                # The primary is slow: race it against the next endpoint
+                hedged = True
+                backup = launch()
+                if backup is not None:
+                    backup.hedged += 1
+                continue
+
+            for future in done:
+                pending.pop(future)
+                try:
+                    return future.result()
+                except Exception as e:
+                    # Fail over, without waiting for a hedged request still in flight
+                    errors.append(e)
+                    launch()
+
+        raise RPCError(f"All RPC endpoints failed: {errors[-1] if errors else 'unavailable'}")
+
+    def metrics(self):
+        return [endpoint.metrics() for endpoint in self.endpoints]
+
+
+class PoolProvider(JSONBaseProvider):
+    """web3 provider that sends every request through a ProviderPool."""
+
+    def __init__(self, pool):
+        super().__init__()
+        self.pool = pool
+
+    def make_request(self, method, params):
+        body = self.encode_rpc_request(method, params)
+        return self.decode_rpc_response(self.pool.post(body))
+
+    def is_connected(self, show_traceback=False):
+        return any(endpoint.state != "open" for endpoint in self.pool.endpoints)
+
+
+rpc_pool = ProviderPool(
+    list(dict.fromkeys([app.config["RPC_URL"], *app.config["RPC_URLS"]])),
+    hedge_factor=app.config["RPC_HEDGE_FACTOR"],
+    hedge_min=app.config["RPC_HEDGE_MIN"],
+)
+
+# Web3 connection to zkSync Era mainnet, through the endpoint pool
+web3 = Web3(PoolProvider(rpc_pool))
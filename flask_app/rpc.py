@@ -0,0 +1,191 @@
+import json
+import time
+import logging
+import threading
+import itertools
+from concurrent.futures import ThreadPoolExecutor
+from eth_abi import decode, encode
+from eth_abi.grammar import parse, TupleType
+from eth_utils import to_checksum_address
+from eth_utils.abi import get_abi_output_types
+from web3.exceptions import ContractLogicError
+from shared import app
+from providers import RPCError, rpc_pool
+
+# Multicall3 aggregate3((address,bool,bytes)[]) selector
+AGGREGATE3_SELECTOR = bytes.fromhex("82ad56cb")
+
+
+def checksum_addresses(abi_type, value):
+    """Checksum every address in a decoded value, as web3's own contract calls return them."""
+    if abi_type.is_array:
+        return [checksum_addresses(abi_type.item_type, item) for item in value]
+    if isinstance(abi_type, TupleType):
+        return tuple(checksum_addresses(component, item) for component, item in zip(abi_type.components, value))
+    if abi_type.base == "address":
+        return to_checksum_address(value)
+    return value
+
+
+class ContractReader:
+    """Batched read-only contract calls over a ProviderPool.
+
+    call() queues a single view call; calls made concurrently (from other
+    greenlets or threads) within flush_interval are sent together. call_many()
+    sends a list of calls directly. Either way eth_calls are packed into
+    JSON-RPC batches of batch_size, and with a Multicall3 address each eth_call
+    aggregates multicall_size contract calls. At most max_concurrency HTTP
+    requests are in flight at once.
+
+    Reverted calls raise (or, from call_many, return) ContractLogicError like
+    web3's own contract calls.
+    """
+
+    def __init__(self, pool, batch_size=500, max_concurrency=4, multicall_address=None, multicall_size=100,
+                 flush_interval=0.005):
+        self.pool = pool
+        self.batch_size = batch_size
+        self.multicall_address = multicall_address
+        self.multicall_size = multicall_size
+        self.flush_interval = flush_interval
+
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        self._ids = itertools.count(1)
+        self._abis = {}
+        self._pending = []
+        self._lock = threading.Lock()
+
+    # Encoding
+
+    def _function_abi(self, contract, fn_name):
+        key = (contract.address, fn_name)
+        if key not in self._abis:
+            self._abis[key] = contract.get_function_by_name(fn_name).abi
+        return self._abis[key]
+
+    def _decode(self, contract, fn_name, data):
+        types = get_abi_output_types(self._function_abi(contract, fn_name))
+        values = [checksum_addresses(parse(abi_type), value) for abi_type, value in zip(types, decode(types, data))]
+        return values[0] if len(values) == 1 else values
+
+    @staticmethod
+    def _block_param(block):
+        return hex(block) if isinstance(block, int) else block
+
+    # Transport
+
+    def _post(self, payload):
+        calls = len(payload) if isinstance(payload, list) else 1
+        return json.loads(self.pool.post(json.dumps(payload).encode(), calls))
+
+    def _send(self, requests_):
+        """Send eth_call requests as JSON-RPC batches; returns raw result bytes or exceptions, in order."""
+        chunks = [requests_[i:i + self.batch_size] for i in range(0, len(requests_), self.batch_size)]
+        results = []
+        for chunk, replies in zip(chunks, self._executor.map(self._post, chunks)):
+            if isinstance(replies, dict):
+                # Some nodes answer a whole batch with a single error object
+                error = replies.get("error", {})
+                raise RPCError(f"{error.get('code')}: {error.get('message')}")
+            by_id = {reply.get("id"): reply for reply in replies}
+            for request in chunk:
+                reply = by_id.get(request["id"])
+                if reply is None:
+                    results.append(RPCError(f"No reply for request {request['id']}"))
+                elif "error" in reply:
+                    error = reply["error"]
+                    message = error.get("message", "")
+                    if error.get("code") == 3 or "revert" in message.lower():
+                        results.append(ContractLogicError(message, data=error.get("data")))
+                    else:
+                        results.append(RPCError(f"{error.get('code')}: {message}"))
+                else:
+                    results.append(bytes.fromhex(reply["result"].removeprefix("0x")))
+        return results
+
+    def _eth_call(self, to, data, block):
+        return {
+            "jsonrpc": "2.0",
+            "id": next(self._ids),
+            "method": "eth_call",
+            "params": [{"to": to, "data": "0x" + data.hex()}, self._block_param(block)],
+        }
+
+    # Public API
+
+    def call_many(self, calls, block="latest"):
+        """Run (contract, fn_name, args) view calls at one block.
+
+        Returns one entry per call: the decoded value, or the exception for
+        that call (ContractLogicError for reverts, RPCError otherwise).
+        """
+        encoded = [(contract.address, bytes.fromhex(contract.encode_abi(fn_name, args=list(args)).removeprefix("0x")))
+                   for contract, fn_name, args in calls]
+
+        if self.multicall_address:
+            groups = [encoded[i:i + self.multicall_size] for i in range(0, len(encoded), self.multicall_size)]
+            requests_ = [
+                self._eth_call(self.multicall_address,
+                               AGGREGATE3_SELECTOR + encode(["(address,bool,bytes)[]"],
+                                                            [[(to, True, data) for to, data in group]]),
+                               block)
+                for group in groups
+            ]
+            raw = []
+            for group, result in zip(groups, self._send(requests_)):
+                if isinstance(result, Exception):
+                    raw += [result] * len(group)
+                    continue
+                for success, data in decode(["(bool,bytes)[]"], result)[0]:
+                    raw.append(data if success else ContractLogicError("execution reverted", data=data))
+        else:
+            raw = self._send([self._eth_call(to, data, block) for to, data in encoded])
+
+        results = []
+        for (contract, fn_name, _), data in zip(calls, raw):
+            if isinstance(data, Exception):
+                results.append(data)
+            elif not data:
+                results.append(ContractLogicError("execution reverted"))
+            else:
+                try:
+                    results.append(self._decode(contract, fn_name, data))
+                except Exception as e:
+                    results.append(RPCError(f"Could not decode {fn_name}: {e}"))
+        return results
+
+    def call(self, contract, fn_name, *args, block="latest"):
+        """Run one view call, batched together with concurrent callers."""
+        pending = {"call": (contract, fn_name, args), "block": block, "done": threading.Event()}
+        with self._lock:
+            self._pending.append(pending)
+            leader = len(self._pending) == 1
+
+        if leader:
+            # Give concurrent callers a moment to join this batch
+            time.sleep(self.flush_interval)
+            with self._lock:
+                batch, self._pending = self._pending, []
+            for block_id in dict.fromkeys(item["block"] for item in batch):
+                group = [item for item in batch if item["block"] == block_id]
+                try:
+                    results = self.call_many([item["call"] for item in group], block_id)
+                except Exception as e:
+                    logging.error(f"Batched contract read failed: {e}")
+                    results = [e] * len(group)
+                for item, result in zip(group, results):
+                    item["result"] = result
+                    item["done"].set()
+
+        pending["done"].wait()
+        if isinstance(pending["result"], Exception):
+            raise pending["result"]
+        return pending["result"]
+
+
+contract_reader = ContractReader(
+    rpc_pool,
+    batch_size=app.config["RPC_BATCH_SIZE"],
+    max_concurrency=app.config["RPC_MAX_CONCURRENCY"],
+    multicall_address=app.config["MULTICALL3_ADDRESS"],
+)
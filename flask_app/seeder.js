@@ -0,0 +1,207 @@
+// Long-lived seeding daemon: a single WebTorrent client holds every torrent
+// the Flask workers ask for. Workers talk to it over a unix socket using
+// newline-delimited JSON (see seeder.py).
+//
+//   node seeder.js <socket path> <state file>
+
+const fs = require('fs')
+const net = require('net')
+const crypto = require('crypto')
+const { dirname } = require('path')
+
+const socketPath = process.argv[2]
+const statePath = process.argv[3]
+
+// DER prefix that turns a raw 32-byte ed25519 public key into SPKI
+const ED25519_SPKI_PREFIX = Buffer.from('302a300506032b6570032100', 'hex')
+
+// path -> {path, torrent, announce, root}; persisted so a restart re-seeds everything
+const seeds = new Map()
+let saveTimer = null
+
+function saveState () {
+  if (!statePath || saveTimer) return
+  saveTimer = setTimeout(() => {
+    saveTimer = null
+    const tmp = `${statePath}.tmp`
+    fs.writeFileSync(tmp, JSON.stringify([...seeds.values()]))
+    fs.renameSync(tmp, statePath)
+  }, 1000)
+}
+
+function loadState () {
+  try {
+    return JSON.parse(fs.readFileSync(statePath, 'utf8'))
+  } catch (err) {
+    return []
+  }
+}
+
+// The ed25519 key BEP 46 pointers are signed with, kept next to the state
+// file so a stream's pointer survives restarts
+function loadKey () {
+  const keyPath = `${statePath}.key`
+  try {
+    return crypto.createPrivateKey({ key: fs.readFileSync(keyPath), format: 'der', type: 'pkcs8' })
+  } catch (err) {
+    const { privateKey } = crypto.generateKeyPairSync('ed25519')
+    fs.writeFileSync(keyPath, privateKey.export({ format: 'der', type: 'pkcs8' }), { mode: 0o600 })
+    return privateKey
+  }
+}
+
+function verify (signature, message, publicKey) {
+  const key = crypto.createPublicKey({
+    key: Buffer.concat([ED25519_SPKI_PREFIX, publicKey]), format: 'der', type: 'spki'
+  })
+  return crypto.verify(null, message, key, signature)
+}
+
+function describe (torrent) {
+  return {
+    infoHash: torrent.infoHash,
+    magnetURI: torrent.magnetURI,
+    path: torrent.seedPath,
+    numPeers: torrent.numPeers,
+    uploaded: torrent.uploaded,
+    announcedAt: torrent.announcedAt || null,
+    firstPeerAt: torrent.firstPeerAt || null
+  }
+}
+
+// Remember when a torrent first reached a tracker and first got a peer
+function track (torrent) {
+  torrent.once('wire', () => { torrent.firstPeerAt = Date.now() })
+  const onAnnounce = () => { torrent.announcedAt = torrent.announcedAt || Date.now() }
+  if (torrent.discovery) torrent.discovery.once('trackerAnnounce', onAnnounce)
+  else torrent.once('ready', () => torrent.discovery && torrent.discovery.once('trackerAnnounce', onAnnounce))
+}
+
+async function main () {
+  const { default: WebTorrent } = await import('webtorrent-hybrid')
+  const client = new WebTorrent({ dht: { verify } })
+  client.on('error', err => console.error(`seeder: ${err.message}`))
+
+  const byPath = new Map()
+  const adding = new Map() // path -> promise of a seed() still in progress
+
+  const privateKey = loadKey()
+  const publicKey = crypto.createPublicKey(privateKey).export({ format: 'der', type: 'spki' }).slice(-32)
+
+  // Seed a file. With a prebuilt .torrent (see torrent.py) the pieces are
+  // trusted as-is instead of being hashed again. Multi-file torrents are
+  // stored under root, and path is only the key they are tracked by.
+  function seed (path, torrentFile, announce, root) {
+    const existing = byPath.get(path)
+    if (existing && !existing.destroyed) return Promise.resolve(existing)
+    // Asked again while the first add (or the restore at startup) is still going: share it
+    if (adding.has(path)) return adding.get(path)
+
+    const added = new Promise((resolve, reject) => {
+      const onReady = torrent => {
+        torrent.seedPath = path
+        byPath.set(path, torrent)
+        seeds.set(path, { path, torrent: torrentFile, announce, root })
+        saveState()
+        resolve(torrent)
+      }
+      const torrent = torrentFile
+        ? client.add(fs.readFileSync(torrentFile), { path: root || dirname(path), skipVerify: true }, onReady)
+        : client.seed(path, { announce }, onReady)
+      torrent.once('error', reject)
+      track(torrent)
+    })
+    adding.set(path, added)
+    const done = () => adding.delete(path)
+    added.then(done, done)
+    return added
+  }
+
+  const commands = {
+    async add ({ path, torrent, announce, root }) {
+      return describe(await seed(path, torrent, announce || [], root))
+    },
+    // Many adds in one round trip; each result is a description or {error}
+    async addMany ({ seeds }) {
+      const results = await Promise.all(seeds.map(({ path, torrent, announce, root }) =>
+        seed(path, torrent, announce || [], root).then(describe, err => ({ path, error: err.message }))))
+      return { results }
+    },
+    // BEP 46: a signed, mutable DHT item (salted with the stream name) whose
+    // value is the infohash of the stream's current torrent
+    async publish ({ name, infoHash }) {
+      // Storing the item on the DHT takes seconds, so it is not waited for
+      const salt = Buffer.from(name)
+      client.dht.put({
+        k: publicKey,
+        salt,
+        seq: Date.now(),
+        v: { ih: Buffer.from(infoHash, 'hex') },
+        sign: buf => crypto.sign(null, buf, privateKey)
+      }, err => { if (err) console.error(`seeder: publishing ${name}: ${err.message}`) })
+      return {
+        publicKey: publicKey.toString('hex'),
+        magnetURI: `magnet:?xs=urn:btpk:${publicKey.toString('hex')}&s=${salt.toString('hex')}`
+      }
+    },
+    async remove ({ infoHash }) {
+      // client.get is async from webtorrent 2 on (awaiting is harmless on 1.x)
+      const torrent = await client.get(infoHash)
+      if (!torrent) throw new Error(`unknown torrent ${infoHash}`)
+      byPath.delete(torrent.seedPath)
+      seeds.delete(torrent.seedPath)
+      saveState()
+      await new Promise(resolve => client.remove(infoHash, { destroyStore: false }, resolve))
+      return {}
+    },
+    async status ({ infoHash }) {
+      const torrent = await client.get(infoHash)
+      if (!torrent || !torrent.seedPath) throw new Error(`unknown torrent ${infoHash}`)
+      return describe(torrent)
+    },
+    async list () {
+      return { torrents: client.torrents.filter(t => t.seedPath).map(describe) }
+    }
+  }
+
+  try { fs.unlinkSync(socketPath) } catch (err) {}
+
+  const server = net.createServer(conn => {
+    let buf = ''
+    conn.on('data', async chunk => {
+      buf += chunk
+      let i
+      while ((i = buf.indexOf('\n')) >= 0) {
+        const line = buf.slice(0, i)
+        buf = buf.slice(i + 1)
+        let reply
+        try {
+          const request = JSON.parse(line)
+          const handler = commands[request.cmd]
+          if (!handler) throw new Error(`unknown command ${request.cmd}`)
+          reply = Object.assign({ ok: true }, await handler(request))
+        } catch (err) {
+          reply = { ok: false, error: err.message }
+        }
+        conn.write(JSON.stringify(reply) + '\n')
+      }
+    })
+    conn.on('error', () => {})
+  })
+  server.listen(socketPath)
+
+  for (const { path, torrent, announce, root } of loadState()) {
+    if (fs.existsSync(path)) {
+      seed(path, torrent, announce, root).catch(err => console.error(`seeder: ${path}: ${err.message}`))
+    }
+  }
+
+  // Exit together with the worker supervising us
+  process.stdin.on('end', () => process.exit(0))
+  process.stdin.resume()
+}
+
+main().catch(err => {
+  console.error(err)
+  process.exit(1)
+})
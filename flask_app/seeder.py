@@ -0,0 +1,426 @@
+import os
+import re
+import queue
+import logging
+import threading
+import time
+from collections import OrderedDict
+from fnmatch import fnmatch
+from shared import app, FILE_DIR, TRACKER_URLS, seeded_files, allowed_file
+from control import ControlClient, ControlError, SupervisedProcess
+from torrent import build_torrent, build_multi_torrent, create_torrent
+from seedindex import seed_index
+from segmentlog import segment_log
+from moderation import moderation
+from prefilter import moderation_filter
+
+SEEDER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "seeder.js")
+
+
+class SeedEngine:
+    """Front end for the seeding daemon that holds every torrent in one Node process."""
+
+    def __init__(self, socket_path, lock_path, state_path):
+        self.client = ControlClient(socket_path)
+        self.process = SupervisedProcess(
+            "seeding daemon",
+            ["node", SEEDER_SCRIPT, socket_path, os.path.abspath(state_path)],
+            socket_path,
+            lock_path,
+        )
+
+    def _call(self, cmd, **params):
+        if not self.process.ensure_running():
+            raise ControlError("seeding daemon is not running")
+        return self.client.call(cmd, **params)
+
+    def add(self, path, torrent_path=None, announce=None, root=None):
+        """Start seeding a file and return its torrent description (infoHash, magnetURI, ...).
+
+        With torrent_path the daemon seeds the prebuilt .torrent without re-hashing the file.
+        Multi-file torrents pass the directory holding their top folder as root;
+        path is then only the key the daemon tracks the torrent under.
+        """
+        return self._call(
+            "add",
+            path=os.path.abspath(path),
+            torrent=torrent_path,
+            announce=announce or TRACKER_URLS,
+            root=root and os.path.abspath(root),
+        )
+
+    def add_many(self, seeds, announce=None):
+        """Seed many (path, torrent_path) pairs in one round trip; returns one result per pair.
+
+        Results are torrent descriptions, or {"path", "error"} for files the daemon could not seed.
+        """
+        return self._call(
+            "addMany",
+            seeds=[{"path": os.path.abspath(path), "torrent": torrent_path, "announce": announce or TRACKER_URLS}
+                   for path, torrent_path in seeds],
+        )["results"]
+
+    def announce(self, path, torrent):
+        """Hand a torrent built by torrent.py to the daemon in the background."""
+        def run():
+            try:
+                self.add(path, torrent["torrent_path"])
+                logging.info(f"Announced {torrent['info_hash']} for {path}")
+            except ControlError as e:
+                logging.error(f"Error announcing {path}: {e}")
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def publish(self, name, info_hash):
+        """Point the daemon's BEP 46 mutable item for name at info_hash.
+
+        Returns the publicKey and the magnetURI (magnet:?xs=urn:btpk:...) that
+        DHT clients can follow from one torrent of the stream to the next.
+        """
+        return self._call("publish", name=name, infoHash=info_hash)
+
+    def remove(self, info_hash):
+        """Stop seeding a torrent; the file on disk is left alone."""
+        self._call("remove", infoHash=info_hash)
+
+    def status(self, info_hash):
+        """Describe one torrent, including when it was first announced and first got a peer."""
+        return self._call("status", infoHash=info_hash)
+
+    def list(self):
+        """List every torrent the daemon is seeding."""
+        return self._call("list")["torrents"]
+
+
+seed_engine = SeedEngine(app.config["SEEDER_SOCKET"], app.config["SEEDER_LOCK"], app.config["SEEDER_STATE"])
+
+
+def torrent_for(file_path, hasher=None):
+    """Return the torrent for a file, hashing it only if the seed index has no current entry."""
+    stat = os.stat(file_path)
+    torrent = seed_index.lookup(file_path, stat) if hasher is None else None
+    if torrent is None:
+        if hasher is not None:
+            torrent = build_torrent(os.path.basename(file_path), hasher)
+        else:
+            torrent = create_torrent(file_path)
+        seed_index.record(file_path, torrent, stat)
+    return torrent
+
+
+def rendition(path):
+    """Segment file name without its sequence number: what all segments of one rendition share."""
+    return re.sub(r"\d+(?=\.\w+$)", "", os.path.basename(path))
+
+
+class SegmentWindow:
+    """Seed a live stream's HLS output as a rolling window.
+
+    Every finished segment (a file matching segment_pattern) is hashed and
+    announced exactly once, in order. Its torrent is retired (dropped from the
+    daemon, the seed index and TORRENT_DIR) as soon as ffmpeg removes the
+    file, or once more than max_segments are live in case a deletion went
+    unnoticed. max_segments counts per rendition: segment names that differ
+    only in their trailing number (stream_0_12.ts, chunk-stream1-00012.m4s)
+    belong to the same one. Only segments matching played_pattern (default:
+    all) are what viewers play; they alone go into the segment log, so a
+    profile with several renditions or separate audio and video tracks logs
+    one of them, and the others are just seeded. Files matching
+    latest_patterns (playlists, fMP4 init segments) are rewritten in place
+    and only their latest version is kept seeding. All work happens on one
+    thread per stream, so events are handled in the order they arrive.
+
+    With live_torrent the played segments are not seeded one by one.
+    Instead every roll_every of them roll the window into one multi-file
+    torrent (<stream>/<segment>), the stream's BEP 46 pointer is moved to it
+    and their log entries all name it, each with the segment inside it.
+    Viewers join one swarm per roll that holds the recent segments, and the
+    previous window torrents keep seeding for `grace` more rolls so nobody is
+    cut off mid-download. Rolling less often hashes the window less often,
+    at the cost of up to roll_every segments of extra delay.
+    """
+
+    def __init__(self, stream, max_segments, segment_pattern="*.ts", latest_patterns=("*.m3u8",),
+                 played_pattern=None, live_torrent=False, roll_every=1, grace=2):
+        self.stream = stream
+        self.max_segments = max_segments
+        self.segment_pattern = segment_pattern
+        self.latest_patterns = latest_patterns
+        self.played_pattern = played_pattern
+        self.live_torrent = live_torrent
+        self.roll_every = roll_every
+        self.grace = grace
+        self.pending = []  # Played segments waiting for the next roll, oldest first (worker thread only)
+        self.segments = OrderedDict()  # path -> torrent (the window torrent it was added with), oldest first
+        self.latest = {}  # path -> torrent
+        self.windows = OrderedDict()  # daemon key -> window torrent, oldest first
+        self.pointer = None  # BEP 46 magnet that always resolves to the newest window
+        self._events = queue.Queue()
+        self._lock = threading.Lock()
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def add(self, path):
+        """A file was written in the stream's directory."""
+        self._events.put(("add", path))
+
+    def remove(self, path):
+        """A file was deleted from the stream's directory."""
+        self._events.put(("remove", path))
+
+    def close(self):
+        """Retire everything and stop the worker thread."""
+        self._events.put(("close", None))
+
+    def magnets(self):
+        """Magnet URLs of the played segments in the window, oldest first."""
+        with self._lock:
+            return [torrent["magnet_url"] for path, torrent in self.segments.items() if self._played(path)]
+
+    def _played(self, path):
+        return self.played_pattern is None or fnmatch(os.path.basename(path), self.played_pattern)
+
+    def live_magnets(self):
+        """The stream's BEP 46 pointer and newest window torrent (None unless live_torrent)."""
+        with self._lock:
+            newest = next(reversed(self.windows.values()), None)
+            return {"pointer": self.pointer, "window": newest and newest["magnet_url"]}
+
+    def _seed(self, path):
+        torrent = torrent_for(path)
+        seed_engine.add(path, torrent["torrent_path"])
+        return torrent
+
+    def _roll(self, new_paths):
+        """Seed the window plus the new segments as one torrent and move the pointer to it."""
+        with self._lock:
+            paths = [old_path for old_path in self.segments
+                     if old_path not in new_paths and self._played(old_path) and os.path.exists(old_path)]
+        torrent = build_multi_torrent(self.stream, (paths + new_paths)[-self.max_segments:])
+        # The daemon keeps one torrent per path, so every window gets a key of its own
+        hls_dir = os.path.dirname(new_paths[-1])
+        key = os.path.join(hls_dir, f".window-{torrent['info_hash']}")
+        seed_engine.add(key, torrent["torrent_path"], root=os.path.dirname(hls_dir))
+        torrent["window"] = key
+        try:
+            pointer = seed_engine.publish(self.stream, torrent["info_hash"])["magnetURI"]
+        except ControlError as e:
+            logging.warning(f"Error publishing the live pointer for {self.stream}: {e}")
+            pointer = self.pointer
+
+        with self._lock:
+            self.windows[key] = torrent
+            self.pointer = pointer
+            expired = []
+            while len(self.windows) > self.grace + 1:
+                expired.append(self.windows.popitem(last=False))
+        for old_key, old_torrent in expired:
+            self._retire_window(old_key, old_torrent)
+        return torrent
+
+    def _retire_window(self, key, torrent):
+        try:
+            seed_engine.remove(torrent["info_hash"])
+        except ControlError as e:
+            logging.error(f"Error retiring {key}: {e}")
+        try:
+            os.remove(torrent["torrent_path"])
+        except OSError:
+            pass
+
+    def _retire(self, path, torrent):
+        if "window" in torrent:
+            # Window torrents are retired as the window rolls, not per segment
+            return
+        try:
+            seed_engine.remove(torrent["info_hash"])
+        except ControlError as e:
+            logging.error(f"Error retiring {path}: {e}")
+        seed_index.remove(path)
+        try:
+            os.remove(torrent["torrent_path"])
+        except OSError:
+            pass
+        logging.info(f"Retired segment {path}")
+
+    def _add(self, path):
+        # A rewritten file (a playlist, or a segment name reused after ffmpeg
+        # restarted) replaces its old torrent; the daemon keeps one torrent per path
+        name = os.path.basename(path)
+        if any(fnmatch(name, pattern) for pattern in self.latest_patterns):
+            previous = self.latest.pop(path, None)
+            if previous:
+                self._retire(path, previous)
+            self.latest[path] = self._seed(path)
+            return
+        if not fnmatch(name, self.segment_pattern):
+            return
+
+        with self._lock:
+            previous = self.segments.pop(path, None)
+        if previous:
+            self._retire(path, previous)
+        played = self._played(path)
+        if self.live_torrent and played:
+            if path in self.pending:
+                self.pending.remove(path)
+            self.pending.append(path)
+            if len(self.pending) < min(self.roll_every, self.max_segments):
+                return
+            paths, self.pending = self.pending, []
+            torrent = self._roll(paths)
+        else:
+            paths, torrent = [path], self._seed(path)
+        if played:
+            for new_path in paths:
+                segment_log.append(self.stream, os.path.basename(new_path), torrent)
+            logging.info(f"Magnet URL for {self.stream}: {torrent['magnet_url']}")
+        with self._lock:
+            for new_path in paths:
+                self.segments[new_path] = torrent
+            same = [old_path for old_path in self.segments if rendition(old_path) == rendition(path)]
+            expired = [(old_path, self.segments.pop(old_path)) for old_path in same[:-self.max_segments]]
+        for old_path, old_torrent in expired:
+            self._retire(old_path, old_torrent)
+
+    def _run(self):
+        while True:
+            event, path = self._events.get()
+            try:
+                if event == "add":
+                    self._add(path)
+                elif event == "remove":
+                    if path in self.pending:
+                        self.pending.remove(path)
+                    with self._lock:
+                        torrent = self.segments.pop(path, None)
+                    if torrent:
+                        self._retire(path, torrent)
+                elif event == "close":
+                    with self._lock:
+                        segments, self.segments = list(self.segments.items()), OrderedDict()
+                    segments += self.latest.items()
+                    self.latest, self.pending = {}, []
+                    for old_path, old_torrent in segments:
+                        self._retire(old_path, old_torrent)
+                    with self._lock:
+                        windows, self.windows = list(self.windows.items()), OrderedDict()
+                        self.pointer = None
+                    for key, torrent in windows:
+                        self._retire_window(key, torrent)
+                    return
+            except (OSError, ControlError) as e:
+                logging.error(f"Error seeding {path} for {self.stream}: {e}")
+
+
+def unseed(info_hash):
+    """Stop seeding a torrent if the daemon has it."""
+    try:
+        seed_engine.remove(info_hash)
+        logging.info(f"Stopped seeding {info_hash}")
+    except ControlError as e:
+        logging.debug(f"Not seeding {info_hash}: {e}")
+
+
+def moderate_magnet(magnet_url):
+    """Stop or resume seeding the static files with this magnet URL, following the blacklist and whitelist."""
+    static_dir = os.path.abspath(FILE_DIR)
+    blocked = moderation_filter.blocked(magnet=magnet_url)
+    for row in seed_index.by_magnet(magnet_url):
+        path = row["path"]
+        if os.path.dirname(path) != static_dir:
+            continue
+        if blocked:
+            seeded_files.pop(path, None)
+            unseed(row["info_hash"])
+        elif path not in seeded_files and os.path.exists(path):
+            try:
+                seed_engine.add(path, row["torrent_path"])
+                seeded_files[path] = magnet_url
+            except ControlError as e:
+                logging.error(f"Error seeding {path}: {e}")
+
+
+def keep_static_files_seeded(interval=1):
+    """Seed the static directory, then keep it in step with magnet blacklist and whitelist changes.
+
+    Runs in the single process holding AUTO_SEED_LOCK.
+    """
+    changes = queue.Queue()
+    moderation.subscribe(changes.put)
+    moderation.refresh(force=True)
+    # Changes from before we subscribed are covered by the full pass
+    auto_seed_static_files()
+    while True:
+        try:
+            moderation.refresh(force=True)
+            magnets = set()
+            while not changes.empty():
+                change = changes.get()
+                if change["kind"] == "magnet":
+                    magnets.add(change["value"])
+            for magnet_url in magnets:
+                moderate_magnet(magnet_url)
+        except Exception as e:
+            logging.error(f"Applying moderation to seeded files failed: {e}")
+        time.sleep(interval)
+
+
+def auto_seed_static_files(batch_size=1000):
+    """Seed all allowed files in the static directory.
+
+    Files whose size and mtime match the seed index are not hashed again;
+    index entries for files that disappeared are dropped. Files whose magnet
+    URL is on the local blacklist are not seeded. The rest are handed to the
+    daemon batch_size at a time, one round trip per batch; files it already
+    restored from its state file come back at once.
+    """
+    seen, blocked, failed = set(), 0, 0
+    batch = []
+
+    def flush():
+        nonlocal failed
+        try:
+            results = seed_engine.add_many(batch)
+        except ControlError as e:
+            logging.error(f"Error seeding {len(batch)} static files: {e}")
+            results = [{"path": path, "error": str(e)} for path, _ in batch]
+        for result in results:
+            if "error" in result:
+                logging.error(f"Error seeding {result['path']}: {result['error']}")
+                seeded_files.pop(result["path"], None)
+                failed += 1
+        batch.clear()
+
+    for entry in os.scandir(FILE_DIR):
+        if not entry.is_file() or not allowed_file(entry.name):
+            continue
+        file_path = os.path.abspath(entry.path)
+        seen.add(file_path)
+        try:
+            torrent = torrent_for(file_path)
+        except OSError as e:
+            logging.error(f"Error seeding {file_path}: {e}")
+            failed += 1
+            continue
+        if moderation_filter.blocked(magnet=torrent["magnet_url"]):
+            # The daemon restores everything it seeded before, so stop it explicitly
+            blocked += 1
+            seeded_files.pop(file_path, None)
+            unseed(torrent["info_hash"])
+            continue
+        seeded_files[file_path] = torrent["magnet_url"]
+        batch.append((file_path, torrent["torrent_path"]))
+        if len(batch) >= batch_size:
+            flush()
+    if batch:
+        flush()
+
+    static_dir = os.path.abspath(FILE_DIR)
+    missing = [
+        row["path"] for row in seed_index.entries()
+        if row["path"] not in seen and os.path.dirname(row["path"]) == static_dir and not os.path.exists(row["path"])
+    ]
+    if missing:
+        seed_index.remove(*missing)
+    logging.info(f"Seeding {len(seen) - blocked - failed} static files, skipped {blocked} blacklisted, "
+                 f"{failed} failed, dropped {len(missing)} stale index entries")
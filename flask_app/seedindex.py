@@ -0,0 +1,69 @@
+import os
+import time
+from shared import SEED_FILE
+from db import Database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS seeds (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    info_hash TEXT NOT NULL,
+    magnet_url TEXT NOT NULL,
+    torrent_path TEXT NOT NULL,
+    seeded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS seeds_magnet ON seeds (magnet_url);
+"""
+
+
+class SeedIndex:
+    """On-disk record of every seeded file, keyed by absolute path.
+
+    A file whose size and mtime still match its entry is trusted without
+    hashing it again, which keeps restarts cheap on large static directories.
+    """
+
+    def __init__(self, db_path):
+        self.db = Database(db_path, SCHEMA)
+
+    def get(self, path):
+        return self.db.query_one("SELECT * FROM seeds WHERE path = ?", (os.path.abspath(path),))
+
+    def entries(self):
+        return self.db.query("SELECT * FROM seeds")
+
+    def by_magnet(self, magnet_url):
+        return self.db.query("SELECT * FROM seeds WHERE magnet_url = ?", (magnet_url,))
+
+    def lookup(self, path, stat=None):
+        """Return the torrent recorded for an unchanged file, or None if it must be re-hashed."""
+        row = self.get(path)
+        if row is None or not os.path.exists(row["torrent_path"]):
+            return None
+        stat = stat or os.stat(path)
+        if row["size"] != stat.st_size or row["mtime_ns"] != stat.st_mtime_ns:
+            return None
+        return {
+            "info_hash": row["info_hash"],
+            "magnet_url": row["magnet_url"],
+            "torrent_path": row["torrent_path"],
+        }
+
+    def record(self, path, torrent, stat=None):
+        """Remember the torrent built for a file as of the given stat."""
+        path = os.path.abspath(path)
+        stat = stat or os.stat(path)
+        self.db.execute(
+            "INSERT OR REPLACE INTO seeds (path, size, mtime_ns, info_hash, magnet_url, torrent_path, seeded_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, torrent["info_hash"], torrent["magnet_url"],
+             torrent["torrent_path"], time.time()),
+        )
+
+    def remove(self, *paths):
+        with self.db.transaction() as conn:
+            conn.executemany("DELETE FROM seeds WHERE path = ?", [(os.path.abspath(p),) for p in paths])
+
+
+seed_index = SeedIndex(SEED_FILE)
@@ -0,0 +1,94 @@
+import time
+from shared import app
+from db import Database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS segments (
+    stream TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT NOT NULL,
+    info_hash TEXT NOT NULL,
+    magnet_url TEXT NOT NULL,
+    created REAL NOT NULL,
+    PRIMARY KEY (stream, seq)
+) WITHOUT ROWID;
+"""
+
+
+class SegmentLog:
+    """Append-only, per-stream log of seeded live segments, shared by every worker.
+
+    Each segment gets the next sequence number of its stream, so viewers can
+    ask for everything after the last one they saw. Reads are primary key
+    range scans on (stream, seq) and cost the same however many streams and
+    segments exist. Entries older than retention seconds are trimmed as new
+    ones are appended.
+    """
+
+    def __init__(self, db_path, retention=3600):
+        self.db = Database(db_path, SCHEMA)
+        self.retention = retention
+
+    def append(self, stream, name, torrent):
+        """Record a newly seeded segment and return its sequence number."""
+        now = time.time()
+        with self.db.transaction() as conn:
+            seq = conn.execute(
+                "SELECT COALESCE(MAX(seq), 0) + 1 FROM segments WHERE stream = ?", (stream,)
+            ).fetchone()[0]
+            conn.execute(
+                "INSERT INTO segments (stream, seq, name, info_hash, magnet_url, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (stream, seq, name, torrent["info_hash"], torrent["magnet_url"], now),
+            )
+            if seq % 100 == 0:
+                conn.execute("DELETE FROM segments WHERE stream = ? AND created < ?", (stream, now - self.retention))
+        return seq
+
+    def since(self, stream, after, limit=100):
+        """Entries with seq > after, oldest first."""
+        rows = self.db.query(
+            "SELECT seq, name, magnet_url, created FROM segments WHERE stream = ? AND seq > ? ORDER BY seq LIMIT ?",
+            (stream, after, limit),
+        )
+        return [dict(row) for row in rows]
+
+    def latest(self, stream, limit):
+        """The newest limit entries, oldest first."""
+        rows = self.db.query(
+            "SELECT seq, name, magnet_url, created FROM segments WHERE stream = ? ORDER BY seq DESC LIMIT ?",
+            (stream, limit),
+        )
+        return [dict(row) for row in reversed(rows)]
+
+    def wait(self, stream, after, timeout, poll_interval=0.2):
+        """Return entries after seq as soon as there are any, or [] after timeout seconds.
+
+        Only re-queries when SQLite reports that another connection committed.
+        """
+        deadline = time.time() + timeout
+        version = None
+        while True:
+            current = self.db.query_one("PRAGMA data_version")[0]
+            if current != version:
+                version = current
+                entries = self.since(stream, after)
+                if entries:
+                    return entries
+            if time.time() >= deadline:
+                return []
+            time.sleep(poll_interval)
+
+    def follow(self, stream, after, timeout=600):
+        """Yield entries as they are appended, for up to timeout seconds."""
+        deadline = time.time() + timeout
+        while time.time() < deadline:
+            entries = self.wait(stream, after, min(15, deadline - time.time()))
+            for entry in entries:
+                after = entry["seq"]
+                yield entry
+            if not entries:
+                # Lets the caller send a keep-alive
+                yield None
+
+
+segment_log = SegmentLog(app.config["SEGMENT_LOG_DB"])
@@ -18,7 +18,8 @@ logging.basicConfig(level=logging.DEBUG)
 class ManiwaniApp(Flask):
     jinja_options = ImmutableDict()
 
-app = ManiwaniApp(__name__, static_url_path='')
+# No built-in static route: FILE_DIR is served by serve_static and friends, after the moderation check
+app = ManiwaniApp(__name__, static_folder=None)
 app.config['TEMPLATES_AUTO_RELOAD'] = True
 app.config["UPLOAD_FOLDER"] = Path("./uploads").resolve()
 app.config["THUMB_FOLDER"] = Path(os.path.join(app.config["UPLOAD_FOLDER"], "thumbs")).resolve()
@@ -26,6 +27,56 @@ app.config["SERVE_STATIC"] = True
 app.config["SERVE_REST"] = True
 app.config["USE_RECAPTCHA"] = False
 app.config["FIREHOSE_LENGTH"] = 10
+app.config["RPC_URL"] = 'https://endpoints.omniatech.io/v1/zksync-era/mainnet/1a6a3c9fbe4c40d5b4d6c46b466e674f'
+app.config["RPC_URLS"] = []  # Extra endpoints to pool with; RPC_URL alone is used when empty
+app.config["RPC_HEDGE_FACTOR"] = 3  # Hedge a request once it takes this many times the endpoint's average
+app.config["RPC_HEDGE_MIN"] = 0.25
+app.config["RPC_BATCH_SIZE"] = 500
+app.config["RPC_MAX_CONCURRENCY"] = 4
+app.config["MULTICALL3_ADDRESS"] = None  # Set to batch view calls through Multicall3 aggregate3
+app.config["MAX_UPLOAD_SIZE"] = 50 * 1024 * 1024  # Matches client_max_body_size in nginx.conf
+app.config["CONTENT_DB"] = "content_store.db"
+app.config["JOBS_DB"] = "upload_jobs.db"
+app.config["SEGMENT_LOG_DB"] = "segment_log.db"
+app.config["ARCHIVE_DB"] = "archive.db"
+app.config["MODERATION_DB"] = "moderation.db"
+app.config["MODERATION_FILTER"] = "moderation.bloom"
+app.config["MODERATION_FILTER_LOCK"] = "/tmp/gremlin-modfilter.lock"
+app.config["CHAIN_INDEXER"] = True
+app.config["CHAIN_DB"] = "chain_index.db"
+app.config["CHAIN_INDEXER_LOCK"] = "/tmp/gremlin-indexer.lock"
+app.config["CHAIN_CONFIRMATIONS"] = 2
+app.config["CHAIN_LOG_BATCH"] = 5000
+app.config["CHAIN_POLL_INTERVAL"] = 2
+app.config["SEEDER_SOCKET"] = "/tmp/gremlin-seeder.sock"
+app.config["SEEDER_LOCK"] = "/tmp/gremlin-seeder.lock"
+app.config["SEEDER_STATE"] = "seeder_state.json"
+app.config["AUTO_SEED_LOCK"] = "/tmp/gremlin-autoseed.lock"
+app.config["STATIC_ACCEL_PREFIX"] = "/_static/"  # Internal nginx location serving FILE_DIR; empty to always send from Flask
+app.config["FFMPEG"] = "/usr/bin/ffmpeg"
+app.config["FFPROBE"] = "/usr/bin/ffprobe"
+app.config["RTMP_URL"] = "rtmp://gremlin.codes:1935/live/{stream}"
+app.config["STREAM_SOCKET"] = "/tmp/gremlin-streams.sock"
+app.config["STREAM_LOCK"] = "/tmp/gremlin-streams.lock"
+app.config["STREAM_IDLE_TIMEOUT"] = 300  # Stop a stream's ffmpeg when no viewer asked for it for this long
+app.config["STREAM_ON_DEMAND"] = False  # Start streams from profile views, not only from nginx-rtmp on_publish
+app.config["STREAM_PROFILE"] = "standard"  # Or "low_latency" or "abr"; publishers can pick with ?profile= on the stream key
+app.config["STREAM_LL_SEGMENT"] = 2  # Low-latency segment length, seconds
+app.config["STREAM_LL_PART"] = 0.5  # Low-latency chunk (partial segment) length, seconds
+app.config["STREAM_LL_THREADS"] = 2  # Encoder threads a low-latency stream needs
+app.config["STREAM_ABR_LADDER"] = [  # Renditions encoded next to the copied source by the "abr" profile
+    {"name": "480p", "height": 480, "bitrate": "1200k", "threads": 1},
+    {"name": "720p", "height": 720, "bitrate": "2800k", "threads": 2},
+    {"name": "1080p", "height": 1080, "bitrate": "5000k", "threads": 4},
+]
+app.config["STREAM_LIVE_TORRENT"] = False  # Seed each stream as one rolling window torrent behind a BEP 46 pointer, not a torrent per segment
+app.config["STREAM_LIVE_TORRENT_ROLL"] = 3  # Segments per window torrent roll: fewer re-hashes and swarm joins, up to that many segments more delay
+app.config["STREAM_ARCHIVE"] = False  # Keep every broadcast as a VOD under static/vod (not for low_latency streams)
+app.config["ARCHIVE_CHUNK_SECONDS"] = 60  # Archived segments are appended into chunk files of about this length
+app.config["ARCHIVE_MAX_AGE"] = 7 * 86400  # Delete finished VODs after this many seconds
+app.config["ARCHIVE_MAX_BYTES"] = 50 * 2 ** 30  # ...or, oldest first, while all VODs together are larger than this
+app.config["STREAM_ENCODE_THREADS"] = None  # Encoder threads shared by all streams; None means one per core
+app.config["STREAM_MAX_LOAD"] = 0.9  # Grant no new encodes, and shed renditions, above this load per core
 
 if os.getenv("MANIWANI_CFG"):
     app.config.from_envvar("MANIWANI_CFG")
@@ -33,9 +84,6 @@ if os.getenv("MANIWANI_CFG"):
 app.url_map.strict_slashes = False
 rest_api = Api(app)
 
-# Web3 connection to zkSync Era mainnet
-#web3 = Web3(Web3.HTTPProvider('https://endpoints.omniatech.io/v1/zksync-era/mainnet/1a6a3c9fbe4c40d5b4d6c46b466e674f'))
-
 # Contract addresses
 gremlinThreadAddress = '0xC560Ce637fc250Ce779E2e27f8f98f4643101288'
 gremlinReplyAddress = '0x5F3a28ECD4CAA8452C0d909265A714f7316E9bcd'
@@ -1177,7 +1225,7 @@ gremlinProfileABI = [
 FILE_DIR = 'static'
 TORRENT_DIR = 'torrents'
 TRACKER_PORT = 80
-SEED_FILE = 'seeded_files.json'
+SEED_FILE = 'seeded_files.db'
 BLACKLIST_FILE = 'blacklist.json'
 WHITELIST_FILE = 'whitelist.json'
 TRACKER_URLS = [
@@ -1190,41 +1238,31 @@ TRACKER_URLS = [
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
 
 seeded_files = {}
-THREADS = []
 
-def load_blacklist():
-    if not os.path.exists(BLACKLIST_FILE):
-        return []  # Return empty list if file does not exist
-    with open(BLACKLIST_FILE, 'r') as f:
-        try:
-            return json.load(f)
-        except json.JSONDecodeError:
-            return []  # Return empty list if file is corrupt or empty
+def load_list(path):
+    """Read a legacy blacklist.json/whitelist.json; missing keys, files or bad JSON read as empty.
 
-# Load whitelist from file, if it exists, otherwise return an empty list
-def load_whitelist():
-    if not os.path.exists(WHITELIST_FILE):
-        return []  # Return empty list if file does not exist
-    with open(WHITELIST_FILE, 'r') as f:
+    Only used to seed the moderation store (see moderation.py), which holds the lists now.
+    """
+    data = {"tags": [], "magnets": [], "users": []}
+    if not os.path.exists(path):
+        return data
+    with open(path, 'r') as f:
         try:
-            return json.load(f)
+            loaded = json.load(f)
         except json.JSONDecodeError:
-            return []  # Retur
-
-
+            return data
+    if isinstance(loaded, dict):
+        data.update({key: list(loaded[key]) for key in data if isinstance(loaded.get(key), list)})
+    return data
 
-blacklist = load_blacklist()
-whitelist = load_whitelist()
 
-
-def save_blacklist(data):
-    with open(BLACKLIST_FILE, 'w') as f:
-        json.dump(data, f)
+def load_blacklist():
+    return load_list(BLACKLIST_FILE)
 
 
-def save_whitelist(data):
-    with open(WHITELIST_FILE, 'w') as f:
-        json.dump(data, f)
+def load_whitelist():
+    return load_list(WHITELIST_FILE)
 
 
 # Helper Functions
@@ -1240,129 +1278,3 @@ def ip_to_int(ip_str):
 def allowed_file(filename):
     """Check if the file has an allowed extension."""
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def seed_file(file_path):
-    """Function to seed the file using the WebTorrent command and return the magnet URL without waiting for the process to exit."""
-    try:
-        # Check if the file is already being seeded
-        if file_path in seeded_files:
-            logging.info(f"{file_path} is already being seeded.")
-            return seeded_files[file_path]  # Return existing magnet URL if it's already seeded
-
-        # Prepare tracker list for WebTorrent seed command
-        tracker_list = " ".join([f"--announce={tracker}" for tracker in TRACKER_URLS])
-
-        # WebTorrent seed command with trackers and keep-seeding
-        cmd = f"webtorrent seed '{file_path}' {tracker_list} --keep-seeding"
-        logging.info(f"Running seeding command: {cmd}")
-
-        # Run the command in a subprocess
-        process = subprocess.Popen(
-            cmd, 
-            shell=True, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE, 
-            text=True
-        )
-
-        magnet_url = None
-
-        # Function to monitor the output of the WebTorrent process
-        def monitor_output():
-            nonlocal magnet_url
-            while True:
-                output = process.stdout.readline()
-                if output == '' and process.poll() is not None:
-                    break
-
-                if output:
-                    #logging.info(f"WebTorrent output: {output.strip()}")
-                    if "Magnet:" in output:
-                        magnet_url = output.split("Magnet: ")[1].strip()
-                        seeded_files[file_path] = magnet_url
-                        logging.info(f"Magnet URL found: {magnet_url}")
-                        break  # Magnet URL found, exit the loop
-
-        # Start monitoring output in a separate thread
-        output_thread = threading.Thread(target=monitor_output)
-        output_thread.start()
-
-        # Wait for the magnet URL to be extracted
-        output_thread.join(timeout=30)  # Wait for up to 10 seconds for the magnet URL to appear
-
-        if magnet_url:
-            logging.info(f"Magnet URL returned: {magnet_url}")
-            return magnet_url
-        else:
-            logging.error(f"Failed to retrieve the magnet URL in time.")
-            return None
-
-    except Exception as e:
-        logging.error(f"Error while seeding file: {str(e)}")
-        return None
-
-class StreamSeed(threading.Thread):
-    """Threaded class for seeding HLS segments using WebTorrent."""
-    
-    def __init__(self, eth_addr, filename):
-        super().__init__()
-        self.eth_addr = eth_addr
-        self.filename = filename
-        self.magnet_url = None
-        self.file_exists = False
-        self.daemon = True  # Make the thread run as a daemon
-        
-    def check_file_exists(self):
-        """Check if the file exists before proceeding."""
-        while not os.path.exists(self.filename):
-            logging.info(f"Waiting for file {self.filename} to appear...")
-            time.sleep(1)  # Wait for the file to be written
-        self.file_exists = True
-        logging.info(f"File {self.filename} found, starting seeding process...")
-
-    def seed_file(self):
-        """Function to seed the file using the WebTorrent command and return the magnet URL."""
-        # Check if the file has already been seeded
-        if (self.eth_addr in seeded_files.keys()):
-          if self.filename in seeded_files[self.eth_addr]:
-              logging.info(f"{self.filename} is already being seeded for {self.eth_addr}.")
-              return
-
-        # Prepare the WebTorrent seed command
-        cmd = f"webtorrent seed {self.filename} --keep-seeding"
-        logging.info(f"Running seeding command: {cmd}")
-        
-        # Run the WebTorrent command
-        process = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        
-        def monitor_output():
-            """Monitor the WebTorrent output to find the magnet URL."""
-            while True:
-                output = process.stdout.readline()
-                if output == '' and process.poll() is not None:
-                    break
-                if output:
-                    logging.info(f"WebTorrent output: {output.strip()}")
-                    if "Magnet:" in output:
-                        self.magnet_url = output.split("Magnet: ")[1].strip()
-                        seeded_files[self.eth_addr].add(self.magnet_url)
-                        logging.info(f"Magnet URL for {self.eth_addr}: {self.magnet_url}")
-                        break
-        
-        monitor_output()
-
-    def run(self):
-        """Main method that runs in the thread."""
-        self.check_file_exists()
-        if self.file_exists:
-            self.seed_file()
-
-
-def auto_seed_static_files():
-    """Automatically seed all allowed files in the static directory."""
-    for filename in os.listdir(FILE_DIR):
-        file_path = os.path.join(FILE_DIR, filename)
-        if os.path.isfile(file_path) and allowed_file(filename):
-            #logging.info(f"Automatically seeding {file_path}")
-            seed_thread = threading.Thread(target=seed_file, args=(file_path,))
-            seed_thread.start()
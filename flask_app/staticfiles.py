@@ -0,0 +1,82 @@
+import os
+import mimetypes
+from flask import Response, request, send_file
+from werkzeug.security import safe_join
+from shared import app
+from seedindex import seed_index
+from prefilter import moderation_filter
+
+# Directories under FILE_DIR with one subdirectory per streamer, named by their address
+STREAM_DIRS = ("hls", "vod")
+# Stream output types mimetypes doesn't know (or gets wrong: .ts is not TypeScript here)
+MEDIA_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".m4s": "video/iso.segment",
+    ".mpd": "application/dash+xml",
+}
+
+
+def strong_etag(path, stat):
+    """The info hash of the file's torrent when it is indexed and unchanged, else its size and mtime."""
+    torrent = seed_index.lookup(path, stat)
+    if torrent is not None:
+        return torrent["info_hash"], torrent["magnet_url"]
+    return f"{stat.st_size:x}-{stat.st_mtime_ns:x}", None
+
+
+def streamer(relpath):
+    """The streamer a file under hls/ or vod/ belongs to, or None."""
+    parts = relpath.split(os.sep)
+    return parts[1] if len(parts) > 2 and parts[0] in STREAM_DIRS else None
+
+
+def media_type(filename):
+    ext = os.path.splitext(filename)[1].lower()
+    return MEDIA_TYPES.get(ext) or mimetypes.guess_type(filename)[0] or "application/octet-stream"
+
+
+def send_static(root, filename):
+    """Answer a request for root/filename after the moderation check.
+
+    Behind nginx (which sends "X-Sendfile-Type: X-Accel-Redirect") the body
+    is left to nginx: the response is only headers, with X-Accel-Redirect
+    pointing at the internal STATIC_ACCEL_PREFIX location, and nginx
+    sendfiles the bytes and answers Range requests itself. Run without
+    nginx, the file is sent from here, Range and conditional requests
+    included. Either way the ETag is strong and If-None-Match is answered
+    with 304 before any file is opened.
+
+    Live and archived stream output (hls/, vod/) is refused when its
+    streamer is blacklisted and is never cached, as playlists keep changing.
+    """
+    root = os.path.abspath(root)
+    path = safe_join(root, filename)
+    if path is None:
+        return Response("Not Found", 404)
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return Response("Not Found", 404)
+    if not os.path.isfile(path):
+        return Response("Not Found", 404)
+
+    # Checked on the resolved path, so "hls/x/../y/..." can't dodge the streamer check
+    relpath = os.path.relpath(path, root)
+    user = streamer(relpath)
+    etag, magnet = strong_etag(path, stat)
+    if moderation_filter.blocked(magnet=magnet, user=user):
+        return Response("Not Found", 404)
+
+    mimetype = media_type(path)
+    if request.headers.get("X-Sendfile-Type") != "X-Accel-Redirect" or not app.config["STATIC_ACCEL_PREFIX"]:
+        return send_file(path, mimetype=mimetype, etag=etag, conditional=True, max_age=0 if user else None)
+
+    headers = {"ETag": f'"{etag}"'}
+    if user:
+        headers["Cache-Control"] = "no-cache"
+    if request.if_none_match.contains_weak(etag):
+        return Response(status=304, headers=headers)
+    headers["X-Accel-Redirect"] = app.config["STATIC_ACCEL_PREFIX"].rstrip("/") + "/" + relpath.replace(os.sep, "/")
+    # nginx keeps the Content-Type of the response it redirects, so it must be the file's
+    return Response(status=200, headers=headers, mimetype=mimetype)
@@ -0,0 +1,77 @@
+import os
+import time
+import logging
+from shared import app, FILE_DIR, seeded_files
+from db import Database
+from seeder import seed_engine
+from torrent import build_torrent
+from seedindex import seed_index
+from prefilter import moderation_filter
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    sha256 TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    info_hash TEXT NOT NULL,
+    magnet_url TEXT NOT NULL,
+    created REAL NOT NULL
+);
+"""
+
+
+class ContentStore:
+    """Content-addressed upload store under FILE_DIR.
+
+    Every distinct file is stored and seeded once as <sha256>.<ext>; uploads
+    of the same bytes get the magnet URL of the stored copy.
+    """
+
+    def __init__(self, root, db_path):
+        self.root = os.path.abspath(root)
+        self.db = Database(db_path, SCHEMA)
+
+    def path_for(self, name):
+        return os.path.join(self.root, name)
+
+    def lookup(self, sha256):
+        """Return the index row for a content hash, or None."""
+        return self.db.query_one("SELECT * FROM blobs WHERE sha256 = ?", (sha256.lower(),))
+
+    def put(self, upload):
+        """Store a received upload (see upload.receive_upload) and return its info_hash and magnet_url.
+
+        For known content the temporary file is dropped and nothing new is
+        written or seeded.
+        """
+        sha256 = upload["sha256"]
+        filename = upload["filename"]
+        ext = filename.rsplit('.', 1)[1].lower() if '.' in filename else 'bin'
+        name = f"{sha256}.{ext}"
+
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT info_hash, magnet_url FROM blobs WHERE sha256 = ?", (sha256,)).fetchone()
+            if row is not None:
+                os.remove(upload["path"])
+                logging.info(f"Deduplicated upload of {filename} as {name}")
+                return {"info_hash": row["info_hash"], "magnet_url": row["magnet_url"]}
+
+            path = self.path_for(name)
+            os.replace(upload["path"], path)
+            torrent = build_torrent(name, upload["hasher"])
+            conn.execute(
+                "INSERT INTO blobs (sha256, name, size, info_hash, magnet_url, created) VALUES (?, ?, ?, ?, ?, ?)",
+                (sha256, name, upload["hasher"].length, torrent["info_hash"], torrent["magnet_url"], time.time()),
+            )
+
+        seed_index.record(path, torrent)
+        if moderation_filter.blocked(magnet=torrent["magnet_url"]):
+            logging.info(f"Stored {filename} as {name}, not seeded: its magnet is blacklisted")
+        else:
+            seeded_files[path] = torrent["magnet_url"]
+            seed_engine.announce(path, torrent)
+            logging.info(f"Stored {filename} as {name}")
+        return {"info_hash": torrent["info_hash"], "magnet_url": torrent["magnet_url"]}
+
+
+content_store = ContentStore(FILE_DIR, app.config["CONTENT_DB"])
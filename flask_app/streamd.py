@@ -0,0 +1,579 @@
+"""Stream supervisor daemon.
+
+Owns every ffmpeg remuxer on the host: at most one per stream, restarted with
+backoff when it exits, and reaped. Streams started by an RTMP publish run
+until the publisher stops; streams started on demand are stopped once nobody
+has asked for them for a while. Run as `python streamd.py <socket>`; the web workers talk
+to it through streams.StreamControl.
+"""
+import os
+import re
+import sys
+import json
+import time
+import signal
+import logging
+import threading
+import subprocess
+import socketserver
+from shared import app, FILE_DIR
+from seeder import SegmentWindow
+from watcher import DirectoryWatcher
+from ffmpeg import FFmpegProcess, probe
+from archive import ArchiveRecorder, archive
+
+STREAM_NAME = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# Segments listed in the live playlist; ffmpeg keeps one more on disk
+HLS_LIST_SIZE = 6
+
+
+def standard_args(stream, hls_dir, rungs, source):
+    """Remux into 10 s MPEG-TS segments without re-encoding."""
+    return [
+        "-c:v", "copy",
+        "-c:a", "copy",
+        "-f", "hls",
+        "-hls_time", "10",
+        "-hls_list_size", str(HLS_LIST_SIZE),
+        # temp_file: segments appear under their final name only once complete
+        "-hls_flags", "delete_segments+temp_file",
+        os.path.join(hls_dir, f"{stream}.m3u8"),
+    ]
+
+
+def low_latency_args(stream, hls_dir, rungs, source):
+    """2 s CMAF segments written as 0.5 s chunks, with preload hints in the playlist.
+
+    Video is re-encoded with a keyframe at every segment boundary so each
+    segment decodes on its own (EXT-X-INDEPENDENT-SEGMENTS) whatever GOP the
+    publisher uses. The dash muxer writes the HLS playlists too; lhls adds
+    EXT-X-PREFETCH hints for the segment still being written.
+    """
+    seconds = app.config["STREAM_LL_SEGMENT"]
+    return [
+        # Video first, so it is representation 0 (chunk-stream0-*.m4s, init-stream0.m4s)
+        "-map", "0:v:0", "-map", "0:a:0?",
+        "-c:v", "libx264", "-preset", "veryfast", "-tune", "zerolatency",
+        "-force_key_frames", f"expr:gte(t,n_forced*{seconds})",
+        "-c:a", "copy",
+        "-f", "dash",
+        "-seg_duration", str(seconds),
+        "-frag_type", "duration",
+        "-frag_duration", str(app.config["STREAM_LL_PART"]),
+        "-window_size", str(HLS_LIST_SIZE),
+        "-extra_window_size", "1",
+        "-remove_at_exit", "1",
+        "-streaming", "1",
+        "-ldash", "1",
+        "-hls_playlist", "1",
+        "-lhls", "1",
+        "-hls_master_name", f"{stream}.m3u8",
+        os.path.join(hls_dir, f"{stream}.mpd"),
+    ]
+
+
+def bufsize(bitrate):
+    """A rate-control buffer of twice the bitrate, in ffmpeg's notation: "1200k" -> "2400k"."""
+    match = re.match(r"^(\d+(?:\.\d+)?)([kKmM]?)$", bitrate)
+    if match is None:
+        raise ValueError(f"Invalid bitrate: {bitrate!r}")
+    return f"{float(match.group(1)) * 2:g}{match.group(2)}"
+
+
+def abr_args(stream, hls_dir, rungs, source):
+    """The source, copied, plus one encoded rendition per rung, under a master playlist.
+
+    Rungs at or above the source height are not encoded (see PROFILES).
+    A source without audio gets video-only renditions. Encoded renditions get a
+    keyframe every 10 s so each of their segments starts with one. The copied
+    source can only be cut at the publisher's keyframes, so its segment
+    boundaries match the encoded ones only when the publisher's keyframe
+    interval divides 10 s; players switching renditions go by timestamps.
+    Rate control is capped: maxrate at the rung's bitrate over a buffer of
+    twice that (see bufsize).
+    """
+    count = len(rungs)
+    filters = [f"[0:v]split={count}" + "".join(f"[v{i}]" for i in range(count))]
+    filters += [f"[v{i}]scale=-2:'min(ih,{rung['height']})'[r{i}]" for i, rung in enumerate(rungs)]
+
+    args = ["-filter_complex", ";".join(filters), "-map", "0:v", "-c:v:0", "copy"]
+    for i, rung in enumerate(rungs, 1):
+        args += [
+            "-map", f"[r{i - 1}]",
+            f"-c:v:{i}", "libx264",
+            f"-b:v:{i}", rung["bitrate"],
+            f"-maxrate:v:{i}", rung["bitrate"],
+            f"-bufsize:v:{i}", bufsize(rung["bitrate"]),
+            f"-threads:v:{i}", str(rung["threads"]),
+        ]
+    args += ["-preset", "veryfast", "-force_key_frames", "expr:gte(t,n_forced*10)"]
+    audio = source.get("audio", True)
+    if audio:
+        for _ in range(count + 1):
+            args += ["-map", "0:a:0?"]
+    return args + [
+        "-c:a", "copy",
+        "-f", "hls",
+        "-hls_time", "10",
+        "-hls_list_size", str(HLS_LIST_SIZE),
+        "-hls_flags", "delete_segments+temp_file+independent_segments",
+        "-master_pl_name", f"{stream}.m3u8",
+        "-var_stream_map", " ".join(f"v:{i},a:{i}" if audio else f"v:{i}" for i in range(count + 1)),
+        "-hls_segment_filename", os.path.join(hls_dir, f"{stream}_%v_%d.ts"),
+        os.path.join(hls_dir, f"{stream}_%v.m3u8"),
+    ]
+
+
+# Output profiles a stream can be published with; all keep the (master) playlist at
+# <stream>.m3u8. "played" matches the segments of the one rendition viewers play
+# from the segment log. "encodes" lists what the profile wants from the encode
+# budget given the probed source (see ffmpeg.probe; {} when unknown), most
+# important first; a profile that wants or is granted none of it runs as
+# "standard". Profiles with "probe" set wait for the probe before their first
+# start. "archive" is the media playlist of the source rendition, whose
+# segments are kept as the VOD (None: CMAF output with separate audio and video
+# tracks is not archived).
+PROFILES = {
+    "standard": {
+        "args": standard_args, "segments": "*.ts", "played": "*.ts", "latest": ("*.m3u8",),
+        "encodes": lambda source: [], "archive": "{stream}.m3u8",
+    },
+    "low_latency": {
+        # The player feeds the video chunks to Media Source Extensions after init-stream0.m4s
+        "args": low_latency_args, "segments": "chunk-*.m4s", "played": "chunk-stream0-*.m4s",
+        "latest": ("*.m3u8", "*.mpd", "init-*.m4s"),
+        "encodes": lambda source: [{"name": "source", "threads": app.config["STREAM_LL_THREADS"]}], "archive": None,
+    },
+    "abr": {
+        # Viewers play the copied source rendition, as archived
+        "args": abr_args, "segments": "*.ts", "played": "{stream}_0_*.ts", "latest": ("*.m3u8",),
+        # Rungs at or above the source height would only re-encode it at full size
+        "encodes": lambda source: sorted(
+            (rung for rung in app.config["STREAM_ABR_LADDER"] if rung["height"] < (source.get("height") or float("inf"))),
+            key=lambda rung: rung["height"]),
+        "archive": "{stream}_0.m3u8", "probe": True,
+    },
+}
+
+
+def ffmpeg_command(stream, hls_dir, profile, rungs=(), source=None):
+    return [
+        app.config["FFMPEG"],
+        "-i", app.config["RTMP_URL"].format(stream=stream),
+        *PROFILES[profile]["args"](stream, hls_dir, rungs, source or {}),
+    ]
+
+
+class EncodeBudget:
+    """Share a fixed number of encoder threads between all streams on the host.
+
+    Rungs are granted in order until the budget runs out, so a stream loses its
+    top renditions before its bottom ones. While the load average per core is
+    above max_load nothing new is granted.
+    """
+
+    def __init__(self, threads, max_load=0.9):
+        self.threads = threads
+        self.max_load = max_load
+        self.allocations = {}  # stream -> threads
+        self._lock = threading.Lock()
+
+    def overloaded(self):
+        try:
+            return os.getloadavg()[0] / (os.cpu_count() or 1) > self.max_load
+        except OSError:
+            return False
+
+    def acquire(self, stream, wanted):
+        """Replace the stream's allocation with as much of wanted as fits; returns the granted rungs."""
+        overloaded = self.overloaded()
+        with self._lock:
+            self.allocations.pop(stream, None)
+            free = self.threads - sum(self.allocations.values())
+            granted = []
+            for rung in wanted:
+                if overloaded or rung["threads"] > free:
+                    break
+                granted.append(rung)
+                free -= rung["threads"]
+            if granted:
+                self.allocations[stream] = sum(rung["threads"] for rung in granted)
+            return granted
+
+    def release(self, stream):
+        with self._lock:
+            self.allocations.pop(stream, None)
+
+    def used(self):
+        with self._lock:
+            return sum(self.allocations.values())
+
+
+class Stream:
+    """Supervision state of one stream."""
+
+    def __init__(self, name, profile):
+        self.name = name
+        self.profile = profile
+        self.running_profile = None
+        self.rungs = []
+        self.rung_cap = None  # Set when the stream had to shed renditions under load
+        self.source = None  # What ffmpeg.probe found in the input; None until probed
+        self.hls_dir = os.path.abspath(os.path.join(FILE_DIR, "hls", name))
+        self.process = None
+        self.state = "starting"
+        self.started_at = None
+        self.next_start = 0
+        self.backoff = 1
+        self.restarts = 0
+        self.last_exit = None
+        self.last_seen = time.time()
+        self.published = False
+        self.stopping = threading.Event()
+        self.window = SegmentWindow(name, HLS_LIST_SIZE + 1,
+                                    PROFILES[profile]["segments"], PROFILES[profile]["latest"],
+                                    PROFILES[profile]["played"].format(stream=name),
+                                    live_torrent=app.config["STREAM_LIVE_TORRENT"],
+                                    roll_every=app.config["STREAM_LIVE_TORRENT_ROLL"])
+
+    def describe(self):
+        return {
+            "stream": self.name,
+            "state": self.state,
+            "profile": self.profile,
+            "running_profile": self.running_profile,
+            "rungs": [rung["name"] for rung in self.rungs],
+            "pid": self.process.pid if self.process else None,
+            "started_at": self.started_at,
+            "restarts": self.restarts,
+            "last_exit": self.last_exit,
+            "next_start": self.next_start if self.state == "backoff" else None,
+            "last_seen": self.last_seen,
+            "published": self.published,
+            "source": self.source,
+            "metrics": self.process.metrics if self.process else None,
+            "magnets": self.window.magnets(),
+            "live": self.window.live_magnets(),
+        }
+
+
+class StreamSupervisor:
+    """Start, restart, reap and idle out one ffmpeg per stream."""
+
+    def __init__(self, budget, idle_timeout=300, max_backoff=60, stop_timeout=10, tick=1, shed_after=30,
+                 recorder=None):
+        self.budget = budget
+        self.recorder = recorder
+        self.shed_after = shed_after
+        self._overloaded_since = None
+        self.idle_timeout = idle_timeout
+        self.max_backoff = max_backoff
+        self.stop_timeout = stop_timeout
+        self.tick_interval = tick
+        self.streams = {}
+        self.watcher = DirectoryWatcher()
+        self._lock = threading.Lock()
+
+    def _plan(self, stream):
+        """Pick what the stream can afford to run right now: (profile, granted rungs)."""
+        wanted = PROFILES[stream.profile]["encodes"](stream.source or {})
+        if not wanted:
+            return "standard", []
+        if stream.rung_cap is not None:
+            wanted = wanted[:stream.rung_cap]
+        rungs = self.budget.acquire(stream.name, wanted)
+        if not rungs:
+            logging.warning(f"No encode budget for {stream.name}, falling back to copy-only")
+            return "standard", []
+        if len(rungs) < len(wanted):
+            logging.warning(f"Encode budget allows {len(rungs)} of {len(wanted)} renditions for {stream.name}")
+        return stream.profile, rungs
+
+    def _probe(self, stream):
+        """Probe the stream's input on a thread; the next _spawn after it answers starts ffmpeg.
+
+        Probing can't block here: nginx-rtmp only lets the publisher's data
+        through once the on_publish request that got us here returns.
+        """
+        if stream.state == "probing":
+            return
+        stream.state = "probing"
+
+        def run():
+            # {}: unknown, so every rung is encoded and audio is assumed
+            stream.source = probe(app.config["RTMP_URL"].format(stream=stream.name), app.config["FFPROBE"]) or {}
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def _spawn(self, stream):
+        if PROFILES[stream.profile].get("probe") and stream.source is None:
+            self._probe(stream)
+            return
+        os.makedirs(stream.hls_dir, exist_ok=True)
+        profile, rungs = self._plan(stream)
+        stream.running_profile, stream.rungs = profile, rungs
+        stream.window.segment_pattern = PROFILES[profile]["segments"]
+        stream.window.latest_patterns = PROFILES[profile]["latest"]
+        stream.window.played_pattern = PROFILES[profile]["played"].format(stream=stream.name)
+        argv = ffmpeg_command(stream.name, stream.hls_dir, profile, rungs, stream.source)
+        if self.recorder:
+            self.recorder.restarted(stream.name)
+        logging.info(f"Starting FFmpeg to stream RTMP to HLS for {stream.name} ({profile})...")
+        try:
+            stream.process = FFmpegProcess(argv, stream.name)
+        except OSError as e:
+            logging.error(f"Error starting FFmpeg for {stream.name}: {e}")
+            self._schedule_restart(stream, time.time())
+            return
+        stream.state = "running"
+        stream.started_at = time.time()
+
+    def _schedule_restart(self, stream, now):
+        self.budget.release(stream.name)
+        stream.process = None
+        # The publisher may come back with a different source
+        stream.source = None
+        stream.state = "backoff"
+        stream.next_start = now + stream.backoff
+        stream.backoff = min(stream.backoff * 2, self.max_backoff)
+        stream.restarts += 1
+
+    def _terminate(self, stream):
+        stream.stopping.set()
+        self.watcher.unwatch(stream.hls_dir)
+        stream.window.close()
+        self.budget.release(stream.name)
+        self._kill(stream.process)
+        if self.recorder:
+            # Stopped before ffmpeg ever ran (still probing): nothing was recorded
+            archived = stream.running_profile and PROFILES[stream.running_profile]["archive"]
+            self.recorder.finish(stream.name, archived and os.path.join(stream.hls_dir, archived.format(stream=stream.name)))
+
+    def _kill(self, process):
+        if process is None or process.poll() is not None:
+            return
+        process.terminate()
+        try:
+            process.wait(self.stop_timeout)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+    def _segment_ready(self, stream, file_path):
+        """ffmpeg finished a segment or rewrote a playlist: seed it."""
+        if not stream.stopping.is_set():
+            stream.window.add(file_path)
+            archived = PROFILES[stream.running_profile]["archive"]
+            if self.recorder and archived and os.path.basename(file_path) == archived.format(stream=stream.name):
+                self.recorder.playlist(stream.name, file_path)
+
+    def _segment_deleted(self, stream, file_path):
+        """ffmpeg dropped a segment out of the window: retire its torrent."""
+        stream.window.remove(file_path)
+
+    def _ensure(self, name, profile=None):
+        """Return the supervised stream, starting it if needed. Call with the lock held."""
+        if not STREAM_NAME.match(name):
+            raise ValueError(f"Invalid stream name: {name!r}")
+        if profile is not None and profile not in PROFILES:
+            raise ValueError(f"Unknown profile: {profile!r}")
+        stream = self.streams.get(name)
+        if stream is None:
+            stream = self.streams[name] = Stream(name, profile or app.config["STREAM_PROFILE"])
+            os.makedirs(stream.hls_dir, exist_ok=True)
+            if self.recorder:
+                self.recorder.begin(name)
+            self.watcher.watch(stream.hls_dir,
+                               lambda path: self._segment_ready(stream, path),
+                               lambda path: self._segment_deleted(stream, path))
+            self._spawn(stream)
+        stream.last_seen = time.time()
+        return stream
+
+    def start(self, name, profile=None):
+        """Make sure the stream is supervised and mark it as wanted."""
+        with self._lock:
+            return self._ensure(name, profile).describe()
+
+    def publish(self, name, profile=None):
+        """A publisher went live: run the stream until stop(), without idling out.
+
+        Publishing with a different profile than the running one restarts the stream.
+        """
+        if profile is not None and profile not in PROFILES:
+            raise ValueError(f"Unknown profile: {profile!r}")
+        with self._lock:
+            running = self.streams.get(name)
+        if running is not None and profile is not None and running.profile != profile:
+            self.stop(name)
+        with self._lock:
+            stream = self._ensure(name, profile)
+            stream.published = True
+            if stream.process is None:
+                # Don't sit out a backoff left over from pulling before the publisher was live
+                stream.backoff = 1
+                self._spawn(stream)
+            return stream.describe()
+
+    def touch(self, name):
+        """Record viewer activity on a supervised stream; does not start anything."""
+        with self._lock:
+            stream = self.streams.get(name)
+            if stream is None:
+                return None
+            stream.last_seen = time.time()
+            return stream.describe()
+
+    def stop(self, name):
+        with self._lock:
+            stream = self.streams.pop(name, None)
+        if stream is None:
+            return None
+        logging.info(f"Stopping stream {name}")
+        self._terminate(stream)
+        stream.state = "stopped"
+        return stream.describe()
+
+    def status(self, name):
+        with self._lock:
+            stream = self.streams.get(name)
+            return stream.describe() if stream else None
+
+    def list(self):
+        with self._lock:
+            return [stream.describe() for stream in self.streams.values()]
+
+    def tick(self):
+        now = time.time()
+        idle = []
+        with self._lock:
+            for name, stream in list(self.streams.items()):
+                if not stream.published and now - stream.last_seen > self.idle_timeout:
+                    idle.append(self.streams.pop(name))
+                    continue
+
+                if stream.process is not None:
+                    returncode = stream.process.poll()
+                    if returncode is None:
+                        continue
+                    # Reap the exited ffmpeg and try again after the backoff
+                    logging.error(f"FFmpeg for {name} exited with code {returncode}: "
+                                  + " | ".join(list(stream.process.tail)[-3:]))
+                    stream.last_exit = returncode
+                    if now - stream.started_at > 60:
+                        stream.backoff = 1
+                    self._schedule_restart(stream, now)
+                elif now >= stream.next_start:
+                    self._spawn(stream)
+            shed = self._pick_shed(now)
+
+        if shed is not None:
+            logging.warning(f"Host overloaded, dropping {shed.name} to {shed.rung_cap} encoded renditions")
+            # The next tick reaps it and restarts it within the lower cap
+            self._kill(shed.process)
+
+        for stream in idle:
+            logging.info(f"Stream {stream.name} idle for {self.idle_timeout}s, stopping")
+            self._terminate(stream)
+
+    def _pick_shed(self, now):
+        """After shed_after seconds of overload, pick the stream using the most encode threads. Call with the lock held."""
+        if not self.budget.overloaded():
+            self._overloaded_since = None
+            return None
+        if self._overloaded_since is None:
+            self._overloaded_since = now
+        if now - self._overloaded_since < self.shed_after:
+            return None
+        encoding = [stream for stream in self.streams.values() if stream.rungs and stream.process is not None]
+        if not encoding:
+            return None
+        stream = max(encoding, key=lambda stream: sum(rung["threads"] for rung in stream.rungs))
+        stream.rung_cap = len(stream.rungs) - 1
+        # Give the load average time to reflect the change before shedding more
+        self._overloaded_since = now
+        return stream
+
+    def budget_status(self):
+        return {"threads": self.budget.threads, "used": self.budget.used(), "overloaded": self.budget.overloaded()}
+
+    def run(self):
+        while True:
+            try:
+                self.tick()
+            except Exception as e:
+                logging.error(f"Stream supervisor tick failed: {e}")
+            time.sleep(self.tick_interval)
+
+    def shutdown(self):
+        with self._lock:
+            streams, self.streams = list(self.streams.values()), {}
+        for stream in streams:
+            self._terminate(stream)
+
+    def handle(self, request):
+        cmd = request.get("cmd")
+        if cmd == "start":
+            return {"stream": self.start(request["stream"], request.get("profile"))}
+        if cmd == "publish":
+            return {"stream": self.publish(request["stream"], request.get("profile"))}
+        if cmd == "touch":
+            return {"stream": self.touch(request["stream"])}
+        if cmd == "stop":
+            return {"stream": self.stop(request["stream"])}
+        if cmd == "status":
+            return {"stream": self.status(request["stream"])}
+        if cmd == "list":
+            return {"streams": self.list()}
+        if cmd == "budget":
+            return {"budget": self.budget_status()}
+        raise ValueError(f"Unknown command: {cmd}")
+
+
+class ControlHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        line = self.rfile.readline()
+        if not line:
+            # A liveness probe (ControlClient.is_alive) connects and hangs up
+            return
+        try:
+            reply = dict(self.server.supervisor.handle(json.loads(line)), ok=True)
+        except Exception as e:
+            reply = {"ok": False, "error": str(e)}
+        self.wfile.write(json.dumps(reply).encode() + b"\n")
+
+
+class ControlServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+
+def main(socket_path):
+    budget = EncodeBudget(app.config["STREAM_ENCODE_THREADS"] or os.cpu_count() or 1, app.config["STREAM_MAX_LOAD"])
+    recorder = None
+    if app.config["STREAM_ARCHIVE"]:
+        archive.recover()
+        recorder = ArchiveRecorder(archive)
+    supervisor = StreamSupervisor(budget, idle_timeout=app.config["STREAM_IDLE_TIMEOUT"], recorder=recorder)
+
+    def exit_(*_):
+        supervisor.shutdown()
+        os._exit(0)
+
+    # Exit with the web worker that supervises us (it holds our stdin)
+    threading.Thread(target=lambda: (sys.stdin.read(), exit_()), daemon=True).start()
+    signal.signal(signal.SIGTERM, exit_)
+
+    try:
+        os.unlink(socket_path)
+    except FileNotFoundError:
+        pass
+    server = ControlServer(socket_path, ControlHandler)
+    server.supervisor = supervisor
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logging.info(f"Stream supervisor listening on {socket_path}")
+    supervisor.run()
+
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,58 @@
+import os
+import sys
+from shared import app
+from control import ControlClient, ControlError, SupervisedProcess
+
+STREAMD_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "streamd.py")
+
+
+class StreamControl:
+    """Front end for the stream supervisor that owns every ffmpeg on the host (streamd.py)."""
+
+    def __init__(self, socket_path, lock_path):
+        self.client = ControlClient(socket_path)
+        self.process = SupervisedProcess(
+            "stream supervisor",
+            [sys.executable, STREAMD_SCRIPT, socket_path],
+            socket_path,
+            lock_path,
+        )
+
+    def _call(self, cmd, **params):
+        if not self.process.ensure_running():
+            raise ControlError("stream supervisor is not running")
+        return self.client.call(cmd, **params)
+
+    def start(self, stream, profile=None):
+        """Start remuxing a stream if nothing is yet, and keep it from idling out; returns its state.
+
+        profile picks the output ("standard", "low_latency" or "abr"); None means STREAM_PROFILE.
+        """
+        return self._call("start", stream=stream, profile=profile)["stream"]
+
+    def publish(self, stream, profile=None):
+        """Start a stream whose publisher just went live; it runs until stop()."""
+        return self._call("publish", stream=stream, profile=profile)["stream"]
+
+    def touch(self, stream):
+        """Keep a running stream from idling out; returns its state, or None if it is not running."""
+        return self._call("touch", stream=stream)["stream"]
+
+    def stop(self, stream):
+        """Stop a stream's ffmpeg; returns its final state, or None if it was not running."""
+        return self._call("stop", stream=stream)["stream"]
+
+    def status(self, stream):
+        """Describe one stream (state, pid, restarts, magnets, ...), or None if it is not supervised."""
+        return self._call("status", stream=stream)["stream"]
+
+    def list(self):
+        """Describe every supervised stream."""
+        return self._call("list")["streams"]
+
+    def budget(self):
+        """Encoder threads available to ABR and low-latency streams, and how many are in use."""
+        return self._call("budget")["budget"]
+
+
+stream_control = StreamControl(app.config["STREAM_SOCKET"], app.config["STREAM_LOCK"])
@@ -0,0 +1,16 @@
+"""Common setup for the tests; import it before any module from flask_app/.
+
+The app's modules open their databases and directories relative to the
+working directory as they are imported, so the tests run from a fresh
+temporary directory.
+"""
+import os
+import sys
+import tempfile
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORK_DIR = tempfile.mkdtemp(prefix="gremlin-test-")
+
+sys.path.insert(0, APP_DIR)
+os.chdir(WORK_DIR)
+os.environ.pop("MANIWANI_CFG", None)
@@ -0,0 +1,58 @@
+"""Visibility rules of the chain index.
+
+Run from flask_app/: python -m unittest discover test
+"""
+import unittest
+
+import support  # noqa: F401
+from indexer import visibility  # noqa: E402
+
+SENDER = "0xAbC0000000000000000000000000000000000001"
+
+
+def post(**flags):
+    row = {"deleted": 0, "whitelisted": 1, "blacklisted": 0, "sender": SENDER, "magnet_url": "magnet:?xt=a"}
+    row.update(flags)
+    return row
+
+
+def lists(**entries):
+    """Moderation sets with the given entries, e.g. blacklist_magnet={"magnet:?xt=a"}."""
+    sets = {(name, kind): set() for name in ("whitelist", "blacklist") for kind in ("magnet", "user", "tag")}
+    for key, values in entries.items():
+        name, kind = key.split("_")
+        sets[(name, kind)] = set(values)
+    return sets
+
+
+class VisibilityTest(unittest.TestCase):
+    def test_plain_post_is_shown(self):
+        self.assertEqual(visibility(post(), ["cats"], 0, lists()), (1, None))
+        self.assertEqual(visibility(post(whitelisted=0), [], 0, lists()), (1, None))
+
+    def test_deleted_comes_first(self):
+        everything = lists(whitelist_magnet={"magnet:?xt=a"}, whitelist_user={SENDER.lower()})
+        self.assertEqual(visibility(post(deleted=1, blacklisted=1), [], 1, everything), (0, "deleted"))
+
+    def test_onchain_whitelist_does_not_override(self):
+        self.assertEqual(visibility(post(blacklisted=1), [], 0, lists()), (0, "blacklisted"))
+        self.assertEqual(visibility(post(), [], 1, lists()), (0, "banned"))
+        self.assertEqual(visibility(post(), [], 0, lists(blacklist_magnet={"magnet:?xt=a"})),
+                         (0, "blacklisted_magnet"))
+
+    def test_onchain_blacklist_and_bans_beat_local_whitelist(self):
+        whitelisted = lists(whitelist_user={SENDER.lower()})
+        self.assertEqual(visibility(post(blacklisted=1), [], 0, whitelisted), (0, "blacklisted"))
+        self.assertEqual(visibility(post(), [], 1, whitelisted), (0, "banned"))
+
+    def test_local_blacklist_by_kind(self):
+        self.assertEqual(visibility(post(), [], 0, lists(blacklist_user={SENDER.lower()})), (0, "blacklisted_user"))
+        self.assertEqual(visibility(post(), ["cats"], 0, lists(blacklist_tag={"cats"})), (0, "blacklisted_tag"))
+
+    def test_local_whitelist_beats_local_blacklist(self):
+        self.assertEqual(visibility(post(), ["cats"], 0,
+                                    lists(blacklist_tag={"cats"}, whitelist_magnet={"magnet:?xt=a"})), (1, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,78 @@
+"""Upload job state transitions, against a stub seeding daemon.
+
+Run from flask_app/: python -m unittest discover test
+"""
+import os
+import time
+import unittest
+from unittest import mock
+
+import support  # noqa: F401
+import jobs  # noqa: E402
+from control import ControlError  # noqa: E402
+
+TORRENT = {"info_hash": "ab" * 20, "magnet_url": "magnet:?xt=urn:btih:" + "ab" * 20}
+
+
+class StubStore:
+    def __init__(self, error=None):
+        self.error = error
+
+    def put(self, upload):
+        if self.error:
+            raise self.error
+        return TORRENT
+
+
+class StubEngine:
+    """Answers status() with each of replies in turn, then keeps repeating the last one."""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+
+    def status(self, info_hash):
+        reply = self.replies.pop(0) if len(self.replies) > 1 else self.replies[0]
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+
+class UploadJobsTest(unittest.TestCase):
+    def run_job(self, engine, store=None, **timeouts):
+        upload_jobs = jobs.UploadJobs(os.path.join(support.WORK_DIR, f"jobs-{time.time_ns()}.db"),
+                                      poll_interval=0.01, **timeouts)
+        path = os.path.join(support.WORK_DIR, "upload.tmp")
+        with open(path, "wb") as f:
+            f.write(b"body")
+        with mock.patch.object(jobs, "seed_engine", engine), mock.patch.object(jobs, "content_store", store or StubStore()):
+            job_id = upload_jobs.submit({"path": path})
+            deadline = time.time() + 5
+            while not upload_jobs.get(job_id)["final"] and time.time() < deadline:
+                time.sleep(0.01)
+        return upload_jobs.get(job_id), path
+
+    def test_announced_then_first_peer(self):
+        job, _ = self.run_job(StubEngine(ControlError("not yet"), {"announcedAt": 1},
+                                         {"announcedAt": 1, "firstPeerAt": 2}))
+        self.assertEqual(job["status"], "done")
+        self.assertTrue(job["final"])
+        self.assertEqual(list(job["stages"]), ["stored", "hashed", "torrent_built", "announced", "first_peer"])
+        self.assertEqual(job["magnet_url"], TORRENT["magnet_url"])
+
+    def test_announced_without_peer_is_done(self):
+        job, _ = self.run_job(StubEngine({"announcedAt": 1}), first_peer_timeout=0.1)
+        self.assertEqual((job["status"], job["stage"], job["final"]), ("done", "announced", True))
+
+    def test_never_announced_fails(self):
+        job, _ = self.run_job(StubEngine({}), announce_timeout=0.1)
+        self.assertEqual((job["status"], job["stage"], job["final"]), ("failed", "torrent_built", True))
+        self.assertEqual(job["error"], "Torrent was not announced in time")
+
+    def test_store_error_fails_and_removes_upload(self):
+        job, path = self.run_job(StubEngine({}), StubStore(OSError("disk full")))
+        self.assertEqual((job["status"], job["error"], job["final"]), ("failed", "disk full", True))
+        self.assertFalse(os.path.exists(path))
+
+
+if __name__ == "__main__":
+    unittest.main()
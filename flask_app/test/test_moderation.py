@@ -0,0 +1,96 @@
+"""The moderation store's bulk edits and the Bloom filter in front of it.
+
+Run from flask_app/: python -m unittest discover test
+"""
+import os
+import unittest
+
+import support
+from moderation import ModerationStore  # noqa: E402
+from prefilter import ModerationFilter  # noqa: E402
+
+USER = "0xAbC0000000000000000000000000000000000001"
+
+
+class ModerationTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(support.WORK_DIR, f"{self.id()}.db")
+        self.store = ModerationStore(self.path)
+
+
+class BulkTest(ModerationTestCase):
+    def test_results_follow_membership_in_order(self):
+        results = self.store.bulk("blacklist", [
+            ("tag", "add", "cats"), ("tag", "add", "cats"), ("tag", "remove", "dogs"),
+            ("magnet", "add", "magnet:?xt=a"), ("magnet", "remove", "magnet:?xt=a"), ("magnet", "remove", "magnet:?xt=a"),
+        ])
+        self.assertEqual(results, ["added", "exists", "missing", "added", "removed", "missing"])
+        self.assertEqual(self.store.export("blacklist"), {"tags": ["cats"], "magnets": [], "users": []})
+
+    def test_values_are_normalized(self):
+        self.assertEqual(self.store.bulk("whitelist", [("user", "add", f" {USER} "), ("user", "add", USER.lower())]),
+                         ["added", "exists"])
+        self.assertTrue(self.store.lookup("whitelist", "user", USER))
+        self.assertEqual(self.store.export("whitelist")["users"], [USER.lower()])
+
+    def test_lists_are_separate(self):
+        self.store.bulk("blacklist", [("tag", "add", "cats")])
+        self.assertEqual(self.store.bulk("whitelist", [("tag", "add", "cats")]), ["added"])
+
+    def test_rejects_unknown_kind_or_operation_before_writing(self):
+        with self.assertRaises(ValueError):
+            self.store.bulk("blacklist", [("tag", "add", "cats"), ("colour", "add", "red")])
+        with self.assertRaises(ValueError):
+            self.store.bulk("blacklist", [("tag", "toggle", "cats")])
+        self.assertEqual(self.store.export("blacklist")["tags"], [])
+
+    def test_other_workers_replay_the_changes(self):
+        other = ModerationStore(self.path)
+        other.refresh(force=True)
+        seen = []
+        other.subscribe(seen.append)
+        self.store.bulk("blacklist", [("tag", "add", "cats"), ("user", "add", USER)])
+        self.store.remove("blacklist", "tag", "cats")
+        other.refresh(force=True)
+        self.assertEqual([(change["kind"], change["op"]) for change in seen],
+                         [("tag", "add"), ("user", "add"), ("tag", "remove")])
+        self.assertEqual(other.export("blacklist"), {"tags": [], "magnets": [], "users": [USER.lower()]})
+
+
+class ModerationFilterTest(ModerationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.filter = ModerationFilter(os.path.join(support.WORK_DIR, f"{self.id()}.bloom"), self.store,
+                                       reopen_interval=0)
+
+    def test_answers_without_a_filter_file(self):
+        self.store.add("blacklist", "magnet", "magnet:?xt=a")
+        self.assertTrue(self.filter.blocked(magnet="magnet:?xt=a"))
+        self.assertFalse(self.filter.blocked(magnet="magnet:?xt=b"))
+
+    def test_whitelist_saves_from_blacklist(self):
+        self.store.add("blacklist", "tag", "cats")
+        self.store.add("whitelist", "user", USER)
+        bloom = self.filter.rebuild()
+        self.assertEqual(bloom.seq, self.store.latest_seq())
+        self.assertTrue(self.filter.blocked(tags=["cats"]))
+        self.assertFalse(self.filter.blocked(user=USER, tags=["cats"]))
+        self.assertFalse(self.filter.blocked(user=USER))
+
+    def test_update_folds_in_adds_and_rebuilds_after_removals(self):
+        bloom = self.filter.rebuild()
+        self.store.add("blacklist", "user", USER)
+        bloom = self.filter.update(bloom)
+        self.assertEqual(bloom.seq, self.store.latest_seq())
+        self.assertTrue(self.filter.blocked(user=USER.upper()))
+        inode = bloom.inode
+        self.store.remove("blacklist", "user", USER)
+        bloom = self.filter.update(bloom)
+        # One stale entry out of one: rebuilt into a new file
+        self.assertNotEqual(bloom.inode, inode)
+        self.assertEqual(bloom.entries, 0)
+        self.assertFalse(self.filter.blocked(user=USER))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,146 @@
+"""ContractReader against a local fake JSON-RPC node.
+
+Run from flask_app/: python -m unittest discover test
+"""
+import json
+import threading
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from eth_abi import decode, encode
+from web3 import Web3
+
+import support  # noqa: F401
+from shared import gremlinThreadABI, gremlinThreadAddress  # noqa: E402
+from providers import ProviderPool  # noqa: E402
+from rpc import ContractReader, AGGREGATE3_SELECTOR  # noqa: E402
+from web3.exceptions import ContractLogicError  # noqa: E402
+
+THREAD = "(uint256,string,string,string,string,string[],string,uint256,address,uint256,bool,bool,bool)"
+SENDER = "0x" + "ab" * 20
+MULTICALL = "0x" + "ca" * 20
+DELETED = 5
+
+
+def selector(signature):
+    return Web3.keccak(text=signature)[:4].hex().removeprefix("0x")
+
+
+class FakeNode:
+    """Just enough of a node for the thread contract: threadCount, getThread and Multicall3 aggregate3."""
+
+    functions = {
+        selector("threadCount()"): "threadCount",
+        selector("getThread(uint256)"): "getThread",
+        AGGREGATE3_SELECTOR.hex(): "aggregate3",
+    }
+
+    def __init__(self):
+        self.posts = []
+        node = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                node.posts.append(body)
+                reply = [node.handle(r) for r in body] if isinstance(body, list) else node.handle(body)
+                data = json.dumps(reply).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def run(self, data):
+        """Execute calldata; returns (success, return data)."""
+        function, args = self.functions[data[:8]], bytes.fromhex(data[8:])
+        if function == "threadCount":
+            return True, encode(["uint256"], [42])
+        if function == "getThread":
+            thread_id = decode(["uint256"], args)[0]
+            if thread_id == DELETED:
+                return False, b""
+            return True, encode([THREAD], [(thread_id, "name", "subject", "email", "magnet", ["tag"], "content",
+                                            0, SENDER, 1000 + thread_id, False, False, False)])
+        calls = decode(["(address,bool,bytes)[]"], args)[0]
+        return True, encode(["(bool,bytes)[]"], [[self.run(call.hex()) for _, _, call in calls]])
+
+    def handle(self, request):
+        success, result = self.run(request["params"][0]["data"][2:])
+        if not success:
+            return {"jsonrpc": "2.0", "id": request["id"],
+                    "error": {"code": 3, "message": "execution reverted: Thread has been deleted"}}
+        return {"jsonrpc": "2.0", "id": request["id"], "result": "0x" + result.hex()}
+
+    def eth_calls(self):
+        return sum(len(post) if isinstance(post, list) else 1 for post in self.posts)
+
+
+class ContractReaderTest(unittest.TestCase):
+    def setUp(self):
+        self.node = FakeNode()
+        self.addCleanup(self.node.server.shutdown)
+        self.contract = Web3().eth.contract(address=gremlinThreadAddress, abi=gremlinThreadABI)
+
+    def reader(self, **kwargs):
+        return ContractReader(ProviderPool([self.node.url]), **kwargs)
+
+    def test_call_many_sends_one_batch(self):
+        calls = [(self.contract, "getThread", (i,)) for i in range(1, 4)] + [(self.contract, "threadCount", ())]
+        results = self.reader().call_many(calls)
+        self.assertEqual(len(self.node.posts), 1)
+        self.assertEqual(self.node.eth_calls(), 4)
+        self.assertEqual([thread[0] for thread in results[:3]], [1, 2, 3])
+        self.assertEqual(results[3], 42)
+
+    def test_addresses_are_checksummed(self):
+        thread = self.reader().call_many([(self.contract, "getThread", (1,))])[0]
+        self.assertEqual(thread[8], Web3.to_checksum_address(SENDER))
+
+    def test_revert_is_returned_in_place(self):
+        results = self.reader().call_many([(self.contract, "getThread", (i,)) for i in (4, DELETED, 6)])
+        self.assertEqual(results[0][0], 4)
+        self.assertIsInstance(results[1], ContractLogicError)
+        self.assertEqual(results[2][0], 6)
+
+    def test_batches_are_split_at_batch_size(self):
+        self.reader(batch_size=2).call_many([(self.contract, "getThread", (i,)) for i in range(1, 6)])
+        self.assertEqual(sorted(len(post) for post in self.node.posts), [1, 2, 2])
+
+    def test_multicall_packs_calls_into_one_eth_call(self):
+        reader = self.reader(multicall_address=MULTICALL, multicall_size=10)
+        results = reader.call_many([(self.contract, "getThread", (i,)) for i in (4, DELETED, 6)])
+        self.assertEqual(self.node.eth_calls(), 1)
+        self.assertEqual(self.node.posts[0][0]["params"][0]["to"], MULTICALL)
+        self.assertEqual(results[0][0], 4)
+        self.assertIsInstance(results[1], ContractLogicError)
+        self.assertEqual(results[2][0], 6)
+
+    def test_concurrent_calls_are_coalesced(self):
+        reader = self.reader(flush_interval=0.05)
+        results = {}
+
+        def call(thread_id):
+            results[thread_id] = reader.call(self.contract, "getThread", thread_id)
+
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(10, 18)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(self.node.posts), 1)
+        self.assertEqual({i: thread[0] for i, thread in results.items()}, {i: i for i in range(10, 18)})
+
+    def test_call_raises_revert(self):
+        with self.assertRaises(ContractLogicError):
+            self.reader().call(self.contract, "getThread", DELETED)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,101 @@
+"""SegmentWindow against a stub seeding daemon.
+
+Run from flask_app/: python -m unittest discover test
+"""
+import os
+import time
+import tempfile
+import unittest
+from unittest import mock
+
+import support
+import seeder  # noqa: E402
+from segmentlog import segment_log  # noqa: E402
+from torrent import bdecode  # noqa: E402
+
+
+class StubEngine:
+    def __init__(self):
+        self.added, self.removed = [], []
+
+    def add(self, path, torrent_path=None, announce=None, root=None):
+        self.added.append(path)
+        return {}
+
+    def publish(self, name, info_hash):
+        return {"magnetURI": f"magnet:?xs=urn:btpk:{name}"}
+
+    def remove(self, info_hash):
+        self.removed.append(info_hash)
+
+
+class SegmentWindowTest(unittest.TestCase):
+    def setUp(self):
+        self.engine = StubEngine()
+        patcher = mock.patch.object(seeder, "seed_engine", self.engine)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.dir = tempfile.mkdtemp(dir=support.WORK_DIR)
+        self.name = os.path.basename(self.dir)
+
+    def window(self, *args, **kwargs):
+        window = seeder.SegmentWindow(self.name, *args, **kwargs)
+        self.addCleanup(window.close)
+        return window
+
+    def write(self, window, *names):
+        for name in names:
+            path = os.path.join(self.dir, name)
+            with open(path, "wb") as f:
+                f.write(os.urandom(1000))
+            window.add(path)
+
+    def settle(self, window):
+        """Wait for the window's worker thread to handle everything queued so far."""
+        deadline = time.time() + 5
+        while not window._events.empty() and time.time() < deadline:
+            time.sleep(0.01)
+        time.sleep(0.1)
+
+    def logged(self):
+        return [(entry["name"], entry["magnet_url"]) for entry in segment_log.latest(self.name, 100)]
+
+    def test_window_is_sized_per_rendition(self):
+        window = self.window(2, "chunk-*.m4s", ("init-*.m4s",), "chunk-stream0-*.m4s")
+        self.write(window, *(f"chunk-stream{rep}-{i:05d}.m4s" for i in range(4) for rep in (0, 1)))
+        self.settle(window)
+        self.assertEqual(sorted(os.path.basename(path) for path in window.segments), [
+            "chunk-stream0-00002.m4s", "chunk-stream0-00003.m4s", "chunk-stream1-00002.m4s", "chunk-stream1-00003.m4s"])
+        # Only the played (video) representation is logged
+        self.assertEqual([name for name, _ in self.logged()], [f"chunk-stream0-{i:05d}.m4s" for i in range(4)])
+        self.assertEqual(len(window.magnets()), 2)
+
+    def test_live_torrent_rolls_every_few_segments(self):
+        window = self.window(4, live_torrent=True, roll_every=2)
+        self.write(window, *(f"s{i}.ts" for i in range(5)))
+        self.settle(window)
+        logged = self.logged()
+        self.assertEqual([name for name, _ in logged], ["s0.ts", "s1.ts", "s2.ts", "s3.ts"])
+        # One window torrent per roll, shared by the segments it added
+        self.assertEqual(logged[0][1], logged[1][1])
+        self.assertEqual(logged[2][1], logged[3][1])
+        self.assertNotEqual(logged[1][1], logged[2][1])
+        newest = next(reversed(window.windows.values()))
+        with open(newest["torrent_path"], "rb") as f:
+            files = bdecode(f.read())[b"info"][b"files"]
+        self.assertEqual([file[b"path"] for file in files], [[b"s0.ts"], [b"s1.ts"], [b"s2.ts"], [b"s3.ts"]])
+        self.assertEqual(window.pending, [os.path.join(self.dir, "s4.ts")])
+        self.assertEqual(window.live_magnets()["pointer"], f"magnet:?xs=urn:btpk:{self.name}")
+
+    def test_deleted_segment_is_retired(self):
+        window = self.window(4)
+        self.write(window, "s0.ts", "s1.ts")
+        self.settle(window)
+        window.remove(os.path.join(self.dir, "s0.ts"))
+        self.settle(window)
+        self.assertEqual([os.path.basename(path) for path in window.segments], ["s1.ts"])
+        self.assertEqual(len(self.engine.removed), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
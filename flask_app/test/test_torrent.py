@@ -0,0 +1,74 @@
+"""Bencoding and torrent building, checked against torrents encoded by hand.
+
+Run from flask_app/: python -m unittest discover test
+"""
+import os
+import hashlib
+import unittest
+
+import support
+from torrent import (bencode, bdecode, piece_length_for, PieceHasher, hash_file, create_torrent,  # noqa: E402
+                     build_multi_torrent)
+
+# 40000 bytes in 16 KiB pieces: 3 pieces, the last one short
+SINGLE_DATA = (bytes(range(256)) * 200)[:40000]
+# sha1 of b"d6:lengthi40000e4:name9:hello.bin12:piece lengthi16384e6:pieces60:<piece hashes>e"
+SINGLE_INFO_HASH = "11c03df01e987de041b57c23264cbb6cd47704e6"
+# sha1 of b"d5:filesld6:lengthi3000e4:pathl4:a.tseed6:lengthi1500e4:pathl4:b.tseee4:name6:stream..."
+MULTI_INFO_HASH = "2c81a26476dcb480811559ee7aaf5b4a0505eb00"
+
+
+def write(name, data):
+    path = os.path.join(support.WORK_DIR, name)
+    with open(path, "wb") as f:
+        f.write(data)
+    return path
+
+
+class BencodeTest(unittest.TestCase):
+    def test_encodes_by_type(self):
+        self.assertEqual(bencode(42), b"i42e")
+        self.assertEqual(bencode(-3), b"i-3e")
+        self.assertEqual(bencode("spam"), b"4:spam")
+        self.assertEqual(bencode([1, b"a"]), b"li1e1:ae")
+        # Keys are sorted as raw bytes
+        self.assertEqual(bencode({"b": 1, "a": [True]}), b"d1:ali1ee1:bi1ee")
+
+    def test_round_trip(self):
+        value = {b"announce": b"wss://t", b"info": {b"length": 3, b"name": b"x", b"pieces": bytes(20)}}
+        self.assertEqual(bdecode(bencode(value)), value)
+
+    def test_rejects_trailing_data(self):
+        with self.assertRaises(ValueError):
+            bdecode(b"i1ei2e")
+
+
+class TorrentTest(unittest.TestCase):
+    def test_piece_length(self):
+        self.assertEqual(piece_length_for(0), 1 << 14)
+        self.assertEqual(piece_length_for(40000), 1 << 14)
+        self.assertEqual(piece_length_for(1 << 30), 1 << 20)
+
+    def test_incremental_hashing_matches_file_hashing(self):
+        hasher = PieceHasher(1 << 14)
+        for i in range(0, len(SINGLE_DATA), 1000):
+            hasher.update(SINGLE_DATA[i:i + 1000])
+        from_disk = hash_file(write("chunks.bin", SINGLE_DATA))
+        self.assertEqual((hasher.length, hasher.pieces()), (from_disk.length, from_disk.pieces()))
+        self.assertEqual(len(hasher.pieces()), 3 * 20)
+
+    def test_single_file_info_hash(self):
+        torrent = create_torrent(write("hello.bin", SINGLE_DATA))
+        self.assertEqual(torrent["info_hash"], SINGLE_INFO_HASH)
+        self.assertTrue(torrent["magnet_url"].startswith(f"magnet:?xt=urn:btih:{SINGLE_INFO_HASH}&dn=hello.bin"))
+        with open(torrent["torrent_path"], "rb") as f:
+            info = bdecode(f.read())[b"info"]
+        self.assertEqual(hashlib.sha1(bencode(info)).hexdigest(), SINGLE_INFO_HASH)
+
+    def test_multi_file_info_hash(self):
+        paths = [write("a.ts", b"abc" * 1000), write("b.ts", b"xyz" * 500)]
+        self.assertEqual(build_multi_torrent("stream", paths)["info_hash"], MULTI_INFO_HASH)
+
+
+if __name__ == "__main__":
+    unittest.main()
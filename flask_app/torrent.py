@@ -0,0 +1,182 @@
+import os
+import time
+import hashlib
+from urllib.parse import quote
+from shared import TORRENT_DIR, TRACKER_URLS
+
+# Read/hash files in chunks of this size
+CHUNK_SIZE = 1 << 16
+
+
+def bencode(obj):
+    """Encode ints, bytes, strings, lists and dicts as bencode."""
+    if isinstance(obj, bool):
+        obj = int(obj)
+    if isinstance(obj, int):
+        return b"i%de" % obj
+    if isinstance(obj, str):
+        obj = obj.encode()
+    if isinstance(obj, bytes):
+        return b"%d:%s" % (len(obj), obj)
+    if isinstance(obj, (list, tuple)):
+        return b"l" + b"".join(bencode(item) for item in obj) + b"e"
+    if isinstance(obj, dict):
+        items = sorted((k.encode() if isinstance(k, str) else k, v) for k, v in obj.items())
+        return b"d" + b"".join(bencode(k) + bencode(v) for k, v in items) + b"e"
+    raise TypeError(f"Cannot bencode {type(obj).__name__}")
+
+
+def bdecode(data):
+    """Decode a bencoded byte string; strings are returned as bytes."""
+    def decode(i):
+        c = data[i:i + 1]
+        if c == b"i":
+            end = data.index(b"e", i)
+            return int(data[i + 1:end]), end + 1
+        if c == b"l":
+            i, items = i + 1, []
+            while data[i:i + 1] != b"e":
+                item, i = decode(i)
+                items.append(item)
+            return items, i + 1
+        if c == b"d":
+            i, items = i + 1, {}
+            while data[i:i + 1] != b"e":
+                key, i = decode(i)
+                items[key], i = decode(i)
+            return items, i + 1
+        if c.isdigit():
+            colon = data.index(b":", i)
+            start = colon + 1
+            end = start + int(data[i:colon])
+            return data[start:end], end
+        raise ValueError(f"Invalid bencode at offset {i}")
+
+    value, end = decode(0)
+    if end != len(data):
+        raise ValueError("Trailing data after bencoded value")
+    return value
+
+
+def piece_length_for(size):
+    """Pick a power-of-two piece length giving roughly 1000 pieces, at least 16 KiB."""
+    length = 1 << 14
+    while size // length > 1024:
+        length <<= 1
+    return length
+
+
+class PieceHasher:
+    """Incrementally compute the SHA-1 piece hashes of a single-file torrent."""
+
+    def __init__(self, piece_length):
+        self.piece_length = piece_length
+        self.length = 0
+        self._pieces = []
+        self._piece = hashlib.sha1()
+        self._piece_fill = 0
+
+    def update(self, data):
+        view = memoryview(data)
+        self.length += len(view)
+        while view:
+            take = min(len(view), self.piece_length - self._piece_fill)
+            self._piece.update(view[:take])
+            self._piece_fill += take
+            view = view[take:]
+            if self._piece_fill == self.piece_length:
+                self._pieces.append(self._piece.digest())
+                self._piece = hashlib.sha1()
+                self._piece_fill = 0
+
+    def pieces(self):
+        """Return the concatenated piece hashes, including the final short piece."""
+        pieces = list(self._pieces)
+        if self._piece_fill:
+            pieces.append(self._piece.digest())
+        return b"".join(pieces)
+
+
+def hash_file(file_path, piece_length=None):
+    """Hash a file on disk and return the filled PieceHasher."""
+    hasher = PieceHasher(piece_length or piece_length_for(os.path.getsize(file_path)))
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            hasher.update(chunk)
+    return hasher
+
+
+def magnet_uri(info_hash, name, announce):
+    """Build a magnet link the browser WebTorrent client can join."""
+    params = [f"xt=urn:btih:{info_hash}", f"dn={quote(name)}"]
+    params += [f"tr={quote(tracker, safe='')}" for tracker in announce]
+    return "magnet:?" + "&".join(params)
+
+
+def write_torrent(info, announce=None):
+    """Wrap an info dict in .torrent metadata and write it to TORRENT_DIR.
+
+    Returns a dict with info_hash, magnet_url and torrent_path.
+    """
+    announce = announce or TRACKER_URLS
+    name = info["name"]
+    info_hash = hashlib.sha1(bencode(info)).hexdigest()
+    meta = {
+        "announce": announce[0],
+        "announce-list": [[tracker] for tracker in announce],
+        "created by": "gremlin.codes",
+        "creation date": int(time.time()),
+        "info": info,
+    }
+
+    os.makedirs(TORRENT_DIR, exist_ok=True)
+    torrent_path = os.path.abspath(os.path.join(TORRENT_DIR, f"{info_hash}.torrent"))
+    tmp_path = f"{torrent_path}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(bencode(meta))
+    os.replace(tmp_path, torrent_path)
+
+    return {
+        "info_hash": info_hash,
+        "magnet_url": magnet_uri(info_hash, name, announce),
+        "torrent_path": torrent_path,
+    }
+
+
+def build_torrent(name, hasher, announce=None):
+    """Build the .torrent for a hashed file; see write_torrent."""
+    return write_torrent({
+        "length": hasher.length,
+        "name": name,
+        "piece length": hasher.piece_length,
+        "pieces": hasher.pieces(),
+    }, announce)
+
+
+def build_multi_torrent(name, paths, announce=None):
+    """Hash files into one multi-file torrent, stored as <name>/<basename>; see write_torrent."""
+    sizes = [os.path.getsize(path) for path in paths]
+    hasher = PieceHasher(piece_length_for(sum(sizes)))
+    files = []
+    for path, size in zip(paths, sizes):
+        with open(path, "rb") as f:
+            # Stop at the size we recorded, in case the file grew meanwhile
+            remaining = size
+            while remaining:
+                chunk = f.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise OSError(f"{path} shrank while it was being hashed")
+                hasher.update(chunk)
+                remaining -= len(chunk)
+        files.append({"length": size, "path": [os.path.basename(path)]})
+    return write_torrent({
+        "files": files,
+        "name": name,
+        "piece length": hasher.piece_length,
+        "pieces": hasher.pieces(),
+    }, announce)
+
+
+def create_torrent(file_path, announce=None):
+    """Hash a file in-process and build its torrent; see build_torrent."""
+    return build_torrent(os.path.basename(file_path), hash_file(file_path), announce)
@@ -0,0 +1,122 @@
+import os
+import hashlib
+import logging
+import tempfile
+from werkzeug.http import parse_options_header
+from werkzeug.sansio.multipart import MultipartDecoder, Data, Epilogue, Field, File, NeedData
+from werkzeug.utils import secure_filename
+from shared import allowed_file
+from torrent import PieceHasher, piece_length_for, hash_file, CHUNK_SIZE
+
+
+class UploadError(Exception):
+    """An upload was rejected; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+class UploadWriter:
+    """Write an upload to a temporary file in dest_dir while hashing it."""
+
+    def __init__(self, dest_dir, filename, piece_length, max_size):
+        self.dest_dir = dest_dir
+        self.filename = filename
+        self.max_size = max_size
+        self.hasher = PieceHasher(piece_length)
+        self.sha256 = hashlib.sha256()
+        fd, self.tmp_path = tempfile.mkstemp(prefix=".upload-", dir=dest_dir)
+        self._file = os.fdopen(fd, "wb")
+
+    def write(self, data):
+        if self.hasher.length + len(data) > self.max_size:
+            raise UploadError(f"File exceeds the {self.max_size} byte limit", 413)
+        self._file.write(data)
+        self.hasher.update(data)
+        self.sha256.update(data)
+
+    def close(self):
+        self._file.close()
+
+    def discard(self):
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+
+def receive_upload(request, dest_dir, max_size, field_name="file"):
+    """Stream a multipart upload to dest_dir in one pass.
+
+    The request body is read in chunks straight off the socket; each chunk is
+    written to disk, fed to the torrent piece hasher and to a SHA-256 content
+    hash, and counted against max_size. Nothing is staged by Werkzeug, and the
+    file is only read back when the body length was a poor guess of the file
+    length (the torrent's piece length depends on the file length).
+
+    Returns a dict with the client's (secured) filename, the temporary path
+    the body was written to, its sha256 and the filled PieceHasher. The caller
+    renames the temporary file into place or removes it.
+    """
+    if request.content_length is not None and request.content_length > max_size + 64 * 1024:
+        raise UploadError(f"File exceeds the {max_size} byte limit", 413)
+
+    mimetype, options = parse_options_header(request.headers.get("Content-Type", ""))
+    boundary = options.get("boundary")
+    if mimetype != "multipart/form-data" or not boundary:
+        raise UploadError("No file provided")
+
+    # The body length bounds the file length, which is usually enough to pick the piece size
+    piece_length = piece_length_for(min(request.content_length or max_size, max_size))
+    decoder = MultipartDecoder(boundary.encode())
+    stream = request.stream
+    writer = None
+    current = None
+    done = None
+    received = False
+
+    try:
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, (Epilogue, NeedData)):
+                if isinstance(event, (Field, File)):
+                    current = event
+                    if isinstance(event, File) and event.name == field_name and done is None:
+                        if event.filename == '':
+                            raise UploadError("No selected file")
+                        if not allowed_file(event.filename):
+                            raise UploadError("Invalid file type")
+                        writer = UploadWriter(dest_dir, secure_filename(event.filename), piece_length, max_size)
+                elif isinstance(event, Data) and writer is not None and current.name == field_name:
+                    writer.write(event.data)
+                    if not event.more_data:
+                        done, writer = writer, None
+                event = decoder.next_event()
+            if not chunk or isinstance(event, Epilogue):
+                break
+
+        if done is None:
+            raise UploadError("No file provided")
+        done.close()
+        if done.hasher.piece_length != piece_length_for(done.hasher.length):
+            # The body was much longer than the file (chunked upload, other fields): hash it
+            # again at the piece length hash_file picks, so a later re-hash finds the same torrent
+            done.hasher = hash_file(done.tmp_path)
+        received = True
+    except ValueError as e:
+        raise UploadError(f"Malformed upload: {e}")
+    finally:
+        # Whatever went wrong (bad upload, disk error, client gone), leave no temporary file behind
+        for partial in (writer, None if received else done):
+            if partial is not None:
+                partial.discard()
+
+    logging.info(f"Received {done.hasher.length} bytes of {done.filename}")
+    return {
+        "filename": done.filename,
+        "path": done.tmp_path,
+        "sha256": done.sha256.hexdigest(),
+        "hasher": done.hasher,
+    }
@@ -0,0 +1,163 @@
+import os
+import time
+import struct
+import select
+import logging
+import threading
+import ctypes
+import ctypes.util
+
+# inotify(7) constants
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+EVENT = struct.Struct("iIII")  # wd, mask, cookie, len; followed by len bytes of name
+
+
+def load_inotify():
+    """Return libc if it provides inotify, else None."""
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        for name in ("inotify_init1", "inotify_add_watch", "inotify_rm_watch"):
+            getattr(libc, name)
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+class DirectoryWatcher:
+    """Report files that are finished in any number of directories, from one thread.
+
+    A file is finished when it is closed after writing or renamed into the
+    directory (ffmpeg's temp_file flag and playlist updates do the latter).
+    Files deleted or renamed away are reported to the optional on_delete
+    callback. Uses inotify where available and otherwise polls modification times every
+    poll_interval seconds. Callbacks run on the watcher thread and should
+    return quickly. Names ending in .tmp are ignored.
+    """
+
+    def __init__(self, poll_interval=1):
+        self.poll_interval = poll_interval
+        self.callbacks = {}  # directory -> (callback(path), on_delete(path) or None)
+        self._wds = {}  # inotify watch descriptor -> directory
+        self._mtimes = {}  # directory -> {name: mtime_ns}, polling only
+        self._lock = threading.Lock()
+        self._thread = None
+
+        self._libc = load_inotify()
+        self._fd = -1
+        if self._libc is not None:
+            self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if self._fd < 0:
+                logging.warning(f"inotify unavailable ({os.strerror(ctypes.get_errno())}), polling instead")
+        else:
+            logging.warning("inotify unavailable, polling instead")
+
+    @property
+    def polling(self):
+        return self._fd < 0
+
+    def watch(self, directory, callback, on_delete=None):
+        """Call callback(path) for every file finished in directory from now on."""
+        directory = os.path.abspath(directory)
+        with self._lock:
+            self.callbacks[directory] = (callback, on_delete)
+            if self.polling:
+                self._mtimes[directory] = self._scan(directory)
+            else:
+                wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory),
+                                                  IN_CLOSE_WRITE | IN_MOVED_TO | IN_DELETE | IN_MOVED_FROM | IN_ONLYDIR)
+                if wd < 0:
+                    del self.callbacks[directory]
+                    raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()), directory)
+                self._wds[wd] = directory
+            if self._thread is None:
+                self._thread = threading.Thread(target=self.run, daemon=True)
+                self._thread.start()
+
+    def unwatch(self, directory):
+        directory = os.path.abspath(directory)
+        with self._lock:
+            self.callbacks.pop(directory, None)
+            self._mtimes.pop(directory, None)
+            for wd, watched in list(self._wds.items()):
+                if watched == directory:
+                    del self._wds[wd]
+                    self._libc.inotify_rm_watch(self._fd, wd)
+
+    def _dispatch(self, directory, name, deleted=False):
+        if name.endswith(".tmp"):
+            return
+        callbacks = self.callbacks.get(directory)
+        callback = callbacks and callbacks[1 if deleted else 0]
+        if callback is None:
+            return
+        try:
+            callback(os.path.join(directory, name))
+        except Exception as e:
+            logging.error(f"Error handling {name} in {directory}: {e}")
+
+    # inotify
+
+    def _read_events(self):
+        try:
+            buf = os.read(self._fd, 65536)
+        except BlockingIOError:
+            return
+        offset = 0
+        while offset < len(buf):
+            wd, mask, _, length = EVENT.unpack_from(buf, offset)
+            name = buf[offset + EVENT.size:offset + EVENT.size + length].rstrip(b"\0")
+            offset += EVENT.size + length
+
+            if mask & IN_Q_OVERFLOW:
+                logging.warning("inotify queue overflowed, some files may have been missed")
+                continue
+            with self._lock:
+                directory = self._wds.get(wd)
+                if mask & IN_IGNORED:
+                    # The directory was removed
+                    self._wds.pop(wd, None)
+                    continue
+            if directory is not None and name:
+                self._dispatch(directory, os.fsdecode(name), deleted=bool(mask & (IN_DELETE | IN_MOVED_FROM)))
+
+    # Polling fallback
+
+    @staticmethod
+    def _scan(directory):
+        try:
+            return {entry.name: entry.stat().st_mtime_ns for entry in os.scandir(directory) if entry.is_file()}
+        except OSError:
+            return {}
+
+    def _poll(self):
+        with self._lock:
+            directories = list(self._mtimes)
+        for directory in directories:
+            current = self._scan(directory)
+            with self._lock:
+                if directory not in self._mtimes:
+                    continue
+                previous, self._mtimes[directory] = self._mtimes[directory], current
+            for name, mtime in sorted(current.items()):
+                if previous.get(name) != mtime:
+                    self._dispatch(directory, name)
+            for name in sorted(previous.keys() - current.keys()):
+                self._dispatch(directory, name, deleted=True)
+
+    def run(self):
+        while True:
+            try:
+                if self.polling:
+                    self._poll()
+                    time.sleep(self.poll_interval)
+                elif select.select([self._fd], [], [], self.poll_interval)[0]:
+                    self._read_events()
+            except Exception as e:
+                logging.error(f"Directory watcher failed: {e}")